@@ -22,8 +22,32 @@ def get_backend_from_uri(uri):
     if uri.startswith('file://'):
         if uri.endswith('.txt'):
             return todotxt
+        if uri.lower().endswith('.ics'):
+            return caldav
 
         path = uri[7:]
         if os.path.isdir(path):
             return caldav
     return markdown
+
+def get_local_path(uri):
+    """
+    Returns the file system path of a source URI, or None if it's remote.
+
+    >>> get_local_path('demos/markdown/markdown.md')
+    'demos/markdown/markdown.md'
+    >>> get_local_path('file:///tmp/todo.txt')
+    '/tmp/todo.txt'
+    >>> get_local_path('https://github.com/ranger/ranger') is None
+    True
+    """
+    if '://' not in uri:
+        return uri
+    if uri.startswith('file://'):
+        return uri[7:]
+    return None
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
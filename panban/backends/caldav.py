@@ -1,8 +1,15 @@
+import base64
+import concurrent.futures
 import datetime
+import http.client
+import json
+import netrc
 import os.path
 import subprocess
 import sys
+import urllib.parse
 import uuid
+import xml.etree.ElementTree as ET
 import panban.api
 from panban.json_api import exceptions
 from panban.json_api.eternal import PortableResponse, PortableNode, DEFAULT_PRIO
@@ -22,6 +29,9 @@ COL_ID_DONE = 3
 
 SHOW_COMPLETED_ITEMS_FOR_DAYS = 14
 
+# Upper bound for the number of files that are written/deleted in parallel
+MAX_WRITE_WORKERS = 8
+
 CATEGORY_PREFIX = '__category_'
 ROOT_CATEGORY = '__all'
 
@@ -37,9 +47,28 @@ VTODO_PRIO_MAP = {
 }
 VTODO_PRIO_MAP_REVERSE = dict((val, key) for (key, val) in VTODO_PRIO_MAP.items())
 
-ISO_DATE = '%Y-%m-%d'
+# If this file exists in the vdir, the "sync" command uses the built-in CalDAV
+# client instead of vdirsyncer.  It's a JSON dict with the key "url" pointing
+# to the calendar collection, and optionally "username" and "password".
+# Without credentials in this file, they are looked up in ~/.netrc.
+NATIVE_SYNC_CONFIG = '.panban-caldav.json'
+NATIVE_SYNC_STATE = '.panban-caldav-state.json'
+HTTP_TIMEOUT = 30
+MULTIGET_BATCH_SIZE = 100
+
+NS_DAV = 'DAV:'
+NS_CALDAV = 'urn:ietf:params:xml:ns:caldav'
+NS_CALSERVER = 'http://calendarserver.org/ns/'
+
 TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
 
+
+def _to_date(value):
+    # DUE and COMPLETED may be either dates or datetimes
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
 class Handler(panban.api.Handler):
     def response(self, data=None, status=None):
         if status is None:
@@ -49,6 +78,7 @@ class Handler(panban.api.Handler):
             version=self.json_api.VERSION,
             status=status,
             data=data,
+            features=['incremental_reload', 'sync', 'lazy_boards', 'rebucket'],
         )
         return response
 
@@ -56,6 +86,120 @@ class Handler(panban.api.Handler):
         self.load_data(query.source)
         return self.response(self.nodes_by_id)
 
+    def cmd_sync(self, query):
+        # NOTE: This may run in a background thread of the frontend, so it
+        # must not touch the loaded data.  The frontend applies the changes
+        # afterwards with the "reload_paths" command.
+        before = self._fingerprint(query.source)
+        config_path = os.path.join(query.source, NATIVE_SYNC_CONFIG)
+        if os.path.exists(config_path):
+            with open(config_path, 'r') as f:
+                config = json.load(f)
+            sync_vdir(query.source, config)
+        else:
+            process = subprocess.run(['vdirsyncer', 'sync'],
+                    stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT)
+            if process.returncode != 0:
+                output = process.stdout.decode('utf-8', 'replace').strip()
+                last_line = output.split('\n')[-1] if output else ''
+                raise Exception('vdirsyncer failed: %s' % last_line)
+        after = self._fingerprint(query.source)
+
+        changed_paths = sorted(path for path in set(before) | set(after)
+                if before.get(path) != after.get(path))
+        return self.response({'changed_paths': changed_paths})
+
+    def cmd_reloadpaths(self, query):
+        if getattr(self, 'basedir', None) != query.source:
+            self.load_data(query.source)
+            return self.response({'nodes': self.nodes_by_id, 'deleted_ids': []})
+
+        old_boards = self._board_children()
+        removed = set()
+        loaded = set()
+        for path in query.arguments['paths']:
+            if not path.lower().endswith('.ics'):
+                continue
+            removed.update(self._unload_calendar_file(path))
+            if os.path.exists(path):
+                loaded.update(self._load_calendar_file(path))
+
+        return self._delta_response(old_boards, removed, loaded)
+
+    def cmd_rebucket(self, query):
+        if getattr(self, 'basedir', None) != query.source:
+            self.load_data(query.source)
+            return self.response({'nodes': self.nodes_by_id, 'deleted_ids': []})
+
+        self.today = datetime.date.today()
+        old_boards = self._board_children()
+        removed = set()
+        loaded = set()
+        for change_date in sorted(self.uids_by_change_date):
+            if change_date > self.today:
+                break
+            for uid in self.uids_by_change_date.pop(change_date):
+                # Place the item again, without touching its file
+                path = self.node_id_to_path[uid]
+                vtodo = self.vtodos_by_id[uid]
+                span = self.span_by_uid[uid]
+                self._unload_vtodo(uid)
+                self.node_ids_by_path[path].remove(uid)
+                removed.add(uid)
+                if self._load_vtodo(path, uid, vtodo, span) is not None:
+                    loaded.add(uid)
+
+        return self._delta_response(old_boards, removed, loaded)
+
+    def _delta_response(self, old_boards, removed, loaded):
+        changed_nodes = dict((uid, self.nodes_by_id[uid]) for uid in loaded)
+        new_boards = self._board_children()
+        for node_id, children in new_boards.items():
+            if old_boards.get(node_id) != children:
+                changed_nodes[node_id] = self.nodes_by_id[node_id]
+        deleted_ids = removed - loaded
+        deleted_ids.update(set(old_boards) - set(new_boards))
+
+        return self.response({
+            'nodes': changed_nodes,
+            'deleted_ids': list(deleted_ids),
+        })
+
+    def cmd_loadboard(self, query):
+        if getattr(self, 'basedir', None) != query.source:
+            self.load_data(query.source)
+
+        board_id = query.arguments['board_id']
+        for key, category_node in self.categories.items():
+            if category_node.id == board_id:
+                return self.response({'nodes': self._materialize_category(key)})
+        return self.response(status=PortableResponse.STATUS_FAIL)
+
+    def _board_children(self):
+        # Returns the children of all category and column nodes
+        result = {}
+        for category_node in self.categories.values():
+            result[category_node.id] = list(category_node.children)
+            for column_id in category_node.children:
+                result[column_id] = list(self.nodes_by_id[column_id].children)
+        return result
+
+    def _fingerprint(self, basedir):
+        """
+        Returns a dict mapping each .ics file in basedir to its mtime and size.
+        """
+        fingerprint = {}
+        if os.path.isfile(basedir):
+            stat = os.stat(basedir)
+            fingerprint[basedir] = (stat.st_mtime_ns, stat.st_size)
+            return fingerprint
+        for entry in os.scandir(basedir):
+            if entry.name.lower().endswith('.ics'):
+                stat = entry.stat()
+                fingerprint[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        return fingerprint
+
     def cmd_changelabel(self, query):
         self.load_data(query.source)
 
@@ -151,14 +295,21 @@ class Handler(panban.api.Handler):
         vtodo['created'] = icalendar.vDatetime(datetime.datetime.now())
         vtodo['uid'] = uid = str(uuid.uuid4())
 
-        path = os.path.join(self.basedir, '%s.ics' % uid)
-        if os.path.exists(path):
-            raise Exception('Path already exists: %s' % path)
+        if os.path.isdir(self.basedir):
+            path = os.path.join(self.basedir, '%s.ics' % uid)
+            if os.path.exists(path):
+                raise Exception('Path already exists: %s' % path)
+        else:
+            path = self.basedir
 
         # Infer metadata from column
         column_id = query.arguments['target_column']
-        column = self.nodes_by_id[column_id]
+        column = self._get_column(column_id)
         tags = list(query.arguments.get('tags', []))
+        category_node = self.nodes_by_id[column.parent]
+        category_key = category_node.id[len(CATEGORY_PREFIX):]
+        if category_key != ROOT_CATEGORY and category_key not in tags:
+            tags.append(category_key)
         if column.label == COL_LABEL_TODO:
             vtodo['status'] = VTODO_STATUS_TODO
         elif column.label == COL_LABEL_NEXT:
@@ -173,64 +324,73 @@ class Handler(panban.api.Handler):
         if tags:
             vtodo['categories'] = icalendar.prop.vCategory(tags)
 
+        column_index = category_node.children.index(column_id)
+        root_column_id = self.categories[ROOT_CATEGORY].children[column_index]
         node = self.make_node(
             uid=uid,
             label=vtodo['summary'],
-            parent=column.parent,
+            parent=root_column_id,
+            tags=tags,
         )
 
         self.vtodos_by_id[uid] = vtodo
         self.node_id_to_path[uid] = path
+        self.node_ids_by_path.setdefault(path, []).append(uid)
+        self.span_by_uid[uid] = (0, 0)
         self.nodes_by_id[uid] = node
-        column.children.append(uid)
+        self.nodes_by_id[root_column_id].children.append(uid)
+        self._index_categories(uid, tags, column_index)
 
         self._write_vtodo(vtodo, create=True)
         return self.response()
 
     def cmd_deleteitems(self, query):
         self.load_data(query.source)
-        paths = []
-        for uid in query.arguments['item_ids']:
-            path = self.node_id_to_path[uid]
-            paths.append(path)
+        uids = dict.fromkeys(query.arguments['item_ids'])  # dedupe, keep order
 
-        for path in paths:
-            os.unlink(path)
+        def delete(uid):
+            if uid not in self.node_id_to_path:
+                raise ValueError('No such item: %s' % uid)
+            self._delete_vtodo(uid)
 
-        return self.response()
+        return self._item_results_response(self._run_per_file(delete, uids))
 
     def cmd_moveitemstocolumn(self, query):
         import icalendar
         ids = query.arguments['item_ids']
-        dirty = []
+        dirty = set()
 
         # Check whether we need to do any changes
-        for uid in query.arguments['item_ids']:
-            vtodo = self.vtodos_by_id[uid]
+        for uid in ids:
+            vtodo = self.vtodos_by_id.get(uid)
+            if vtodo is None:
+                # Unknown to our cache, let the reload below sort it out
+                dirty.add(uid)
+                continue
             tags = self._extract_tags(vtodo)
 
             if query.arguments['target_column'].endswith(COL_DONE):
                 if str(vtodo.get('status', '')) != VTODO_STATUS_DONE:
-                    dirty.append(vtodo)
+                    dirty.add(uid)
             elif query.arguments['target_column'].endswith(COL_TODAY):
                 if not self._is_due_today(vtodo):
-                    dirty.append(vtodo)
+                    dirty.add(uid)
                 if str(vtodo.get('status', '')) != VTODO_STATUS_TODO:
-                    dirty.append(vtodo)
+                    dirty.add(uid)
             elif query.arguments['target_column'].endswith(COL_NEXT):
                 if self._is_due_today(vtodo):
-                    dirty.append(vtodo)
+                    dirty.add(uid)
                 if str(vtodo.get('status', '')) != VTODO_STATUS_TODO:
-                    dirty.append(vtodo)
+                    dirty.add(uid)
                 if 'next' not in tags:
-                    dirty.append(vtodo)
+                    dirty.add(uid)
             else:
                 if self._is_due_today(vtodo):
-                    dirty.append(vtodo)
+                    dirty.add(uid)
                 if str(vtodo.get('status', '')) != VTODO_STATUS_TODO:
-                    dirty.append(vtodo)
+                    dirty.add(uid)
                 if 'next' in tags:
-                    dirty.append(vtodo)
+                    dirty.add(uid)
 
         if not dirty:
             # Nothing to do.
@@ -238,11 +398,15 @@ class Handler(panban.api.Handler):
 
         # Reload data in case of changes since last reload
         self.load_data(query.source)
-        dirty = []
+        dirty = {}  # uid -> vtodo, so that each file is written only once
+        results = {}
 
         # Apply changes
         now = icalendar.vDatetime(datetime.datetime.now())
-        for uid in query.arguments['item_ids']:
+        for uid in ids:
+            if uid not in self.vtodos_by_id:
+                results[uid] = 'No such item: %s' % uid
+                continue
             vtodo = self.vtodos_by_id[uid]
             tags = self._extract_tags(vtodo)
 
@@ -253,7 +417,7 @@ class Handler(panban.api.Handler):
                 if str(vtodo.get('status', '')) != VTODO_STATUS_DONE:
                     vtodo['status'] = VTODO_STATUS_DONE
                     vtodo['completed'] = now
-                    if vtodo not in dirty: dirty.append(vtodo)
+                    dirty[uid] = vtodo
 
             elif query.arguments['target_column'].endswith(COL_TODAY):
                 # Requirements for it to show up in the "Active" column:
@@ -262,12 +426,12 @@ class Handler(panban.api.Handler):
                 # Make sure that these requirements are met:
                 if not self._is_due_today(vtodo):
                     vtodo['due'] = now
-                    if vtodo not in dirty: dirty.append(vtodo)
+                    dirty[uid] = vtodo
                 if str(vtodo.get('status', '')) != VTODO_STATUS_TODO:
                     vtodo['status'] = VTODO_STATUS_TODO
                     if 'completed' in vtodo:
                         del vtodo['completed']
-                    if vtodo not in dirty: dirty.append(vtodo)
+                    dirty[uid] = vtodo
 
             elif query.arguments['target_column'].endswith(COL_NEXT):
                 # Requirements for it to show up in the "Next" column:
@@ -277,16 +441,16 @@ class Handler(panban.api.Handler):
                 # Make sure that these requirements are met:
                 if self._is_due_today(vtodo):
                     del vtodo['due']
-                    if vtodo not in dirty: dirty.append(vtodo)
+                    dirty[uid] = vtodo
                 if str(vtodo.get('status', '')) != VTODO_STATUS_TODO:
                     vtodo['status'] = VTODO_STATUS_TODO
                     if 'completed' in vtodo:
                         del vtodo['completed']
-                    if vtodo not in dirty: dirty.append(vtodo)
+                    dirty[uid] = vtodo
                 if TAG_NEXT not in tags:
                     tags.append(TAG_NEXT)
                     vtodo['categories'] = icalendar.prop.vCategory(tags)
-                    if vtodo not in dirty: dirty.append(vtodo)
+                    dirty[uid] = vtodo
             else:
                 # Requirements for it to show up in the "Todo" column:
                 # - No due date or due date later than tomorrow
@@ -295,24 +459,65 @@ class Handler(panban.api.Handler):
                 # Make sure that these requirements are met:
                 if self._is_due_today(vtodo):
                     del vtodo['due']
-                    if vtodo not in dirty: dirty.append(vtodo)
+                    dirty[uid] = vtodo
                 if str(vtodo.get('status', '')) != VTODO_STATUS_TODO:
                     vtodo['status'] = VTODO_STATUS_TODO
                     if 'completed' in vtodo:
                         del vtodo['completed']
-                    if vtodo not in dirty: dirty.append(vtodo)
+                    dirty[uid] = vtodo
                 if TAG_NEXT in tags:
                     tags.remove(TAG_NEXT)
                     if len(tags) == 0:
                         del vtodo['categories']
                     else:
                         vtodo['categories'] = icalendar.prop.vCategory(tags)
-                    if vtodo not in dirty: dirty.append(vtodo)
-
-        for vtodo in dirty:
-            self._write_vtodo(vtodo)
+                    dirty[uid] = vtodo
+
+        results.update(self._run_per_file(
+            lambda uid: self._write_vtodo(dirty[uid]), dirty))
+        for uid in ids:
+            results.setdefault(uid, self.json_api.ITEM_RESULT_OK)
+
+        return self._item_results_response(results)
+
+    def _run_per_item(self, function, uids):
+        """
+        Calls function(uid) for every uid on a bounded pool of threads.
+
+        Returns a dict that maps each uid to ITEM_RESULT_OK or to an error
+        message, so that one failing file doesn't abort the whole batch.
+
+        >>> h = Handler(json_api='1')
+        >>> def check(uid):
+        ...     if uid == 'bad':
+        ...         raise OSError('Permission denied')
+        >>> sorted(h._run_per_item(check, ['good', 'bad']).items())
+        [('bad', 'Permission denied'), ('good', 'ok')]
+        """
+        results = {}
+        if not uids:
+            return results
+
+        workers = min(MAX_WRITE_WORKERS, len(uids))
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            futures = dict((executor.submit(function, uid), uid) for uid in uids)
+            for future in concurrent.futures.as_completed(futures):
+                uid = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    results[uid] = str(e) or type(e).__name__
+                else:
+                    results[uid] = self.json_api.ITEM_RESULT_OK
+        return results
 
-        return self.response()
+    def _item_results_response(self, results):
+        if all(result == self.json_api.ITEM_RESULT_OK
+                for result in results.values()):
+            status = PortableResponse.STATUS_OK
+        else:
+            status = PortableResponse.STATUS_FAIL
+        return self.response({'item_results': results}, status=status)
 
     def load_data(self, basedir):
         if not os.path.exists(basedir):
@@ -320,157 +525,313 @@ class Handler(panban.api.Handler):
 
         import icalendar
 
-        ics_files = [filename for filename in os.listdir(basedir) \
-                if filename.lower().endswith('.ics')]
+        if os.path.isdir(basedir):
+            ics_files = [os.path.join(basedir, filename)
+                    for filename in os.listdir(basedir)
+                    if filename.lower().endswith('.ics')]
+        else:
+            # A single calendar file with many items
+            ics_files = [basedir]
 
         self.basedir = basedir
         self.nodes_by_id = {}
         self.vtodos_by_id = {}
         self.node_id_to_path = {}
+        self.node_ids_by_path = {}
+        self.span_by_uid = {}  # uid -> (start, end) byte range in its file
         self.categories = {}
+        self.uids_by_category = {}  # category -> dict of uids (ordered set)
+        self.column_index_by_uid = {}
+        self.uids_by_change_date = {}  # date -> set of uids to be re-placed
+        self.change_date_by_uid = {}
+        self.today = datetime.date.today()
 
-        def add_category(label, key=None, prio=0):
-            # use "key" for internal categories where key != label, e.g. "__all"
-            if key is None:
-                key = label
-
-            category_uid = CATEGORY_PREFIX + key
-            category_node = self.make_node(
-                uid=category_uid,
+        # First of all, add a category that every node will belong to
+        source_label = os.path.basename(basedir)
+        if not os.path.isdir(basedir):
+            source_label = os.path.splitext(source_label)[0]
+        self._add_category(source_label, ROOT_CATEGORY, DEFAULT_PRIO)
+        self._materialize_category(ROOT_CATEGORY)
+
+        # Then add a node for every VTODO item, along with extra categories
+        for path in ics_files:
+            self._load_calendar_file(path)
+
+    def _add_category(self, label, key=None, prio=0):
+        # use "key" for internal categories where key != label, e.g. "__all"
+        if key is None:
+            key = label
+
+        category_uid = CATEGORY_PREFIX + key
+        category_node = self.make_node(
+            uid=category_uid,
+            label=label,
+            parent=None,
+            prio=prio,
+        )
+        self.nodes_by_id[category_node.id] = category_node
+        self.categories[key] = category_node
+        return category_node
+
+    def _materialize_category(self, key):
+        """
+        Creates the columns of a category board and fills them with the items
+        of that category, as found in the category index.
+
+        Boards of categories other than ROOT_CATEGORY are only materialized
+        when the frontend opens them, to keep the "load_all" response small.
+        Their columns reference the same nodes as the columns of the board
+        ROOT_CATEGORY, and the nodes' parents remain the latter columns.
+
+        Returns a dict of the nodes that make up the board.
+        """
+        category_node = self.categories[key]
+        category_uid = category_node.id
+        board = {category_uid: category_node}
+        if category_node.children:
+            for column_id in category_node.children:
+                board[column_id] = self.nodes_by_id[column_id]
+            return board
+
+        columns = (
+            (COL_TODO, COL_LABEL_TODO, 0),
+            (COL_NEXT, COL_LABEL_NEXT, 0),
+            (COL_TODAY, COL_LABEL_TODAY, 0),
+            (COL_DONE, COL_LABEL_DONE, 1),
+        )
+        for suffix, label, pos in columns:
+            column = self.make_node(
+                uid=category_uid + suffix,
                 label=label,
-                parent=None,
-                prio=prio,
-            )
-            self.nodes_by_id[category_node.id] = category_node
-
-            column_todo = self.make_node(
-                uid=category_uid + COL_TODO,
-                label=COL_LABEL_TODO,
-                parent=category_uid,
-                pos=0,
-            )
-            self.nodes_by_id[column_todo.id] = column_todo
-            category_node.children.append(column_todo.id)
-
-            column_next = self.make_node(
-                uid=category_uid + COL_NEXT,
-                label=COL_LABEL_NEXT,
-                parent=category_uid,
-                pos=0,
-            )
-            self.nodes_by_id[column_next.id] = column_next
-            category_node.children.append(column_next.id)
-
-            column_today = self.make_node(
-                uid=category_uid + COL_TODAY,
-                label=COL_LABEL_TODAY,
-                parent=category_uid,
-                pos=0,
-            )
-            self.nodes_by_id[column_today.id] = column_today
-            category_node.children.append(column_today.id)
-
-            column_done = self.make_node(
-                uid=category_uid + COL_DONE,
-                label=COL_LABEL_DONE,
                 parent=category_uid,
-                pos=1,
+                pos=pos,
             )
-            self.nodes_by_id[column_done.id] = column_done
-            category_node.children.append(column_done.id)
+            self.nodes_by_id[column.id] = column
+            category_node.children.append(column.id)
+            board[column.id] = column
+
+        for uid in self.uids_by_category.get(key, ()):
+            column_id = category_node.children[self.column_index_by_uid[uid]]
+            self.nodes_by_id[column_id].children.append(uid)
+        return board
+
+    def _get_column(self, column_id):
+        if column_id not in self.nodes_by_id:
+            for key, category_node in self.categories.items():
+                if column_id.startswith(category_node.id + '__'):
+                    self._materialize_category(key)
+                    break
+        return self.nodes_by_id[column_id]
+
+    def _load_calendar_file(self, path):
+        """
+        Adds the VTODO items stored in the given file to the loaded data.
+
+        Returns a list of the UIDs of the new nodes.
+        """
+        uids = []
+        for uid, vtodo, span in self._extract_vtodos(path):
+            if self._load_vtodo(path, uid, vtodo, span) is not None:
+                uids.append(uid)
+        return uids
+
+    def _load_vtodo(self, path, uid, vtodo, span):
+        """
+        Adds a VTODO item to the loaded data.
+
+        Returns the UID of the new node, or None if the item is hidden.
+        """
+        column_index, change_date = self._place_vtodo(vtodo)
+        if column_index is None:
+            return None
 
-            self.categories[key] = category_node
+        if 'categories' in vtodo:
+            categories_internal = vtodo['categories']
+            categories = [str(cat) for cat in categories_internal.cats]
+        else:
+            categories = []
 
-        # First of all, add a category that every node will belong to
-        source_label = os.path.basename(basedir)
-        add_category(source_label, ROOT_CATEGORY, DEFAULT_PRIO)
-
-        # Then add a node for every ICS file in the directory, along with extra categories
-        for filename in ics_files:
-            path = os.path.join(basedir, filename)
-            uid, vtodo = self._extract_vtodo(path)
-            status = str(vtodo.get('status', None))
-            if 'due' in vtodo:
-                due_date = vtodo['due'].dt.strftime(ISO_DATE)
-                today = datetime.date.today().strftime(ISO_DATE)
-            else:
-                due_date = None
-
-            if status == VTODO_STATUS_DONE:
-                column_index = COL_ID_DONE
-
-                # Hide completed items that are older than N days
-                if 'completed' in vtodo:
-                    completed_day = vtodo['completed'].dt.strftime(ISO_DATE)
-                    cutoff_day = datetime.date.today() - datetime.timedelta(SHOW_COMPLETED_ITEMS_FOR_DAYS)
-                    if completed_day < cutoff_day.strftime(ISO_DATE):
-                        continue
-            elif self._is_due_today(vtodo):
-                column_index = COL_ID_TODAY
-            elif TAG_NEXT in self._extract_tags(vtodo):
-                column_index = COL_ID_NEXT
-            else:
-                column_index = COL_ID_TODO
+        if 'created' in vtodo:
+            creation_date = vtodo['created'].dt.strftime(TIME_FORMAT)
+        else:
+            creation_date = None
+        if 'completed' in vtodo:
+            completion_date = vtodo['completed'].dt.strftime(TIME_FORMAT)
+        else:
+            completion_date = None
 
-            if 'categories' in vtodo:
-                categories_internal = vtodo['categories']
-                categories = [str(cat) for cat in categories_internal.cats]
-            else:
-                categories = []
+        if 'description' in vtodo:
+            description = str(vtodo['description'])
+        else:
+            description = None
 
-            if 'created' in vtodo:
-                creation_date = vtodo['created'].dt.strftime(TIME_FORMAT)
-            else:
-                creation_date = None
+        pnode = self.make_node(
+            uid=uid,
+            label=str(vtodo['summary']),
+            parent=self.categories[ROOT_CATEGORY].children[column_index],
+            description=description,
+            prio=VTODO_PRIO_MAP_REVERSE[vtodo.get('priority', None)],
+            tags=categories,
+            creation_date=creation_date,
+            completion_date=completion_date,
+        )
+        self.nodes_by_id[uid] = pnode
+        self.vtodos_by_id[uid] = vtodo
+        self.node_id_to_path[uid] = path
+        self.node_ids_by_path.setdefault(path, []).append(uid)
+        self.span_by_uid[uid] = span
+
+        # Add the node to its category
+        category = self.categories[ROOT_CATEGORY]
+        column = self.nodes_by_id[category.children[column_index]]
+        column.children.append(pnode.id)
+
+        self._index_categories(uid, categories, column_index)
+        if change_date is not None:
+            self.uids_by_change_date.setdefault(change_date, set()).add(uid)
+            self.change_date_by_uid[uid] = change_date
+        return uid
+
+    def _place_vtodo(self, vtodo):
+        """
+        Determines the column of an item on the current day.
+
+        Returns a tuple (column_index, change_date), where column_index is
+        None if the item is hidden, and change_date is the day on which the
+        item will be placed differently, or None if that never happens.
+
+        >>> import icalendar
+        >>> h = Handler(json_api='1')
+        >>> h.today = datetime.date(2020, 5, 17)
+        >>> vtodo = icalendar.Todo()
+        >>> vtodo.add('due', datetime.datetime(2020, 5, 20, 12, 0))
+        >>> h._place_vtodo(vtodo)
+        (0, datetime.date(2020, 5, 20))
+        >>> h.today = datetime.date(2020, 5, 20)
+        >>> h._place_vtodo(vtodo)
+        (2, None)
+        >>> vtodo['status'] = VTODO_STATUS_DONE
+        >>> vtodo.add('completed', datetime.datetime(2020, 5, 10, 8, 0))
+        >>> h._place_vtodo(vtodo)
+        (3, datetime.date(2020, 5, 25))
+        >>> h.today = datetime.date(2020, 5, 25)
+        >>> h._place_vtodo(vtodo)
+        (None, None)
+        """
+        status = str(vtodo.get('status', None))
+        if status == VTODO_STATUS_DONE:
+            # Hide completed items that are older than N days
             if 'completed' in vtodo:
-                completion_date = vtodo['completed'].dt.strftime(TIME_FORMAT)
-            else:
-                completion_date = None
-
-            if 'description' in vtodo:
-                description = str(vtodo['description'])
-            else:
-                description = None
-
-            pnode = self.make_node(
-                uid=uid,
-                label=str(vtodo['summary']),
-                parent=self.categories[ROOT_CATEGORY].children[column_index],
-                description=description,
-                prio=VTODO_PRIO_MAP_REVERSE[vtodo.get('priority', None)],
-                tags=categories,
-                creation_date=creation_date,
-                completion_date=completion_date,
-            )
-            self.nodes_by_id[uid] = pnode
-            self.vtodos_by_id[uid] = vtodo
-            self.node_id_to_path[uid] = path
-
-            # Add the node to its category
-            category = self.categories[ROOT_CATEGORY]
-            column = self.nodes_by_id[category.children[column_index]]
-            column.children.append(pnode.id)
-
-    def _extract_vtodo(self, path):
-        import icalendar
-        with open(path, 'r') as f:
-            content = f.read()
-
-        # The root component of an .ics file is a VCALENDAR and
-        # typically the first subcomponent is the actual VTODO item.
-        # Let's extract that.
-        vcalendar = icalendar.Todo.from_ical(content)
-        if vcalendar.name == 'VTODO':
-            vtodo = vcalendar
+                hide_day = _to_date(vtodo['completed'].dt) + \
+                        datetime.timedelta(SHOW_COMPLETED_ITEMS_FOR_DAYS + 1)
+                if hide_day <= self.today:
+                    return None, None
+                return COL_ID_DONE, hide_day
+            return COL_ID_DONE, None
+
+        if 'due' in vtodo:
+            due_day = _to_date(vtodo['due'].dt)
+            if due_day <= self.today:
+                return COL_ID_TODAY, None
         else:
-            for component in vcalendar.subcomponents:
-                if component.name == 'VTODO':
-                    vtodo = component
-                    break
-            else:
-                return
-        uid = str(vtodo['uid'])
-        return uid, vtodo
+            due_day = None
+        if TAG_NEXT in self._extract_tags(vtodo):
+            return COL_ID_NEXT, due_day
+        return COL_ID_TODO, due_day
+
+    def _index_categories(self, uid, categories, column_index):
+        # Index the node by its categories, for the per-category boards
+        self.column_index_by_uid[uid] = column_index
+        for key in categories:
+            if key not in self.categories:
+                self._add_category(key)
+            self.uids_by_category.setdefault(key, {})[uid] = None
+            category_node = self.categories[key]
+            if category_node.children:  # The board is materialized
+                column_id = category_node.children[column_index]
+                self.nodes_by_id[column_id].children.append(uid)
+
+    def _unload_calendar_file(self, path):
+        """
+        Removes the nodes of the given file from the loaded data.
+
+        Returns a list of the UIDs of the removed nodes.
+        """
+        uids = self.node_ids_by_path.pop(path, [])
+        for uid in uids:
+            self._unload_vtodo(uid)
+        return uids
+
+    def _unload_vtodo(self, uid):
+        node = self.nodes_by_id.pop(uid, None)
+        if node is not None and node.parent in self.nodes_by_id:
+            column = self.nodes_by_id[node.parent]
+            while uid in column.children:
+                column.children.remove(uid)
+        self.vtodos_by_id.pop(uid, None)
+        self.node_id_to_path.pop(uid, None)
+        self.span_by_uid.pop(uid, None)
+        change_date = self.change_date_by_uid.pop(uid, None)
+        if change_date in self.uids_by_change_date:
+            self.uids_by_change_date[change_date].discard(uid)
+        column_index = self.column_index_by_uid.pop(uid, None)
+
+        for key in (node.tags if node is not None else ()):
+            uids = self.uids_by_category.get(key, {})
+            uids.pop(uid, None)
+            category_node = self.categories.get(key)
+            if category_node is None:
+                continue
+            if not uids:
+                # The last item of this category is gone, and so is its board
+                del self.uids_by_category[key]
+                del self.categories[key]
+                for node_id in [category_node.id] + category_node.children:
+                    del self.nodes_by_id[node_id]
+            elif category_node.children:
+                column = self.nodes_by_id[category_node.children[column_index]]
+                while uid in column.children:
+                    column.children.remove(uid)
+
+    def _extract_vtodos(self, path):
+        r"""
+        Parses the VTODO items of an .ics file one component at a time.
+
+        Yields a tuple (uid, vtodo, span) for each item, where span is the
+        (start, end) byte range of the component within the file.
+
+        >>> import tempfile
+        >>> calendar = tempfile.NamedTemporaryFile(suffix='.ics', delete=False)
+        >>> _ = calendar.write(b'BEGIN:VCALENDAR\r\n'
+        ...     b'BEGIN:VTODO\r\nUID:1\r\nSUMMARY:First\r\nEND:VTODO\r\n'
+        ...     b'BEGIN:VEVENT\r\nUID:2\r\nEND:VEVENT\r\n'
+        ...     b'BEGIN:VTODO\r\nUID:3\r\nSUMMARY:Third\r\nEND:VTODO\r\n'
+        ...     b'END:VCALENDAR\r\n')
+        >>> calendar.close()
+        >>> h = Handler(json_api='1')
+        >>> [(uid, str(vtodo['summary']), span)
+        ...     for uid, vtodo, span in h._extract_vtodos(calendar.name)]
+        [('1', 'First', (17, 63)), ('3', 'Third', (96, 142))]
+        """
+        import icalendar
+
+        with open(path, 'rb') as f:
+            offset = 0
+            start = None
+            lines = []
+            for line in f:
+                stripped = line.rstrip(b'\r\n').upper()
+                if stripped == b'BEGIN:VTODO':
+                    start = offset
+                    lines = []
+                if start is not None:
+                    lines.append(line)
+                offset += len(line)
+                if stripped == b'END:VTODO' and start is not None:
+                    vtodo = icalendar.Todo.from_ical(b''.join(lines))
+                    if 'uid' in vtodo:
+                        yield str(vtodo['uid']), vtodo, (start, offset)
+                    start = None
 
     def _extract_tags(self, vtodo):
         if 'categories' in vtodo:
@@ -485,41 +846,173 @@ class Handler(panban.api.Handler):
         uid = str(vtodo['uid'])
         path = self.node_id_to_path[uid]
 
-        if not create:
-            with open(path, 'r') as f:
-                content = f.read()
-
-            # We got the VTODO item as method argument, but the root
-            # component of an .ics file is a VCALENDAR.
-            # Let's extract that, and then swap out the old VTODO with
-            # the new one we got as method argument.
-            vcalendar = icalendar.Todo.from_ical(content)
-            if vcalendar.name == 'VTODO':
-                vcalendar = vtodo
-            else:
-                for i, component in enumerate(vcalendar.subcomponents):
-                    if component.name == 'VTODO':
-                        vcalendar.subcomponents[i] = vtodo
-                        break
-                else:
-                    vcalendar.subcomponents.append(vtodo)
-        else:
+        if create and not os.path.exists(path):
             vcalendar = icalendar.Calendar()
             vcalendar['version'] = '2.0'
             vcalendar['prodid'] = 'Panban'
             vcalendar.add_component(vtodo)
+            content = vcalendar.to_ical()
+            with open(path, 'wb') as f:
+                f.write(content)
+            start = content.index(b'BEGIN:VTODO')
+            end = content.index(b'END:VTODO') + len(b'END:VTODO\r\n')
+            self.span_by_uid[uid] = (start, end)
+            return
+
+        if create:
+            # Append the item to an existing calendar with many items
+            with open(path, 'rb') as f:
+                content = f.read()
+            start = end = content.upper().rfind(b'END:VCALENDAR')
+            if start < 0:
+                raise Exception('Not a calendar file: %s' % path)
+        else:
+            start, end = self.span_by_uid[uid]
+
+        # Replace only the bytes of this component instead of re-encoding
+        # the whole calendar
+        self._splice(path, start, end, vtodo.to_ical(), uid)
+
+    def _delete_vtodo(self, uid):
+        r"""
+        Removes an item from its file and from the loaded data.
+
+        >>> import tempfile
+        >>> from panban.controller import DatabaseAbstraction
+        >>> tomorrow = datetime.date.today() + datetime.timedelta(1)
+        >>> calendar = tempfile.NamedTemporaryFile(suffix='.ics', delete=False)
+        >>> _ = calendar.write(b'BEGIN:VCALENDAR\r\n'
+        ...     b'BEGIN:VTODO\r\nUID:1\r\nSUMMARY:First\r\n'
+        ...     b'DUE;VALUE=DATE:' + tomorrow.strftime('%Y%m%d').encode() +
+        ...     b'\r\nEND:VTODO\r\n'
+        ...     b'BEGIN:VTODO\r\nUID:2\r\nSUMMARY:Second\r\n'
+        ...     b'DUE;VALUE=DATE:' + tomorrow.strftime('%Y%m%d').encode() +
+        ...     b'\r\nEND:VTODO\r\n'
+        ...     b'END:VCALENDAR\r\n')
+        >>> calendar.close()
+        >>> h = Handler(json_api='1')
+        >>> db = DatabaseAbstraction(h, calendar.name)
+        >>> db.reload()
+        >>> db.find_nodes_by_label('First')[0].delete()
+        True
+        >>> '1' in h.nodes_by_id, h.uids_by_change_date == {tomorrow: {'2'}}
+        (False, True)
+
+        Pretend that the due day has come, then reload the file:
+
+        >>> h.uids_by_change_date[datetime.date.min] = \
+        ...     h.uids_by_change_date.pop(tomorrow)
+        >>> db.rebucket()
+        >>> db.reload_paths([calendar.name])
+        >>> sorted(node.label for node in db.nodes_by_id.values()
+        ...     if node.parent and node.parent not in db.root_node_ids)
+        ['Second']
+        """
+        path = self.node_id_to_path[uid]
+        if os.path.isdir(self.basedir):
+            with open(path, 'rb') as f:
+                # Hidden items aren't indexed, so count the items in the file
+                vtodo_count = f.read().upper().count(b'BEGIN:VTODO')
+        else:
+            vtodo_count = None  # Never remove the only calendar file
+        if vtodo_count == 1:
+            os.unlink(path)
+        else:
+            start, end = self.span_by_uid[uid]
+            self._splice(path, start, end, b'', uid)
+        self.node_ids_by_path[path].remove(uid)
+        self._unload_vtodo(uid)
+
+    def _splice(self, path, start, end, data, uid):
+        r"""
+        Replaces the bytes from start to end of the file with data.
+
+        Only the rest of the file after the replaced range is rewritten.
+        The byte ranges of the other items in the same file are updated.
+
+        >>> import tempfile
+        >>> calendar = tempfile.NamedTemporaryFile(suffix='.ics', delete=False)
+        >>> _ = calendar.write(b'BEGIN:VCALENDAR\n'
+        ...     b'BEGIN:VTODO\nUID:1\nSUMMARY:First\nEND:VTODO\n'
+        ...     b'BEGIN:VEVENT\nUID:2\nEND:VEVENT\n'
+        ...     b'BEGIN:VTODO\nUID:3\nSUMMARY:Third\nEND:VTODO\n'
+        ...     b'END:VCALENDAR\n')
+        >>> calendar.close()
+        >>> h = Handler(json_api='1')
+        >>> h.load_data(calendar.name)
+        >>> start, end = h.span_by_uid['1']
+        >>> h._splice(calendar.name, start, end,
+        ...     b'BEGIN:VTODO\r\nUID:1\r\nSUMMARY:Changed\r\nEND:VTODO\r\n', '1')
+        >>> print(open(calendar.name).read().strip())
+        BEGIN:VCALENDAR
+        BEGIN:VTODO
+        UID:1
+        SUMMARY:Changed
+        END:VTODO
+        BEGIN:VEVENT
+        UID:2
+        END:VEVENT
+        BEGIN:VTODO
+        UID:3
+        SUMMARY:Third
+        END:VTODO
+        END:VCALENDAR
+        >>> h.span_by_uid == dict((uid, span) for uid, vtodo, span
+        ...     in h._extract_vtodos(calendar.name))
+        True
+        """
+        with open(path, 'r+b') as f:
+            # Keep the line endings of the file
+            f.seek(max(0, start - 2))
+            sample = f.read(end - max(0, start - 2))
+            if sample and b'\r\n' not in sample:
+                data = data.replace(b'\r\n', b'\n')
+            f.seek(end)
+            tail = f.read()
+            f.seek(start)
+            f.write(data)
+            f.write(tail)
+            f.truncate()
+
+        shift = len(data) - (end - start)
+        for other in self.node_ids_by_path.get(path, []):
+            other_start, other_end = self.span_by_uid[other]
+            if other == uid:
+                self.span_by_uid[uid] = (start, start + len(data))
+            elif other_start >= end:
+                self.span_by_uid[other] = (other_start + shift, other_end + shift)
+
+    def _run_per_file(self, function, uids):
+        """
+        Like _run_per_item, but items stored in the same file are handled
+        one after another, back to front, by the same thread.
+        """
+        uids_by_path = {}
+        for uid in uids:
+            path = self.node_id_to_path.get(uid)
+            uids_by_path.setdefault(path, []).append(uid)
+
+        results = {}
+
+        def run(path):
+            group = uids_by_path[path]
+            group.sort(key=lambda uid: self.span_by_uid.get(uid, (0, 0)),
+                    reverse=True)
+            for uid in group:
+                try:
+                    function(uid)
+                except Exception as e:
+                    results[uid] = str(e) or type(e).__name__
+                else:
+                    results[uid] = self.json_api.ITEM_RESULT_OK
 
-        content = vcalendar.to_ical().decode('utf-8')
-
-        with open(path, 'w') as f:
-            f.write(content)
+        self._run_per_item(run, list(uids_by_path))
+        return results
 
     def _is_due_today(self, vtodo):
         if 'due' not in vtodo:
             return None
-        due_date = vtodo['due'].dt.strftime(ISO_DATE)
-        today = datetime.date.today().strftime(ISO_DATE)
-        return due_date <= today
+        return _to_date(vtodo['due'].dt) <= datetime.date.today()
 
     def make_node(self, uid, label, parent, description=None, pos=None, prio=0, tags=None, creation_date=None, completion_date=None):
         pnode = PortableNode()
@@ -553,13 +1046,409 @@ class Handler(panban.api.Handler):
         elif command == 'add_node':
             response = self.cmd_addnode(query)
         elif command == 'sync':
-            subprocess.check_call(['vdirsyncer', 'sync'])
-            response = self.response()
+            response = self.cmd_sync(query)
+        elif command == 'reload_paths':
+            response = self.cmd_reloadpaths(query)
+        elif command == 'load_board':
+            response = self.cmd_loadboard(query)
+        elif command == 'rebucket':
+            response = self.cmd_rebucket(query)
         else:
             raise exceptions.InvalidCommandError(command)
         return response.to_json()
 
 
+class CalDAVError(Exception):
+    def __init__(self, status, method, path):
+        self.status = status
+        super().__init__('%s %s failed with HTTP status %d'
+                % (method, path, status))
+
+
+class CalDAVClient(object):
+    """
+    A minimal CalDAV client for a single calendar collection.
+
+    All requests go through one persistent HTTP connection, which is
+    re-opened transparently if the server closed it in the meantime.
+    """
+
+    def __init__(self, url, username=None, password=None, timeout=HTTP_TIMEOUT):
+        parsed = urllib.parse.urlsplit(url)
+        self.scheme = parsed.scheme
+        self.netloc = parsed.netloc
+        self.path = parsed.path if parsed.path.endswith('/') else parsed.path + '/'
+        self.timeout = timeout
+        self.headers = {'User-Agent': 'panban'}
+        if username is None:
+            try:
+                credentials = netrc.netrc().authenticators(parsed.hostname)
+            except (OSError, netrc.NetrcParseError):
+                credentials = None
+            if credentials:
+                username, _, password = credentials
+        if username is not None:
+            token = '%s:%s' % (username, password or '')
+            self.headers['Authorization'] = 'Basic ' + \
+                    base64.b64encode(token.encode('utf-8')).decode('ascii')
+        self._connection = None
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def request(self, method, path, body=None, headers=None, expect=(200,)):
+        """
+        Returns a tuple (status, headers, body) of the response.
+
+        Raises CalDAVError if the status is not in "expect".
+        """
+        all_headers = dict(self.headers)
+        all_headers.update(headers or {})
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+
+        for attempt in (1, 2):
+            if self._connection is None:
+                if self.scheme == 'https':
+                    self._connection = http.client.HTTPSConnection(
+                            self.netloc, timeout=self.timeout)
+                else:
+                    self._connection = http.client.HTTPConnection(
+                            self.netloc, timeout=self.timeout)
+            try:
+                self._connection.request(method, path, body, all_headers)
+                response = self._connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError,
+                    BrokenPipeError):
+                # The server closed our idle keep-alive connection
+                self.close()
+                if attempt == 2:
+                    raise
+
+        if response.getheader('Connection', '').lower() == 'close':
+            self.close()
+        if response.status not in expect:
+            raise CalDAVError(response.status, method, path)
+        return response.status, response, data
+
+    def _multistatus(self, method, body, depth, expect=(207,)):
+        status, response, data = self.request(method, self.path, body, {
+            'Content-Type': 'application/xml; charset=utf-8',
+            'Depth': depth,
+        }, expect=expect)
+        return ET.fromstring(data)
+
+    def _absolute_href(self, href):
+        return urllib.parse.urlsplit(href).path
+
+    def get_ctag(self):
+        """
+        Returns a tuple (ctag, sync_token).  Either may be None.
+        """
+        body = ('<d:propfind xmlns:d="DAV:" xmlns:cs="%s"><d:prop>'
+                '<cs:getctag/><d:sync-token/>'
+                '</d:prop></d:propfind>' % NS_CALSERVER)
+        root = self._multistatus('PROPFIND', body, '0')
+        ctag = root.findtext('.//{%s}getctag' % NS_CALSERVER)
+        sync_token = root.findtext('.//{%s}sync-token' % NS_DAV)
+        return ctag, sync_token or None
+
+    def get_etag(self, href):
+        """
+        Returns the ETag of a single resource, or None if it doesn't exist.
+        """
+        body = ('<d:propfind xmlns:d="DAV:"><d:prop><d:getetag/>'
+                '</d:prop></d:propfind>')
+        status, response, data = self.request('PROPFIND', href, body, {
+            'Content-Type': 'application/xml; charset=utf-8',
+            'Depth': '0',
+        }, expect=(207, 404))
+        if status == 404:
+            return None
+        return ET.fromstring(data).findtext('.//{%s}getetag' % NS_DAV)
+
+    def list_etags(self):
+        """
+        Returns a dict mapping each resource href to its ETag.
+        """
+        body = ('<d:propfind xmlns:d="DAV:"><d:prop><d:getetag/>'
+                '</d:prop></d:propfind>')
+        root = self._multistatus('PROPFIND', body, '1')
+        etags = {}
+        for response in root.iter('{%s}response' % NS_DAV):
+            href = self._absolute_href(response.findtext('{%s}href' % NS_DAV))
+            etag = response.findtext('.//{%s}getetag' % NS_DAV)
+            if href != self.path and etag is not None:
+                etags[href] = etag
+        return etags
+
+    def sync_collection(self, sync_token):
+        """
+        Returns a tuple (new_sync_token, changed, deleted), where "changed" is
+        a dict mapping the hrefs of changed resources to their ETags and
+        "deleted" is a list of hrefs of deleted resources.
+
+        Raises CalDAVError if the server rejected the sync token.
+        """
+        body = ('<d:sync-collection xmlns:d="DAV:">'
+                '<d:sync-token>%s</d:sync-token><d:sync-level>1</d:sync-level>'
+                '<d:prop><d:getetag/></d:prop></d:sync-collection>'
+                % (sync_token or ''))
+        root = self._multistatus('REPORT', body, '1')
+        changed = {}
+        deleted = []
+        for response in root.iter('{%s}response' % NS_DAV):
+            href = self._absolute_href(response.findtext('{%s}href' % NS_DAV))
+            if href == self.path:
+                continue
+            if '404' in (response.findtext('{%s}status' % NS_DAV) or ''):
+                deleted.append(href)
+            else:
+                changed[href] = response.findtext('.//{%s}getetag' % NS_DAV)
+        return root.findtext('{%s}sync-token' % NS_DAV), changed, deleted
+
+    def multiget(self, hrefs):
+        """
+        Returns a dict mapping each of the given hrefs to (etag, data).
+        """
+        result = {}
+        hrefs = list(hrefs)
+        for i in range(0, len(hrefs), MULTIGET_BATCH_SIZE):
+            batch = hrefs[i:i + MULTIGET_BATCH_SIZE]
+            body = ('<c:calendar-multiget xmlns:d="DAV:" xmlns:c="%s">'
+                    '<d:prop><d:getetag/><c:calendar-data/></d:prop>%s'
+                    '</c:calendar-multiget>' % (NS_CALDAV, ''.join(
+                        '<d:href>%s</d:href>' % href for href in batch)))
+            root = self._multistatus('REPORT', body, '1')
+            for response in root.iter('{%s}response' % NS_DAV):
+                href = self._absolute_href(
+                        response.findtext('{%s}href' % NS_DAV))
+                data = response.findtext('.//{%s}calendar-data' % NS_CALDAV)
+                if data is not None:
+                    etag = response.findtext('.//{%s}getetag' % NS_DAV)
+                    result[href] = (etag, data)
+        return result
+
+    def put(self, href, data, etag=None):
+        """
+        Uploads a resource.  If etag is None, the resource must not exist yet.
+        Returns the new ETag.  Many servers don't send it along with the
+        response, then it is fetched separately.
+        """
+        headers = {'Content-Type': 'text/calendar; charset=utf-8'}
+        if etag is None:
+            headers['If-None-Match'] = '*'
+        else:
+            headers['If-Match'] = etag
+        status, response, data = self.request('PUT', href, data, headers,
+                expect=(200, 201, 204))
+        return response.getheader('ETag') or self.get_etag(href)
+
+    def delete(self, href, etag=None):
+        """Deletes a resource, unless it changed since it had the given ETag."""
+        headers = {}
+        if etag is not None:
+            headers['If-Match'] = etag
+        self.request('DELETE', href, headers=headers, expect=(200, 204, 404))
+
+
+def sync_vdir(basedir, config, client=None):
+    """
+    Synchronizes the .ics files in basedir with a CalDAV collection.
+
+    Remote changes are found through the collection's sync-token with a
+    sync-collection REPORT, falling back to comparing ETags, and nothing but
+    a single PROPFIND is sent if the ctag didn't change.  Local changes are
+    uploaded with preconditions.  If an item changed on both sides, the
+    remote version wins.
+
+    Returns a list of the local paths that were written or deleted.
+
+    >>> import tempfile
+    >>> from panban.testing import StandInCalDAVServer
+    >>> server = StandInCalDAVServer()
+    >>> vtodo = ('BEGIN:VCALENDAR\\r\\nBEGIN:VTODO\\r\\nUID:{0}\\r\\n'
+    ...          'SUMMARY:{1}\\r\\nEND:VTODO\\r\\nEND:VCALENDAR\\r\\n')
+    >>> server.put_resource('a.ics', vtodo.format('a', 'Remote task'))
+    >>> vdir = tempfile.mkdtemp()
+    >>> config = {'url': server.url + '/calendar/'}
+    >>> [os.path.basename(path) for path in sync_vdir(vdir, config)]
+    ['a.ics']
+
+    Nothing but the ctag is fetched if nothing changed:
+
+    >>> server.request_count = 0
+    >>> sync_vdir(vdir, config), server.request_count
+    ([], 1)
+
+    Local and remote changes are exchanged:
+
+    >>> with open(os.path.join(vdir, 'b.ics'), 'w') as f:
+    ...     _ = f.write(vtodo.format('b', 'Local task'))
+    >>> server.put_resource('c.ics', vtodo.format('c', 'Another one'))
+    >>> server.delete_resource('a.ics')
+    >>> server.connection_count = 0
+    >>> sorted(os.path.basename(path) for path in sync_vdir(vdir, config))
+    ['a.ics', 'c.ics']
+    >>> sorted(os.listdir(vdir))
+    ['.panban-caldav-state.json', 'b.ics', 'c.ics']
+    >>> sorted(server.resources)
+    ['/calendar/b.ics', '/calendar/c.ics']
+
+    All requests of a sync share a single connection:
+
+    >>> server.connection_count
+    1
+    >>> server.close()
+
+    Servers that send no ETag along with the response to PUT are asked for
+    it, so that local changes can still be uploaded with preconditions:
+
+    >>> server = StandInCalDAVServer(etag_on_put=False)
+    >>> vdir = tempfile.mkdtemp()
+    >>> config = {'url': server.url + '/calendar/'}
+    >>> with open(os.path.join(vdir, 'd.ics'), 'w') as f:
+    ...     _ = f.write(vtodo.format('d', 'Local task'))
+    >>> sync_vdir(vdir, config)
+    []
+    >>> with open(os.path.join(vdir, 'd.ics'), 'w') as f:
+    ...     _ = f.write(vtodo.format('d', 'Edited task'))
+    >>> sync_vdir(vdir, config)
+    []
+    >>> b'Edited task' in server.resources['/calendar/d.ics'][1]
+    True
+    >>> os.unlink(os.path.join(vdir, 'd.ics'))
+    >>> sync_vdir(vdir, config), sorted(server.resources)
+    ([], [])
+    >>> server.close()
+    """
+    state_path = os.path.join(basedir, NATIVE_SYNC_STATE)
+    try:
+        with open(state_path, 'r') as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        state = {'ctag': None, 'sync_token': None, 'resources': {}}
+    resources = state['resources']  # href -> dict(etag, filename, fingerprint)
+
+    own_client = client is None
+    if own_client:
+        client = CalDAVClient(config['url'], config.get('username'),
+                config.get('password'))
+
+    def fingerprint(path):
+        stat = os.stat(path)
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def local_path(href):
+        if href in resources:
+            filename = resources[href]['filename']
+        else:
+            filename = os.path.basename(urllib.parse.unquote(href.rstrip('/')))
+            if not filename.lower().endswith('.ics'):
+                filename += '.ics'
+        return os.path.join(basedir, filename)
+
+    try:
+        # Find local changes
+        hrefs_by_filename = dict((resource['filename'], href)
+                for href, resource in resources.items())
+        local_changes = {}  # href -> path, or None for deleted files
+        for href, resource in resources.items():
+            path = os.path.join(basedir, resource['filename'])
+            if not os.path.exists(path):
+                local_changes[href] = None
+            elif fingerprint(path) != resource['fingerprint']:
+                local_changes[href] = path
+        for filename in os.listdir(basedir):
+            if filename.lower().endswith('.ics') and \
+                    filename not in hrefs_by_filename:
+                href = client.path + urllib.parse.quote(filename)
+                local_changes[href] = os.path.join(basedir, filename)
+
+        # Find remote changes
+        ctag, sync_token = client.get_ctag()
+        remote_changed = {}
+        remote_deleted = []
+        if ctag is None or ctag != state['ctag']:
+            synced = None
+            if sync_token is not None:
+                try:
+                    synced = client.sync_collection(state['sync_token'])
+                except CalDAVError:
+                    pass  # e.g. the server forgot our sync token
+            if synced is not None:
+                sync_token, remote_changed, remote_deleted = synced
+            else:
+                etags = client.list_etags()
+                remote_changed = dict((href, etag)
+                        for href, etag in etags.items()
+                        if href not in resources
+                        or resources[href]['etag'] != etag)
+                remote_deleted = [href for href in resources
+                        if href not in etags]
+            # Skip resources whose ETag we know already, e.g. our own uploads
+            for href, etag in list(remote_changed.items()):
+                if etag is not None and href in resources and \
+                        resources[href]['etag'] == etag:
+                    del remote_changed[href]
+
+        changed_paths = []
+
+        # Apply remote changes, which win over conflicting local changes
+        fetched = client.multiget(remote_changed)
+        for href, (etag, data) in fetched.items():
+            path = local_path(href)
+            with open(path, 'w') as f:
+                f.write(data)
+            resources[href] = {'etag': etag,
+                    'filename': os.path.basename(path),
+                    'fingerprint': fingerprint(path)}
+            local_changes.pop(href, None)
+            changed_paths.append(path)
+        for href in remote_deleted:
+            if href in resources:
+                path = local_path(href)
+                if os.path.exists(path):
+                    os.unlink(path)
+                    changed_paths.append(path)
+                del resources[href]
+            local_changes.pop(href, None)
+
+        # Upload local changes.  The ETag of an upload may be unknown, e.g.
+        # in the state of older versions, then it is fetched again.
+        for href, path in local_changes.items():
+            etag = None
+            if href in resources:
+                etag = resources[href]['etag'] or client.get_etag(href)
+            if path is None:
+                if etag is not None:
+                    client.delete(href, etag)
+                del resources[href]
+                continue
+            with open(path, 'r') as f:
+                data = f.read()
+            new_etag = client.put(href, data, etag)
+            resources[href] = {'etag': new_etag,
+                    'filename': os.path.basename(path),
+                    'fingerprint': fingerprint(path)}
+
+        # Our own uploads change the ctag, so only remember it if there were
+        # none.  Otherwise, the next sync checks the ETags once more.
+        state['ctag'] = None if local_changes else ctag
+        state['sync_token'] = sync_token
+    finally:
+        if own_client:
+            client.close()
+
+    with open(state_path, 'w') as f:
+        json.dump(state, f)
+    return changed_paths
+
+
 if __name__ == '__main__':
     if '--doctest' in sys.argv:
         import doctest
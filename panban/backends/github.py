@@ -1,13 +1,678 @@
-import sys
+import concurrent.futures
+import http.client
 import json
+import os
+import re
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
 import panban.api
 from panban.json_api.eternal import PortableResponse, PortableNode
 from panban.json_api import exceptions
-import urllib.request
 
 URI_START = 'https://github.com/'
+API_URL = os.environ.get('GITHUB_API_URL', 'https://api.github.com')
+HTTP_TIMEOUT = 30
+PER_PAGE = 100  # the maximum that the GitHub API allows
+MAX_FETCH_WORKERS = 8  # concurrent requests for the pages of one listing
+MAX_REPOSITORY_WORKERS = 4  # repositories that are refreshed concurrently
+MAX_RETRIES = 3
+RETRY_DELAY = 0.5  # seconds before the first retry, doubled for each retry
+MIRROR_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or
+        os.path.expanduser('~/.cache'), 'panban', 'github')
+MIRROR_VERSION = 2
+
+LINK_REGEX = re.compile(r'<([^>]*)>\s*;\s*rel="([^"]*)"')
+
+
+class GitHubError(Exception):
+    def __init__(self, status, method, path, reason=None):
+        self.status = status
+        if reason is None:
+            reason = 'HTTP status %d' % status
+        super().__init__('%s %s failed with %s' % (method, path, reason))
+
+
+class GitHubRateLimitError(GitHubError):
+    def __init__(self, method, path, reset):
+        self.reset = reset
+        super().__init__(403, method, path, 'exceeded rate limit until %s'
+                % time.strftime('%H:%M', time.localtime(reset)))
+
+
+def parse_link_header(value):
+    """
+    Returns a dictionary mapping the "rel" of each link to its URL.
+
+    >>> links = parse_link_header('<https://x/issues?page=2>; rel="next", '
+    ...     '<https://x/issues?page=5>; rel="last"')
+    >>> links['next'], links['last']
+    ('https://x/issues?page=2', 'https://x/issues?page=5')
+    >>> parse_link_header(None)
+    {}
+    """
+    if not value:
+        return {}
+    return dict((rel, url) for url, rel in LINK_REGEX.findall(value))
+
+
+def _with_page(url, page):
+    parsed = urllib.parse.urlsplit(url)
+    params = urllib.parse.parse_qsl(parsed.query)
+    params = [(key, val) for key, val in params if key != 'page']
+    params.append(('page', str(page)))
+    return urllib.parse.urlunsplit(parsed._replace(
+        query=urllib.parse.urlencode(params)))
+
+
+class FetchStats(object):
+    """
+    Counts what refreshing one repository cost.
+
+    >>> stats = FetchStats('hut/panban')
+    >>> stats.count(200, 2048)
+    >>> stats.count(304, 0)
+    >>> stats.seconds = 0.25
+    >>> print(stats)
+    hut/panban: 2 requests (1 not modified), 2 KiB in 0.25s
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.requests = 0
+        self.not_modified = 0
+        self.size = 0
+        self.seconds = 0
+        self._lock = threading.Lock()
+
+    def count(self, status, size):
+        with self._lock:
+            self.requests += 1
+            self.size += size
+            if status == 304:
+                self.not_modified += 1
+
+    def __str__(self):
+        return '%s: %d requests (%d not modified), %d KiB in %.2fs' % (
+                self.name, self.requests, self.not_modified,
+                self.size // 1024, self.seconds)
+
+
+class GitHubClient(object):
+    """
+    A minimal client for the REST API of GitHub.
+
+    Every thread that uses the client gets its own persistent HTTP
+    connection.  The pages of a listing are fetched concurrently on a
+    bounded thread pool that lives as long as the client, so that each
+    worker keeps reusing its keep-alive connection across refreshes.
+    Work on several repositories is spread over a second pool with map(),
+    whose workers may then use the first one.
+
+    >>> from panban.testing import StandInGitHubServer
+    >>> server = StandInGitHubServer()
+    >>> server.add_issues('hut/panban', 250)
+    >>> client = GitHubClient(server.url)
+    >>> issues = client.get_all_pages('/repos/hut/panban/issues',
+    ...     {'state': 'all'})
+    >>> len(issues), issues[0]['number'], issues[-1]['number']
+    (250, 1, 250)
+    >>> server.request_count
+    3
+
+    Transient server errors are retried:
+
+    >>> server.fail_next = 2
+    >>> client.retry_delay = 0
+    >>> len(client.get_all_pages('/repos/hut/panban/issues'))
+    250
+    >>> client.get('/repos/hut/nonexistent/issues')
+    Traceback (most recent call last):
+      ...
+    GitHubError: GET /repos/hut/nonexistent/issues failed with HTTP status 404
+
+    Once the rate limit is exhausted, no more requests are made until it
+    is reset:
+
+    >>> server.rate_limit_remaining = 1
+    >>> _ = client.get('/repos/hut/panban/issues')
+    >>> count = server.request_count
+    >>> client.get('/repos/hut/panban/issues')  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+      ...
+    GitHubRateLimitError: GET /repos/hut/panban/issues failed with exceeded rate limit until ...
+    >>> server.request_count == count
+    True
+    >>> client.close()
+    >>> server.close()
+    """
+
+    def __init__(self, url=API_URL, token=None, timeout=HTTP_TIMEOUT,
+            max_workers=MAX_FETCH_WORKERS, retries=MAX_RETRIES,
+            max_repository_workers=MAX_REPOSITORY_WORKERS):
+        parsed = urllib.parse.urlsplit(url)
+        self.scheme = parsed.scheme
+        self.netloc = parsed.netloc
+        self.path = parsed.path.rstrip('/')
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.max_repository_workers = max_repository_workers
+        self.retries = retries
+        self.retry_delay = RETRY_DELAY
+        self.headers = {
+            'User-Agent': 'panban',
+            'Accept': 'application/vnd.github+json',
+        }
+        if token is None:
+            token = os.environ.get('GITHUB_TOKEN')
+        if token:
+            self.headers['Authorization'] = 'Bearer ' + token
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._pools = {}
+        self.rate_limit_remaining = None
+        self.rate_limit_reset = 0
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            if self.scheme == 'https':
+                connection = http.client.HTTPSConnection(self.netloc,
+                        timeout=self.timeout)
+            else:
+                connection = http.client.HTTPConnection(self.netloc,
+                        timeout=self.timeout)
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def _drop_connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+            with self._lock:
+                if connection in self._connections:
+                    self._connections.remove(connection)
+
+    def _get_pool(self, name, max_workers):
+        with self._lock:
+            if name not in self._pools:
+                self._pools[name] = concurrent.futures.ThreadPoolExecutor(
+                        max_workers, thread_name_prefix='github-' + name)
+            return self._pools[name]
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            pool.shutdown()
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
+
+    def _relative(self, url):
+        """Turns a URL from a Link header into a path for our connection."""
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.netloc and parsed.netloc != self.netloc:
+            raise GitHubError(None, 'GET', url, 'unexpected host')
+        path = parsed.path
+        if parsed.query:
+            path += '?' + parsed.query
+        return path
+
+    def map(self, function, items):
+        """Like the builtin map(), but runs on the pool for repositories."""
+        pool = self._get_pool('repositories', self.max_repository_workers)
+        return list(pool.map(function, items))
+
+    def get_each(self, requests, expect=(200,), stats=None):
+        """
+        Sends GET requests concurrently and returns the list of the results
+        of get().  Each request is a tuple (path, headers).
+        """
+        pool = self._get_pool('pages', self.max_workers)
+        return list(pool.map(lambda request: self.get(request[0],
+            headers=request[1], expect=expect, stats=stats), requests))
+
+    def get(self, path, params=None, headers=None, expect=(200,), stats=None):
+        """
+        Returns a tuple (status, headers, decoded json) of the response.
+
+        Connection errors, timeouts and 5xx responses are retried with an
+        exponential backoff.  Raises GitHubError if the status is not in
+        "expect" after all retries, and GitHubRateLimitError without even
+        trying while the rate limit is exhausted.  Every request is counted
+        in the given FetchStats.
+        """
+        if not path.startswith(self.path + '/'):
+            path = self.path + path
+        if params:
+            path += ('&' if '?' in path else '?') + \
+                    urllib.parse.urlencode(params)
+        all_headers = dict(self.headers)
+        all_headers.update(headers or {})
+        if self.rate_limit_remaining == 0 and time.time() < self.rate_limit_reset:
+            raise GitHubRateLimitError('GET', path, self.rate_limit_reset)
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+            try:
+                connection = self._connection()
+                connection.request('GET', path, headers=all_headers)
+                response = connection.getresponse()
+                data = response.read()
+                if stats is not None:
+                    stats.count(response.status, len(data))
+            except (http.client.HTTPException, ConnectionError,
+                    socket.timeout) as e:
+                self._drop_connection()
+                if attempt == self.retries:
+                    raise GitHubError(None, 'GET', path, str(e))
+                continue
+            if response.getheader('Connection', '').lower() == 'close':
+                self._drop_connection()
+            if response.status < 500 or attempt == self.retries:
+                break
+
+        self._update_rate_limit(response)
+        if response.status in (403, 429) and self.rate_limit_remaining == 0:
+            raise GitHubRateLimitError('GET', path, self.rate_limit_reset)
+        if response.status not in expect:
+            raise GitHubError(response.status, 'GET', path)
+        decoded = json.loads(data.decode('utf-8')) if data else None
+        return response.status, response, decoded
+
+    def _update_rate_limit(self, response):
+        remaining = response.getheader('X-RateLimit-Remaining')
+        reset = response.getheader('X-RateLimit-Reset')
+        retry_after = response.getheader('Retry-After')
+        with self._lock:
+            if remaining is not None:
+                self.rate_limit_remaining = int(remaining)
+            if reset is not None:
+                self.rate_limit_reset = int(reset)
+            if retry_after is not None and response.status in (403, 429):
+                # A secondary rate limit, e.g. for too many concurrent requests
+                self.rate_limit_remaining = 0
+                self.rate_limit_reset = time.time() + int(retry_after)
+
+    def get_all_pages(self, path, params=None):
+        """
+        Returns the concatenated items of all pages of a listing.
+        """
+        return self.fetch_pages(path, params)[1]
+
+    def fetch_pages(self, path, params=None, etag=None, stats=None):
+        """
+        Returns a tuple (etag, items) with the items of all pages of a listing.
+
+        The first page tells the number of pages in its Link header, the
+        remaining pages are then fetched concurrently.  If the server only
+        gives us a "next" link, the pages are followed one by one instead.
+
+        If the first page still matches the given etag, nothing else is
+        fetched and items is None.  Such a request costs no rate limit.
+        """
+        params = dict(params or {})
+        params.setdefault('per_page', PER_PAGE)
+        headers = {'If-None-Match': etag} if etag else None
+        status, response, items = self.get(path, params, headers,
+                expect=(200, 304), stats=stats)
+        if status == 304:
+            return etag, None
+        etag = response.getheader('ETag')
+        links = parse_link_header(response.getheader('Link'))
+
+        if 'last' in links:
+            last_url = links['last']
+            query = urllib.parse.parse_qs(urllib.parse.urlsplit(last_url).query)
+            last_page = int(query.get('page', ['1'])[0])
+            paths = [self._relative(_with_page(last_url, page))
+                    for page in range(2, last_page + 1)]
+            for status, response, page_items in self.get_each(
+                    [(path, None) for path in paths], stats=stats):
+                items.extend(page_items)
+            return etag, items
+
+        while 'next' in links:
+            status, response, page_items = self.get(
+                    self._relative(links['next']), stats=stats)
+            items.extend(page_items)
+            links = parse_link_header(response.getheader('Link'))
+        return etag, items
+
+
+def _trim_issue(item):
+    """
+    Returns the data of an issue from the GitHub API that we keep in the
+    mirror.  The body is left out, see DescriptionCache.
+    """
+    return {
+        'number': item['number'],
+        'node_id': item['node_id'],
+        'title': item['title'],
+        'state': item['state'],
+        'updated_at': item['updated_at'],
+        'assigned': bool(item.get('assignees')),
+        'labels': [label['name'] for label in item.get('labels') or ()],
+        'milestone': (item.get('milestone') or {}).get('title'),
+    }
+
+
+def _write_json(path, data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # Replace the file atomically, it may be read by another thread
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+class RepositoryList(object):
+    """
+    The names of the repositories of an organization or a user, on the disk.
+
+    Archived repositories and those without issues are left out.
+
+    >>> from panban.testing import StandInGitHubServer
+    >>> server = StandInGitHubServer()
+    >>> server.add_issues('ranger/ranger', 1)
+    >>> server.add_issues('ranger/ranger.github.io', 1)
+    >>> server.add_issues('hut/panban', 1)
+    >>> server.organizations.add('ranger')
+    >>> client = GitHubClient(server.url)
+    >>> repositories = RepositoryList(os.path.join(tempfile.mkdtemp(), 'r.json'))
+    >>> repositories.refresh(client, 'ranger'), repositories.names
+    (True, ['ranger/ranger', 'ranger/ranger.github.io'])
+    >>> repositories.refresh(client, 'hut'), repositories.names
+    (True, ['hut/panban'])
+    >>> client.close()
+    >>> server.close()
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.names = []
+        self.etag = None
+
+    def load(self):
+        """Returns False if there is no usable list yet."""
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get('version') != MIRROR_VERSION:
+            return False
+        self.names = data['names']
+        self.etag = data['etag']
+        return True
+
+    def save(self):
+        _write_json(self.path, {
+            'version': MIRROR_VERSION,
+            'etag': self.etag,
+            'names': self.names,
+        })
+
+    def refresh(self, client, owner, stats=None):
+        """Returns whether the list changed."""
+        try:
+            etag, items = client.fetch_pages('/orgs/%s/repos' % owner, None,
+                    self.etag, stats)
+        except GitHubError as e:
+            if e.status != 404:
+                raise
+            # Not an organization, but a user
+            etag, items = client.fetch_pages('/users/%s/repos' % owner, None,
+                    self.etag, stats)
+        if items is None:
+            return False
+        names = sorted(item['full_name'] for item in items
+                if item.get('has_issues', True) and not item.get('archived'))
+        changed = names != self.names
+        self.names = names
+        self.etag = etag
+        return changed
+
+
+class IssueMirror(object):
+    """
+    A copy of the issues of one repository in a JSON file on the disk.
+
+    The mirror remembers when it was last updated, so that refresh() only
+    downloads the issues that changed since then, and the ETag of that
+    request, so that an unchanged listing costs no rate limit at all.
+
+    >>> from panban.testing import StandInGitHubServer
+    >>> server = StandInGitHubServer()
+    >>> server.add_issues('hut/panban', 150)
+    >>> client = GitHubClient(server.url)
+    >>> mirror = IssueMirror(os.path.join(tempfile.mkdtemp(), 'panban.json'))
+    >>> mirror.load()
+    False
+    >>> mirror.refresh(client, 'hut/panban'), len(mirror.issues)
+    (True, 150)
+    >>> mirror.save()
+
+    After that, only the changed issues are transmitted, plus the newest
+    one of the previous refresh:
+
+    >>> server.update_issue('hut/panban', 7, state='closed')
+    >>> mirror = IssueMirror(mirror.path)
+    >>> mirror.load()
+    True
+    >>> mirror.refresh(client, 'hut/panban'), mirror.issues[7]['state']
+    (True, 'closed')
+    >>> server.last_response_size
+    2
+    >>> mirror.refresh(client, 'hut/panban')
+    False
+    >>> before = server.rate_limit_remaining
+    >>> mirror.refresh(client, 'hut/panban'), server.last_status
+    (False, 304)
+    >>> server.rate_limit_remaining == before
+    True
+    >>> client.close()
+    >>> server.close()
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.issues = {}  # number -> dict, as returned by _trim_issue()
+        self.since = None  # the "updated_at" of the newest issue
+        self.etag = None  # of the listing of the issues updated since then
+        self.new_bodies = {}  # number -> entry for the DescriptionCache
+
+    def load(self):
+        """Returns False if there is no usable mirror yet."""
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get('version') != MIRROR_VERSION:
+            return False
+        self.issues = dict((issue['number'], issue) for issue in data['issues'])
+        self.since = data['since']
+        self.etag = data['etag']
+        return True
+
+    def save(self):
+        _write_json(self.path, {
+            'version': MIRROR_VERSION,
+            'since': self.since,
+            'etag': self.etag,
+            'issues': [self.issues[number] for number in sorted(self.issues)],
+        })
+        if self.new_bodies:
+            # The listing contained the bodies anyway, so keep them for later
+            cache = DescriptionCache(description_cache_path(self.path))
+            cache.load()
+            cache.entries.update(self.new_bodies)
+            cache.save()
+            self.new_bodies = {}
+
+    def refresh(self, client, name, stats=None):
+        """Merges the changed issues.  Returns whether anything changed."""
+        params = {'state': 'all'}
+        if self.since is not None:
+            params['since'] = self.since
+        etag, items = client.fetch_pages('/repos/%s/issues' % name,
+                params, self.etag, stats)
+        if items is None:
+            return False
+
+        changed = False
+        for item in items:
+            issue = _trim_issue(item)
+            if self.issues.get(issue['number']) != issue:
+                self.issues[issue['number']] = issue
+                self.new_bodies[issue['number']] = {
+                    'updated_at': issue['updated_at'],
+                    'body': item.get('body'),
+                }
+                changed = True
+
+        if changed:
+            # Since "since" is inclusive, the next refresh will get at least
+            # the newest issue again, and the ETag of that listing is stored.
+            self.since = max(issue['updated_at'] for issue in self.issues.values())
+            self.etag = None
+        else:
+            self.etag = etag
+        return changed
+
+
+def description_cache_path(mirror_path):
+    # "@" can't be part of the name of a repository
+    return mirror_path[:-len('.json')] + '@bodies.json'
+
+
+class DescriptionCache(object):
+    """
+    The bodies of the issues of one repository, in a JSON file on the disk.
+
+    They are kept apart from the IssueMirror, so that loading a board doesn't
+    need to read them.  The IssueMirror stores the bodies that come with its
+    listings, the others are fetched when needed.
+
+    >>> from panban.testing import StandInGitHubServer
+    >>> server = StandInGitHubServer()
+    >>> server.add_issues('hut/panban', 20)
+    >>> client = GitHubClient(server.url)
+    >>> mirror = IssueMirror(os.path.join(tempfile.mkdtemp(), 'panban.json'))
+    >>> mirror.refresh(client, 'hut/panban')
+    True
+    >>> issues = [mirror.issues[number] for number in (1, 2, 3)]
+    >>> cache = DescriptionCache(description_cache_path(mirror.path))
+    >>> cache.load()
+    False
+    >>> cache.fetch(client, 'hut/panban', issues)
+    True
+    >>> cache.get(issues[1])['body']
+    'Body of issue 2'
+    >>> cache.fetch(client, 'hut/panban', issues)
+    False
+
+    When an issue changed, its body is requested again:
+
+    >>> server.update_issue('hut/panban', 2, body='New body')
+    >>> mirror.refresh(client, 'hut/panban')
+    True
+    >>> cache.fetch(client, 'hut/panban', [mirror.issues[2]])
+    True
+    >>> cache.get(mirror.issues[2])['body']
+    'New body'
+    >>> client.close()
+    >>> server.close()
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}  # number -> dict with "updated_at" and "body"
+        self.fingerprint = None
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def is_modified(self):
+        return self._stat() != self.fingerprint
+
+    def load(self):
+        """Returns False if there is no usable cache yet."""
+        self.fingerprint = self._stat()
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get('version') != MIRROR_VERSION:
+            return False
+        self.entries = dict((int(number), entry)
+                for number, entry in data['entries'].items())
+        return True
+
+    def save(self):
+        _write_json(self.path, {
+            'version': MIRROR_VERSION,
+            'entries': self.entries,
+        })
+        self.fingerprint = self._stat()
+
+    def get(self, issue):
+        """Returns the entry of the issue, or None if it's outdated."""
+        entry = self.entries.get(issue['number'])
+        if entry is None or entry['updated_at'] != issue['updated_at']:
+            return None
+        return entry
+
+    def fetch(self, client, name, issues, stats=None):
+        """
+        Fetches the outdated bodies of the given issues concurrently.
+
+        Returns whether anything was fetched.
+        """
+        outdated = [issue for issue in issues if self.get(issue) is None]
+        if not outdated:
+            return False
+        requests = [('/repos/%s/issues/%d' % (name, issue['number']), None)
+                for issue in outdated]
+        results = client.get_each(requests, stats=stats)
+        for issue, (status, response, item) in zip(outdated, results):
+            self.entries[issue['number']] = {
+                'updated_at': issue['updated_at'],
+                'body': item.get('body'),
+            }
+        return True
+
 
 class Handler(panban.api.Handler):
+    api_url = API_URL
+    mirror_dir = MIRROR_DIR
+    client = None
+    source = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fetch_stats = {}  # repository name -> FetchStats of its last refresh
+        self.issues_by_node_id = {}  # node ID -> (repository name, issue)
+        self.description_caches = {}  # repository name -> DescriptionCache
+
     def response(self, data=None, status=None):
         if status is None:
             status = PortableResponse.STATUS_OK
@@ -15,6 +680,8 @@ class Handler(panban.api.Handler):
         response = PortableResponse(
             version=self.json_api.VERSION,
             status=status,
+            features=['incremental_reload', 'sync', 'sync_on_load',
+                'lazy_descriptions'],
             data=data,
         )
         return response
@@ -23,69 +690,332 @@ class Handler(panban.api.Handler):
         self.load_data(query.source)
         return self.response(self.nodes_by_id)
 
-    def load_data(self, source):
+    def cmd_sync(self, query):
+        # NOTE: This may run in a background thread of the frontend, so it
+        # must not touch the loaded data.  The frontend applies the changes
+        # afterwards with the "reload_paths" command.
+        changed_paths = []
+        names = []
+        for owner, repositories in self._parse_source(query.source):
+            if repositories is None:
+                repositories = RepositoryList(self._mirror_path(owner))
+                repositories.load()
+                old_etag = repositories.etag
+                if repositories.refresh(self._get_client(), owner):
+                    changed_paths.append(repositories.path)
+                if repositories.etag != old_etag:
+                    repositories.save()
+                names.extend(repositories.names)
+            else:
+                names.extend(repositories)
+        names = list(dict.fromkeys(names))
+
+        mirrors = [IssueMirror(self._mirror_path(name)) for name in names]
+        old_etags = []
+        for mirror in mirrors:
+            mirror.load()
+            old_etags.append(mirror.etag)
+        errors = []
+        results = self._refresh_mirrors(names, mirrors)
+        for name, mirror, old_etag, result in zip(names, mirrors, old_etags,
+                results):
+            if isinstance(result, Exception):
+                errors.append('%s: %s' % (name, result))
+                continue
+            if result or mirror.etag != old_etag:
+                mirror.save()
+            if result:
+                changed_paths.append(mirror.path)
+        if errors and len(errors) == len(names):
+            raise results[0]
+
+        report = self._fetch_report(names)
+        if errors:
+            report += '; failed: ' + '; '.join(errors)
+        return self.response({'changed_paths': changed_paths, 'report': report})
+
+    def cmd_loaddescriptions(self, query):
+        if self.source != query.source:
+            self.load_data(query.source)
+
+        issues_by_name = {}
+        for node_id in query.arguments['node_ids']:
+            if node_id in self.issues_by_node_id:
+                name, issue = self.issues_by_node_id[node_id]
+                issues_by_name.setdefault(name, []).append(issue)
+
+        descriptions = {}
+        for name, issues in issues_by_name.items():
+            cache = self.description_caches.get(name)
+            if cache is None or cache.is_modified():
+                # It's new, or a sync stored the bodies of changed issues
+                cache = DescriptionCache(description_cache_path(
+                    self._mirror_path(name)))
+                cache.load()
+                self.description_caches[name] = cache
+            if cache.fetch(self._get_client(), name, issues):
+                cache.save()
+            for issue in issues:
+                descriptions[issue['node_id']] = \
+                        cache.get(issue)['body'] or None
+        return self.response({'descriptions': descriptions})
+
+    def cmd_reloadpaths(self, query):
+        old_nodes = self.nodes_by_id if self.source == query.source else None
+        self.load_data(query.source)
+        if old_nodes is None:
+            return self.response({'nodes': self.nodes_by_id, 'deleted_ids': []})
+
+        changed_nodes = {}
+        for node_id, node in self.nodes_by_id.items():
+            old_node = old_nodes.get(node_id)
+            if old_node is None or old_node.to_json(self.json_api) != \
+                    node.to_json(self.json_api):
+                changed_nodes[node_id] = node
+        deleted_ids = [node_id for node_id in old_nodes
+                if node_id not in self.nodes_by_id]
+        return self.response({
+            'nodes': changed_nodes,
+            'deleted_ids': deleted_ids,
+        })
+
+    def _parse_source(self, source):
+        """
+        Returns a list of tuples (owner, repositories).  Repositories is None
+        if the source contains all repositories of that owner.
+
+        >>> Handler()._parse_source('https://github.com/hut/panban')
+        [('hut', ['hut/panban'])]
+        >>> Handler()._parse_source('https://github.com/ranger,hut/panban,hut/x')
+        [('ranger', None), ('hut', ['hut/panban', 'hut/x'])]
+        """
         if not source.startswith(URI_START):
             raise Exception(f"Source URI must start with {URI_START}")
-        owner, repo = source[len(URI_START):].split('/', 1)
-        req = urllib.request.Request('https://api.github.com/repos/{owner}/{repo}/issues?per_page=10000&state=all'.format(owner=owner, repo=repo))
-        response = urllib.request.urlopen(req).read()
-        decoded = json.loads(response.decode('utf-8'))
+        result = []
+        repositories_by_owner = {}
+        for name in source[len(URI_START):].split(','):
+            name = name.strip().strip('/')
+            owner = name.split('/', 1)[0]
+            if '/' not in name:
+                result.append((owner, None))
+            elif owner in repositories_by_owner:
+                repositories_by_owner[owner].append(name)
+            else:
+                repositories_by_owner[owner] = [name]
+                result.append((owner, repositories_by_owner[owner]))
+        return result
 
-        nodes_by_id = {}
+    def _get_client(self):
+        if self.client is None:
+            self.client = GitHubClient(self.api_url)
+        return self.client
 
-        project_node = self.make_node(
-            node_id='__root',
-            label='all',
-            parent=None,
-        )
-        nodes_by_id[project_node.id] = project_node
+    def _mirror_path(self, name):
+        # The name of a repository or of its owner
+        host = urllib.parse.urlsplit(self.api_url).netloc.replace(':', '_')
+        return os.path.join(self.mirror_dir, host, name + '.json')
 
-        column_todo = self.make_node(
-            node_id='__todo',
-            label='Todo',
-            parent=project_node,
-        )
-        nodes_by_id[column_todo.id] = column_todo
-        project_node.children.append(column_todo.id)
-
-        column_active = self.make_node(
-            node_id='__active',
-            label='Active',
-            parent=project_node,
-            pos=1,
-        )
-        nodes_by_id[column_active.id] = column_active
-        project_node.children.append(column_active.id)
-
-        column_done = self.make_node(
-            node_id='__done',
-            label='Done',
-            parent=project_node,
-            pos=2,
-        )
-        nodes_by_id[column_done.id] = column_done
-        project_node.children.append(column_done.id)
+    def _refresh_mirrors(self, names, mirrors):
+        """
+        Refreshes the mirrors concurrently.
 
-        for issue in decoded:
-            if issue['state'] == 'open':
-                if issue['comments'] > 0:
-                    target_column = column_active
-                else:
-                    target_column = column_todo
+        Returns a list with whether each mirror changed, or the exception
+        that prevented its refresh.
+        """
+        client = self._get_client()
+
+        def refresh(name_and_mirror):
+            name, mirror = name_and_mirror
+            stats = FetchStats(name)
+            start = time.time()
+            try:
+                return mirror.refresh(client, name, stats)
+            except GitHubError as e:
+                return e
+            finally:
+                stats.seconds = time.time() - start
+                self.fetch_stats[name] = stats
+
+        return client.map(refresh, zip(names, mirrors))
+
+    def _fetch_report(self, names):
+        all_stats = [self.fetch_stats[name] for name in names
+                if name in self.fetch_stats]
+        if not all_stats:
+            return ''
+        slowest = max(all_stats, key=lambda stats: stats.seconds)
+        return '%d repositories, %d requests, slowest: %s' % (len(all_stats),
+                sum(stats.requests for stats in all_stats), slowest)
+
+    def load_data(self, source):
+        """
+        Builds the nodes from the mirrors, which are downloaded first if needed.
+
+        >>> from panban.controller import DatabaseAbstraction
+        >>> from panban.testing import StandInGitHubServer
+        >>> server = StandInGitHubServer()
+        >>> server.add_issues('hut/panban', 120)
+        >>> handler = Handler()
+        >>> handler.api_url = server.url
+        >>> handler.mirror_dir = tempfile.mkdtemp()
+        >>> db = DatabaseAbstraction(handler, 'https://github.com/hut/panban')
+        >>> db.reload()
+        >>> def column_sizes(board_id='__root'):
+        ...     return [len(column.children)
+        ...             for column in db._get_board_columns(board_id)]
+        >>> column_sizes()
+        [40, 40, 40]
+
+        Later loads only read the mirror, and sync() refreshes it:
+
+        >>> server.update_issue('hut/panban', 1, state='closed')
+        >>> db.reload()
+        >>> column_sizes()
+        [40, 40, 40]
+        >>> paths = db.sync()
+        >>> db.reload_paths(paths)
+        >>> column_sizes()
+        [40, 39, 41]
+        >>> db.sync()
+        []
+
+        Labels become tags and milestones become boards.  The bodies of the
+        issues are only sent when they are needed, and they were already
+        stored along with the mirror:
+
+        >>> server.update_issue('hut/panban', 2, labels=[{'name': 'bug'}],
+        ...     milestone={'title': 'v1.0'})
+        >>> db.reload_paths(db.sync())
+        >>> node = db.nodes_by_id['I_hut_panban_2']
+        >>> node.tags, node.description
+        (['bug'], None)
+        >>> [board.label for board in db.get_root_nodes()]
+        ['all', 'v1.0']
+        >>> column_sizes('__milestone_hut/panban_v1.0')
+        [1, 0, 0]
+        >>> count = server.request_count
+        >>> db.load_descriptions(['I_hut_panban_2', 'I_hut_panban_3'])
+        >>> node.description, server.request_count - count
+        ('Body of issue 2', 0)
+
+        Several repositories are shown together on one board, and each of
+        them on a board of its own:
+
+        >>> server.add_issues('ranger/ranger', 30)
+        >>> server.add_issues('ranger/ranger.github.io', 3)
+        >>> server.organizations.add('ranger')
+        >>> db = DatabaseAbstraction(handler, 'https://github.com/hut/panban,ranger')
+        >>> db.reload()
+        >>> [node.label for node in db.get_root_nodes()]
+        ['all', 'hut/panban', 'hut/panban: v1.0', 'ranger/ranger', 'ranger/ranger.github.io']
+        >>> column_sizes(), column_sizes('__repo_ranger/ranger')
+        ([51, 50, 52], [10, 10, 10])
+        >>> sorted(db.all_tags)
+        ['bug', 'panban', 'ranger', 'ranger.github.io']
+        >>> sorted(handler.fetch_stats)
+        ['hut/panban', 'ranger/ranger', 'ranger/ranger.github.io']
+        >>> handler.client.close()
+        >>> server.close()
+        """
+        names = []
+        for owner, repositories in self._parse_source(source):
+            if repositories is None:
+                repositories = RepositoryList(self._mirror_path(owner))
+                if not repositories.load():
+                    repositories.refresh(self._get_client(), owner)
+                    repositories.save()
+                names.extend(repositories.names)
             else:
-                target_column = column_done
-            node = self.make_node(
-                node_id=issue['node_id'],
-                label=issue['title'],
-                parent=target_column,
-                pos=len(target_column.children),
-            )
-            target_column.children.append(node.id)
-            nodes_by_id[node.id] = node
+                names.extend(repositories)
+        names = list(dict.fromkeys(names))
+
+        mirrors = [IssueMirror(self._mirror_path(name)) for name in names]
+        missing = [(name, mirror) for name, mirror in zip(names, mirrors)
+                if not mirror.load()]
+        if missing:
+            # There is nothing to show yet, so we have to wait for it
+            results = self._refresh_mirrors(*zip(*missing))
+            for (name, mirror), result in zip(missing, results):
+                if isinstance(result, Exception):
+                    raise result
+                mirror.save()
+        self.source = source
+
+        nodes_by_id = {}
+        issues_by_node_id = {}
+        columns = self._make_board(nodes_by_id, '__root', 'all', '')
+        columns_by_board_id = {}
+        for name, mirror in zip(names, mirrors):
+            board_ids = []
+            if len(names) > 1:
+                board_ids.append('__repo_' + name)
+                if board_ids[-1] not in columns_by_board_id:
+                    columns_by_board_id[board_ids[-1]] = self._make_board(
+                            nodes_by_id, board_ids[-1], name, board_ids[-1])
+            tags = [name.split('/', 1)[1]] if len(names) > 1 else []
+
+            # Newest first, like the GitHub API lists them
+            for number in sorted(mirror.issues, reverse=True):
+                issue = mirror.issues[number]
+                if issue['state'] != 'open':
+                    index = 2
+                elif issue['assigned']:
+                    index = 1
+                else:
+                    index = 0
+                target_column = columns[index]
+                node = self.make_node(
+                    node_id=issue['node_id'],
+                    label=issue['title'],
+                    parent=target_column,
+                    pos=len(target_column.children),
+                    tags=tags + issue['labels'],
+                )
+                target_column.children.append(node.id)
+                nodes_by_id[node.id] = node
+                issues_by_node_id[node.id] = (name, issue)
+
+                # The node is shared with the boards of the repository and
+                # of the milestone
+                node_board_ids = list(board_ids)
+                if issue['milestone'] is not None:
+                    board_id = '__milestone_%s_%s' % (name, issue['milestone'])
+                    if board_id not in columns_by_board_id:
+                        label = issue['milestone']
+                        if len(names) > 1:
+                            label = '%s: %s' % (name, label)
+                        columns_by_board_id[board_id] = self._make_board(
+                                nodes_by_id, board_id, label, board_id)
+                    node_board_ids.append(board_id)
+                for board_id in node_board_ids:
+                    columns_by_board_id[board_id][index].children.append(node.id)
 
         self.nodes_by_id = nodes_by_id
+        self.issues_by_node_id = issues_by_node_id
+
+    def _make_board(self, nodes_by_id, board_id, label, column_prefix):
+        """Returns the columns "Todo", "Active" and "Done" of a new board."""
+        board = self.make_node(
+            node_id=board_id,
+            label=label,
+            parent=None,
+        )
+        nodes_by_id[board.id] = board
+        columns = []
+        for pos, (column_id, column_label) in enumerate((('__todo', 'Todo'),
+                ('__active', 'Active'), ('__done', 'Done'))):
+            column = self.make_node(
+                node_id=column_prefix + column_id,
+                label=column_label,
+                parent=board,
+                pos=pos,
+            )
+            nodes_by_id[column.id] = column
+            board.children.append(column.id)
+            columns.append(column)
+        return columns
 
-    def make_node(self, node_id, label, parent, pos=0,
+    def make_node(self, node_id, label, parent, pos=0, tags=None,
                 creation_date=None, completion_date=None):
         if isinstance(parent, PortableNode):
             parent_id = parent.id
@@ -98,6 +1028,7 @@ class Handler(panban.api.Handler):
         pnode.parent = parent_id
         pnode.pos = pos
         pnode.id = node_id
+        pnode.tags = list(tags or [])
         pnode.creation_date = creation_date
         pnode.completion_date = completion_date
         return pnode
@@ -106,6 +1037,12 @@ class Handler(panban.api.Handler):
         command = query.command
         if command == 'load_all':
             response = self.cmd_getcolumndata(query)
+        elif command == 'sync':
+            response = self.cmd_sync(query)
+        elif command == 'reload_paths':
+            response = self.cmd_reloadpaths(query)
+        elif command == 'load_descriptions':
+            response = self.cmd_loaddescriptions(query)
         #elif command == 'move_nodes':
         #    response = self.cmd_moveitemstocolumn(query)
         #elif command == 'delete_nodes':
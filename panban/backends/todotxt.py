@@ -5,6 +5,8 @@ import re
 import time
 import hashlib
 import argparse
+import datetime
+import urllib.parse
 import panban.api
 import panban.json_api.eternal
 from panban.json_api import exceptions
@@ -19,14 +21,395 @@ PRIORITY_MAP = {
 for letter in 'DEFGHIJKLMNOPQRSTUVWXYZ':
     PRIORITY_MAP[letter] = 1
 
+PRIO_TO_PRIORITY = {
+    3: 'A',
+    2: 'B',
+    1: 'C',
+    0: None,
+}
+
+DESCRIPTION_KEY = 'desc'  # key:value tag holding the percent-encoded description
+PRIORITY_KEY = 'pri'  # key:value tag holding the priority of completed todos
+
+# Completed todos are moved from todo.txt to done.txt after this many days.
+# Of done.txt, only the last DONE_TAIL_SIZE todos are shown at first, and
+# the command "load_more" shows DONE_TAIL_SIZE more each time.
+DONE_FILENAME = 'done.txt'
+ARCHIVE_COMPLETED_AFTER_DAYS = 14
+DONE_TAIL_SIZE = 50
+TAIL_BLOCK_SIZE = 8192  # bytes read at a time when reading done.txt backwards
+
+TODO_HEAD_REGEX = re.compile(r'^(?:x (?:(\d{4}-\d{2}-\d{2}) )?)?'
+        r'(?:\(([A-Z])\) )?(?:(\d{4}-\d{2}-\d{2}) )?')
+TODO_TAG_REGEX = re.compile(r'^([A-Za-z][^\s:]*):([^\s/][^\s]*)$')
+
 def today():
     return time.strftime('%Y-%m-%d')
 
+
+class Todo(object):
+    """
+    A single line of a todo.txt file.
+
+    The text excludes the projects, contexts and key:value tags, which are
+    appended to the end of the line when writing it.
+
+    >>> todo = Todo.from_line('(A) 2020-01-01 call mom +family @phone due:2020-01-05')
+    >>> todo.priority, todo.creation_date, todo.text
+    ('A', '2020-01-01', 'call mom')
+    >>> todo.projects, todo.contexts, todo.tags
+    (['family'], ['phone'], {'due': '2020-01-05'})
+    >>> todo = Todo.from_line('x 2020-01-03 2020-01-01 read https://example.com')
+    >>> todo.completed, todo.completion_date, todo.text
+    (True, '2020-01-03', 'read https://example.com')
+    >>> todo.priority = 'B'
+    >>> todo.to_line()
+    'x 2020-01-03 2020-01-01 read https://example.com pri:B'
+
+    Times and ratios in the text are not tags, since the key of a tag has to
+    start with a letter:
+
+    >>> todo = Todo.from_line('meeting at 10:30 with Bob, ratio 3:2')
+    >>> todo.text, todo.tags
+    ('meeting at 10:30 with Bob, ratio 3:2', {})
+    >>> todo.to_line()
+    'meeting at 10:30 with Bob, ratio 3:2'
+    """
+
+    def __init__(self, text='', priority=None, completed=False,
+            completion_date=None, creation_date=None, projects=None,
+            contexts=None, tags=None):
+        self.text = text
+        self.priority = priority
+        self.completed = completed
+        self.completion_date = completion_date
+        self.creation_date = creation_date
+        self.projects = projects or []
+        self.contexts = contexts or []
+        self.tags = tags or {}
+
+        # Position of the line in the file and in TodoFile.todos
+        self.line_number = None
+        self.index = None
+        self.offset = None
+        self.length = 0
+        self.newline = '\n'
+
+    @classmethod
+    def from_line(cls, line):
+        todo = cls()
+        match = TODO_HEAD_REGEX.match(line)
+        todo.completed = line.startswith('x ')
+        todo.completion_date, todo.priority, todo.creation_date = match.groups()
+
+        words = []
+        for word in line[match.end():].split():
+            if len(word) > 1 and word[0] == '+':
+                todo.projects.append(word[1:])
+            elif len(word) > 1 and word[0] == '@':
+                todo.contexts.append(word[1:])
+            elif TODO_TAG_REGEX.match(word):
+                key, value = word.split(':', 1)
+                todo.tags[key] = value
+            else:
+                words.append(word)
+        todo.text = ' '.join(words)
+        if todo.completed and PRIORITY_KEY in todo.tags:
+            todo.priority = todo.tags.pop(PRIORITY_KEY)
+        return todo
+
+    def to_line(self):
+        parts = []
+        if self.completed:
+            parts.append('x')
+            if self.completion_date:
+                parts.append(self.completion_date)
+        elif self.priority:
+            parts.append('(%s)' % self.priority)
+        if self.creation_date:
+            parts.append(self.creation_date)
+        if self.text:
+            parts.append(self.text)
+        parts.extend('+' + project for project in self.projects)
+        parts.extend('@' + context for context in self.contexts)
+        parts.extend('%s:%s' % item for item in self.tags.items())
+        if self.completed and self.priority:
+            parts.append('%s:%s' % (PRIORITY_KEY, self.priority))
+        return ' '.join(parts)
+
+
+class TodoFile(object):
+    """
+    The todos of a todo.txt file along with their positions in the file.
+
+    Either the whole file is read with read(), or only its last lines with
+    read_tail().  Each todo remembers its line number (if known) and byte
+    range, so that it can be rewritten without touching the rest of the file.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.todos = []  # in the order of the file
+        self.line_count = None
+        self.tail_start = None  # offset of the first line that was read
+        self.fingerprint = None
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def is_modified(self):
+        return self._stat() != self.fingerprint
+
+    def read(self):
+        """
+        Parses the file line by line, unless it didn't change since the last
+        call.  Returns True if the file was parsed.
+        """
+        if not self.is_modified():
+            return False
+        todos = []
+        offset = 0
+        line_number = 0
+        with open(self.filename, 'rb') as f:
+            for raw_line in f:
+                todo = self._parse(raw_line, offset)
+                if todo is not None:
+                    todo.line_number = line_number
+                    todos.append(todo)
+                offset += len(raw_line)
+                line_number += 1
+
+        self.todos[:] = todos
+        self._reindex()
+        self.line_count = line_number
+        self.tail_start = 0
+        self.fingerprint = self._stat()
+        return True
+
+    def read_tail(self, count):
+        """
+        Makes sure that the last count todos of the file are read, going
+        backwards from the end of the file.  Returns the todos that were read.
+
+        >>> import tempfile
+        >>> filename = os.path.join(tempfile.mkdtemp(), 'done.txt')
+        >>> _ = open(filename, 'w').write(''.join(
+        ...     'x 2020-01-%02d task %d\\n' % (i, i) for i in range(1, 21)))
+        >>> done_file = TodoFile(filename)
+        >>> [todo.text for todo in done_file.read_tail(3)]
+        ['task 18', 'task 19', 'task 20']
+        >>> [todo.text for todo in done_file.read_tail(5)]
+        ['task 16', 'task 17']
+        >>> done_file.read_tail(5)
+        []
+        >>> len(done_file.todos), done_file.tail_start
+        (5, 306)
+        """
+        fingerprint = self._stat()
+        if fingerprint is None:
+            self.fingerprint = None
+            return []
+        if fingerprint != self.fingerprint:
+            self.todos[:] = []
+            self.line_count = None
+            self.tail_start = fingerprint[1]
+            self.fingerprint = fingerprint
+        count -= len(self.todos)
+        if count <= 0 or self.tail_start == 0:
+            return []
+
+        end = start = self.tail_start
+        skipped = b''
+        lines = []
+        with open(self.filename, 'rb') as f:
+            while start > 0:
+                start = max(0, start - TAIL_BLOCK_SIZE)
+                f.seek(start)
+                lines = f.read(end - start).splitlines(keepends=True)
+                # The first line is probably incomplete
+                skipped = lines.pop(0) if start > 0 and lines else b''
+                if sum(1 for line in lines if line.strip()) >= count:
+                    break
+
+        todos = []
+        offset = start + len(skipped)
+        for raw_line in lines:
+            todo = self._parse(raw_line, offset)
+            if todo is not None:
+                todos.append(todo)
+            offset += len(raw_line)
+        todos = todos[-count:]
+
+        self.tail_start = todos[0].offset if todos else start + len(skipped)
+        self.todos[:0] = todos
+        self._reindex()
+        return todos
+
+    def _reindex(self, start=0):
+        for index in range(start, len(self.todos)):
+            self.todos[index].index = index
+
+    def contains(self, todo):
+        index = todo.index
+        return index is not None and index < len(self.todos) and \
+                self.todos[index] is todo
+
+    def _parse(self, raw_line, offset):
+        line = raw_line.decode('utf-8')
+        content = line.rstrip('\r\n')
+        if not content.strip():
+            return None
+        todo = Todo.from_line(content)
+        todo.offset = offset
+        todo.length = len(raw_line)
+        todo.newline = line[len(content):] or '\n'
+        return todo
+
+    def write(self, changed=(), deleted=()):
+        """
+        Rewrites the lines of the changed todos and removes those of the
+        deleted todos.
+
+        If every line keeps its length, the lines are overwritten in place,
+        otherwise the file is rewritten from the first affected line on.
+
+        >>> import shutil, tempfile
+        >>> filename = os.path.join(tempfile.mkdtemp(), 'todo.txt')
+        >>> _ = shutil.copy('demos/todotxt/todo.txt', filename)
+        >>> todo_file = TodoFile(filename)
+        >>> todo_file.read()
+        True
+        >>> first, second = todo_file.todos[:2]
+        >>> first.priority = 'A'
+        >>> todo_file.write(changed=[first], deleted=[second])
+        >>> print(open(filename).read().strip())
+        (A) buy groceries @buy
+        remember the forgotten
+        edit this file @chores +active
+        x learn to code @chores
+        x set a goal
+        >>> [(todo.line_number, todo.offset) for todo in todo_file.todos[:2]]
+        [(0, 0), (1, 23)]
+        >>> todo_file.read()  # The todos in memory are up to date
+        False
+        """
+        edits = {}  # index -> (todo, new bytes of the line)
+        for todo in changed:
+            edits[todo.index] = (todo, (todo.to_line() + todo.newline).encode('utf-8'))
+        for todo in deleted:
+            edits[todo.index] = (todo, b'')
+        if not edits:
+            return
+        for todo, data in edits.values():
+            if not self.contains(todo):
+                raise ValueError('Todo is not in %s: %s' % (self.filename,
+                    todo.to_line()))
+        indexes = sorted(edits)
+
+        in_place = all(len(data) == todo.length for todo, data in edits.values())
+        with open(self.filename, 'r+b') as f:
+            if in_place:
+                for index in indexes:
+                    todo, data = edits[index]
+                    f.seek(todo.offset)
+                    f.write(data)
+            else:
+                start = edits[indexes[0]][0].offset
+                f.seek(start)
+                tail = f.read()
+                chunks = []
+                position = start
+                for index in indexes:
+                    todo, data = edits[index]
+                    chunks.append(tail[position - start:todo.offset - start])
+                    chunks.append(data)
+                    position = todo.offset + todo.length
+                chunks.append(tail[position - start:])
+                f.seek(start)
+                f.write(b''.join(chunks))
+                f.truncate()
+        self.fingerprint = self._stat()
+        if in_place:
+            return
+
+        # Update the positions of the todos from the first changed line on
+        first = indexes[0]
+        shift = 0
+        line_shift = 0
+        remaining = []
+        for todo in self.todos[first:]:
+            edit = edits.get(todo.index)
+            if edit is not None and not edit[1]:
+                shift -= todo.length
+                line_shift -= 1
+                continue
+            todo.offset += shift
+            if todo.line_number is not None:
+                todo.line_number += line_shift
+            if edit is not None:
+                shift += len(edit[1]) - todo.length
+                todo.length = len(edit[1])
+            remaining.append(todo)
+        self.todos[first:] = remaining
+        self._reindex(first)
+        if self.line_count is not None:
+            self.line_count += line_shift
+
+    def append(self, todos):
+        """
+        Appends the todos to the end of the file, creating it if necessary.
+        """
+        if not os.path.exists(self.filename):
+            open(self.filename, 'wb').close()
+            self.todos[:] = []
+            self.line_count = 0
+            self.tail_start = 0
+        elif self.is_modified():
+            # Don't mix up positions in a file that changed behind our back
+            self.todos[:] = []
+            self.line_count = None
+            self.tail_start = os.path.getsize(self.filename)
+
+        with open(self.filename, 'r+b') as f:
+            end = f.seek(0, os.SEEK_END)
+            if end:
+                f.seek(end - 1)
+                if f.read(1) != b'\n':
+                    # Terminate the last line first
+                    f.write(b'\n')
+                    end += 1
+                    if self.todos:
+                        self.todos[-1].length += 1
+            newline = self.todos[-1].newline if self.todos else '\n'
+            for todo in todos:
+                data = (todo.to_line() + newline).encode('utf-8')
+                f.write(data)
+                todo.offset = end
+                todo.length = len(data)
+                todo.newline = newline
+                if self.line_count is not None:
+                    todo.line_number = self.line_count
+                    self.line_count += 1
+                todo.index = len(self.todos)
+                self.todos.append(todo)
+                end += len(data)
+        self.fingerprint = self._stat()
+
 class Handler(panban.api.Handler):
     COLUMN_LABEL_TODO = 'Todo'
     COLUMN_LABEL_URGENT = 'High Prio'
     COLUMN_LABEL_ACTIVE = 'Active'
     COLUMN_LABEL_DONE = 'Done'
+    COLUMN_LABELS = [
+        COLUMN_LABEL_TODO,
+        COLUMN_LABEL_URGENT,
+        COLUMN_LABEL_ACTIVE,
+        COLUMN_LABEL_DONE,
+    ]
     ACTIVE_TAG = 'active'
     FILTER_NAME_ALL = '.*'
     FILTER_NAME_NONE = '^$'
@@ -47,23 +430,22 @@ class Handler(panban.api.Handler):
             version=self.json_api.VERSION,
             status=status,
             data=data,
-            features=['autogenerate_node_ids'],
+            features=['autogenerate_node_ids', 'rebucket', 'lazy_boards',
+                'load_more'],
         )
         return response
 
     def cmd_addnode(self, query):
-        import todotxtio
-
         self.load_data(query.source)
 
-        todo = todotxtio.Todo(
+        todo = Todo(
             text=self.node_label_to_todo_label(query.arguments['label']),
             creation_date=today()
         )
 
         # Infer metadata from column
         parent_id = query.arguments['target_column']
-        parent = self.nodes_by_id[parent_id]
+        parent = self._get_column(parent_id)
         if parent.label == self.COLUMN_LABEL_DONE:
             todo.completed = True
             todo.completion_date = today()
@@ -78,10 +460,12 @@ class Handler(panban.api.Handler):
         if context_node.label not in (
                 self.FILTER_NAME_ALL, self.FILTER_NAME_NONE):
             todo.contexts.append(context_node.label)
+        todo.priority = todo.priority or PRIO_TO_PRIORITY[query.arguments['prio']]
+        for tag in query.arguments.get('tags', []):
+            if tag not in todo.projects:
+                todo.projects.append(tag)
 
-        self.list_of_todos.append(todo)
-
-        self.dump_data(query.source)
+        self.todo_file.append([todo])
         return self.response()
 
     def cmd_getcolumndata(self, query):
@@ -89,13 +473,107 @@ class Handler(panban.api.Handler):
         self.load_data(filename)
         return self.response(self.nodes_by_id)
 
+    def cmd_rebucket(self, query):
+        # Only threshold dates depend on the day, so unless one of them was
+        # reached, nothing has to be moved and the file isn't even read.
+        old_nodes = getattr(self, 'nodes_by_id', None)
+        if old_nodes is not None and (self.next_threshold is None
+                or self.next_threshold > today()):
+            return self.response({'nodes': {}, 'deleted_ids': []})
+
+        self.load_data(query.source)
+        return self._delta_response(old_nodes)
+
+    def cmd_loadmore(self, query):
+        old_nodes = getattr(self, 'nodes_by_id', None)
+        if old_nodes is not None:
+            self.done_count = max(self.done_count,
+                    len(self.done_file.todos)) + DONE_TAIL_SIZE
+        self.load_data(query.source)
+        return self._delta_response(old_nodes)
+
+    def _delta_response(self, old_nodes):
+        # Compares the nodes with those before the last load_data()
+        if old_nodes is None:
+            return self.response({'nodes': self.nodes_by_id, 'deleted_ids': []})
+
+        changed_nodes = {}
+        for node_id, node in self.nodes_by_id.items():
+            old_node = old_nodes.get(node_id)
+            if old_node is None or old_node.to_json(self.json_api) != \
+                    node.to_json(self.json_api):
+                changed_nodes[node_id] = node
+        deleted_ids = [node_id for node_id in old_nodes
+                if node_id not in self.nodes_by_id]
+        if changed_nodes or deleted_ids:
+            # The columns of the other boards are sent again on demand
+            for board in self.boards.values():
+                changed_nodes[board.id] = board
+        return self.response({
+            'nodes': changed_nodes,
+            'deleted_ids': deleted_ids,
+        })
+
+    def cmd_loadboard(self, query):
+        self.load_data(query.source)
+
+        board_id = query.arguments['board_id']
+        for name, board in self.boards.items():
+            if board.id == board_id:
+                return self.response({'nodes': self._materialize_board(name)})
+        return self.response(status=PortableResponse.STATUS_FAIL)
+
     def cmd_changelabel(self, query):
         self.load_data(query.source)
 
         todo = self.todos_by_node_id[query.arguments['item_id']]
         todo.text = self.node_label_to_todo_label(query.arguments['new_label'])
 
-        self.dump_data(query.source)
+        self._write_todos(changed=[todo])
+        return self.response()
+
+    def cmd_changedescription(self, query):
+        self.load_data(query.source)
+
+        todo = self.todos_by_node_id[query.arguments['item_id']]
+        description = query.arguments['new_description']
+        if description:
+            todo.tags[DESCRIPTION_KEY] = urllib.parse.quote(description, safe='')
+        else:
+            todo.tags.pop(DESCRIPTION_KEY, None)
+
+        self._write_todos(changed=[todo])
+        return self.response()
+
+    def cmd_changeprio(self, query):
+        self.load_data(query.source)
+
+        todo = self.todos_by_node_id[query.arguments['item_id']]
+        todo.priority = PRIO_TO_PRIORITY[query.arguments['prio']]
+
+        self._write_todos(changed=[todo])
+        return self.response()
+
+    def cmd_changetags(self, query):
+        self.load_data(query.source)
+
+        # The tags of a node are the projects of the todo, except for the
+        # project that puts it into the "Active" column
+        todo = self.todos_by_node_id[query.arguments['item_id']]
+        action = query.arguments['action']
+        if action == self.json_api.PARAM_TAG_ADD:
+            for tag in query.arguments['tags']:
+                if tag not in todo.projects:
+                    todo.projects.append(tag)
+        elif action == self.json_api.PARAM_TAG_REMOVE:
+            for tag in query.arguments['tags']:
+                if tag in todo.projects and tag != self.ACTIVE_TAG:
+                    todo.projects.remove(tag)
+        elif action == self.json_api.PARAM_TAG_CLEAR:
+            todo.projects = [project for project in todo.projects
+                    if project == self.ACTIVE_TAG]
+
+        self._write_todos(changed=[todo])
         return self.response()
 
     def cmd_moveitemstocolumn(self, query):
@@ -104,9 +582,9 @@ class Handler(panban.api.Handler):
 
         ids = query.arguments['item_ids']
         target_column_id = query.arguments['target_column']
-        target_column = self.nodes_by_id[target_column_id]
-        for node_id in ids:
-            todo = self.todos_by_node_id[node_id]
+        target_column = self._get_column(target_column_id)
+        todos = [self.todos_by_node_id[node_id] for node_id in ids]
+        for todo in todos:
             if target_column.label == self.COLUMN_LABEL_TODO:
                 todo.completed = False
                 todo.completion_date = None
@@ -130,7 +608,7 @@ class Handler(panban.api.Handler):
             else:
                 raise Exception('Invalid column')
 
-        self.dump_data(filename)
+        self._write_todos(changed=todos)
         return self.response()
 
     def cmd_deleteitems(self, query):
@@ -138,11 +616,8 @@ class Handler(panban.api.Handler):
 
         ids = query.arguments['item_ids']
         to_be_deleted = [self.todos_by_node_id[node_id] for node_id in ids]
-        for i in reversed(range(len(self.list_of_todos))):
-            if self.list_of_todos[i] in to_be_deleted:
-                del self.list_of_todos[i]
 
-        self.dump_data(query.source)
+        self._write_todos(deleted=to_be_deleted)
         return self.response()
 
     def load_data(self, filename):
@@ -153,7 +628,7 @@ class Handler(panban.api.Handler):
         >>> isinstance(nodes, dict)
         True
         >>> len(nodes)
-        32
+        14
         >>> roots = [n for n in nodes.values() if not n.parent]
         >>> len(roots)  # 1 unfiltered + 2 filtering by project + 1 filter for no project
         4
@@ -163,49 +638,53 @@ class Handler(panban.api.Handler):
         4
         >>> [len(nodes[column].children) for column in root.children]  # Entries
         [3, 0, 1, 2]
-        """
 
-        import todotxtio
+        The other boards are only created when they are opened, and they
+        show the same nodes as the first board:
+
+        >>> [len(board.children) for board in roots]
+        [4, 0, 0, 0]
+        >>> chores = h._materialize_board('chores')
+        >>> len(chores)
+        5
+        >>> [len(nodes[column].children) for column in roots[3].children]
+        [1, 0, 1, 1]
+        """
 
         if not os.path.exists(filename):
             raise exceptions.SourceFileDoesNotExist(filename)
 
-        with open(filename, 'r') as f:
-            content = f.read()
-        self.list_of_todos = todotxtio.from_string(content)
-
-        nodes_by_id = {}
-        todos_by_node_id = {}
-        projects = {}
-        column_labels = [
-            self.COLUMN_LABEL_TODO,
-            self.COLUMN_LABEL_URGENT,
-            self.COLUMN_LABEL_ACTIVE,
-            self.COLUMN_LABEL_DONE,
-        ]
+        if getattr(self, 'todo_file', None) is None or \
+                self.todo_file.filename != filename:
+            self.todo_file = TodoFile(filename)
+            self.done_file = TodoFile(os.path.join(os.path.dirname(filename),
+                DONE_FILENAME))
+            self.list_of_todos = self.todo_file.todos
+            self.done_count = DONE_TAIL_SIZE
+        if self.todo_file.read():
+            self._archive_completed()
+        self.done_file.read_tail(self.done_count)
+        all_todos = self.todo_file.todos + self.done_file.todos
+
+        self.nodes_by_id = {}
+        self.todos_by_node_id = {}
+        self.boards = {}  # context name -> board node
+        self.node_ids_by_context = {}
+        self.column_index_by_node_id = {}
 
         def add_context(name, pos):
-            project_node = self.make_node(
+            board = self.make_node(
                 label=name,
                 parent=None,
                 pos=pos,
                 prio=DEFAULT_PRIO,
             )
-            nodes_by_id[project_node.id] = project_node
-            projects[name] = project_node
-
-            for colpos, column_name in enumerate(column_labels):
-                column_node = self.make_node(
-                    label=column_name,
-                    parent=project_node,
-                    pos=colpos,
-                    prio=DEFAULT_PRIO,
-                )
-                nodes_by_id[column_node.id] = column_node
-                project_node.children.append(column_node.id)
+            self.nodes_by_id[board.id] = board
+            self.boards[name] = board
+            self.node_ids_by_context[name] = []
 
         context_names = set()
-        for todo in self.list_of_todos:
+        for todo in all_todos:
             context_names |= set(todo.contexts)
         context_names = list(sorted(context_names))
         add_context(self.FILTER_NAME_ALL, 0)
@@ -213,46 +692,96 @@ class Handler(panban.api.Handler):
         for pos, context_name in enumerate(context_names):
             add_context(context_name, pos + 2)
 
-        for todo in self.list_of_todos:
+        # Every todo gets a single node in the board that shows everything.
+        # The other boards only refer to these nodes, see _materialize_board.
+        root = self.boards[self.FILTER_NAME_ALL]
+        self._materialize_board(self.FILTER_NAME_ALL)
+
+        current_day = today()
+        next_threshold = None
+        for todo in all_todos:
             if 't' in todo.tags:
                 # Hide items that are below the date threshold
-                today = time.strftime('%Y-%m-%d')
-                if todo.tags['t'] > today:
+                threshold = todo.tags['t']
+                if threshold > current_day:
+                    if next_threshold is None or threshold < next_threshold:
+                        next_threshold = threshold
                     continue
 
-            additional_contexts = [self.FILTER_NAME_ALL]
-            if not todo.contexts:
-                additional_contexts.append(self.FILTER_NAME_NONE)
-            for project_name in additional_contexts + todo.contexts:
-                project_node = projects[project_name]
-                if todo.completed:
-                    target_column_id = project_node.children[3]
-                elif self.ACTIVE_TAG in todo.projects:
-                    target_column_id = project_node.children[2]
-                elif todo.priority == 'A':
-                    target_column_id = project_node.children[1]
-                else:
-                    target_column_id = project_node.children[0]
-                target_column = nodes_by_id[target_column_id]
-
-                node = self.make_node(
-                    label=self.todo_label_to_node_label(todo.text),
-                    parent=target_column.id,
-                    pos=len(target_column.children),
-                    prio=PRIORITY_MAP[todo.priority],
-                    creation_date=todo.creation_date,
-                    completion_date=todo.completion_date
-                )
+            if todo.completed:
+                column_index = 3
+            elif self.ACTIVE_TAG in todo.projects:
+                column_index = 2
+            elif todo.priority == 'A':
+                column_index = 1
+            else:
+                column_index = 0
+            target_column = self.nodes_by_id[root.children[column_index]]
+
+            if DESCRIPTION_KEY in todo.tags:
+                description = urllib.parse.unquote(todo.tags[DESCRIPTION_KEY])
+            else:
+                description = None
+
+            node = self.make_node(
+                label=self.todo_label_to_node_label(todo.text),
+                parent=target_column.id,
+                pos=len(target_column.children),
+                prio=PRIORITY_MAP[todo.priority],
+                creation_date=todo.creation_date,
+                completion_date=todo.completion_date,
+                description=description,
+                tags=[project for project in todo.projects
+                    if project != self.ACTIVE_TAG],
+            )
+
+            target_column.children.append(node.id)
+            self.nodes_by_id[node.id] = node
+            self.todos_by_node_id[node.id] = todo
+            self.column_index_by_node_id[node.id] = column_index
+            # dict.fromkeys drops duplicate contexts of the same todo
+            for context_name in dict.fromkeys(todo.contexts or
+                    [self.FILTER_NAME_NONE]):
+                self.node_ids_by_context[context_name].append(node.id)
+
+        self.next_threshold = next_threshold  # when the next item shows up
 
-                target_column.children.append(node.id)
-                nodes_by_id[node.id] = node
-                todos_by_node_id[node.id] = todo
+    def _materialize_board(self, name):
+        """
+        Creates the columns of a board, unless that happened already.
 
-        self.todos_by_node_id = todos_by_node_id
-        self.nodes_by_id = nodes_by_id
+        Returns a dict of the board node and its columns.
+        """
+        board = self.boards[name]
+        result = {board.id: board}
+        if not board.children:
+            for colpos, column_label in enumerate(self.COLUMN_LABELS):
+                column = self.make_node(
+                    label=column_label,
+                    parent=board,
+                    pos=colpos,
+                    prio=DEFAULT_PRIO,
+                )
+                self.nodes_by_id[column.id] = column
+                board.children.append(column.id)
+            for node_id in self.node_ids_by_context[name]:
+                column_index = self.column_index_by_node_id[node_id]
+                column_id = board.children[column_index]
+                self.nodes_by_id[column_id].children.append(node_id)
+        for column_id in board.children:
+            result[column_id] = self.nodes_by_id[column_id]
+        return result
+
+    def _get_column(self, column_id):
+        if column_id not in self.nodes_by_id:
+            for name in self.boards:
+                self._materialize_board(name)
+                if column_id in self.nodes_by_id:
+                    break
+        return self.nodes_by_id[column_id]
 
     def make_node(self, label, parent, pos, prio, creation_date=None,
-            completion_date=None):
+            completion_date=None, description=None, tags=None):
         if isinstance(parent, PortableNode):
             parent_id = parent.id
         elif isinstance(parent, str):
@@ -267,13 +796,62 @@ class Handler(panban.api.Handler):
         pnode.id = self.json_api.generate_node_id(pnode)
         pnode.creation_date = creation_date
         pnode.completion_date = completion_date
+        pnode.description = description
+        pnode.tags = tags or []
         return pnode
 
-    def dump_data(self, filename):
-        import todotxtio
-        todotxtio.to_file(filename, self.list_of_todos)
+    def _write_todos(self, changed=(), deleted=()):
+        # Write each todo to the file that it came from.  Archived todos
+        # that are no longer completed move back to the todo file.
+        archived_changed = []
+        restored = []
+        for todo in changed:
+            if self.done_file.contains(todo):
+                if todo.completed:
+                    archived_changed.append(todo)
+                else:
+                    restored.append(todo)
+        if restored:
+            self.todo_file.append([Todo.from_line(todo.to_line())
+                for todo in restored])
+
+        self.done_file.write(changed=archived_changed,
+                deleted=[todo for todo in deleted
+                    if self.done_file.contains(todo)] + restored)
+        self.todo_file.write(
+                changed=[todo for todo in changed
+                    if self.todo_file.contains(todo)],
+                deleted=[todo for todo in deleted
+                    if self.todo_file.contains(todo)])
+
+    def _archive_completed(self):
+        """
+        Moves todos that were completed a while ago to the done file.
+        """
+        cutoff_day = datetime.date.today() - \
+                datetime.timedelta(ARCHIVE_COMPLETED_AFTER_DAYS)
+        cutoff = cutoff_day.strftime('%Y-%m-%d')
+        old_todos = [todo for todo in self.todo_file.todos if todo.completed
+                and todo.completion_date and todo.completion_date < cutoff]
+        if not old_todos:
+            return
+
+        # Append first, so that nothing is lost if removing them fails
+        self.done_file.append([Todo.from_line(todo.to_line())
+            for todo in old_todos])
+        self.todo_file.write(deleted=old_todos)
 
     def handle(self, query):
+        try:
+            return self._handle(query)
+        except Exception:
+            # The parsed todos may have been changed without being written
+            if getattr(self, 'todo_file', None) is not None:
+                self.todo_file.fingerprint = None
+                self.done_file.fingerprint = None
+            raise
+
+    def _handle(self, query):
         command = query.command
         if command == 'load_all':
             response = self.cmd_getcolumndata(query)
@@ -283,8 +861,20 @@ class Handler(panban.api.Handler):
             response = self.cmd_deleteitems(query)
         elif command == 'change_label':
             response = self.cmd_changelabel(query)
+        elif command == 'change_description':
+            response = self.cmd_changedescription(query)
+        elif command == 'change_prio':
+            response = self.cmd_changeprio(query)
+        elif command == 'change_tags':
+            response = self.cmd_changetags(query)
         elif command == 'add_node':
             response = self.cmd_addnode(query)
+        elif command == 'rebucket':
+            response = self.cmd_rebucket(query)
+        elif command == 'load_board':
+            response = self.cmd_loadboard(query)
+        elif command == 'load_more':
+            response = self.cmd_loadmore(query)
         else:
             raise exceptions.InvalidCommandError(command)
         return response.to_json()
@@ -6,8 +6,11 @@ manipulate the locally cached data representation, and at the same time,
 synchronize the data on the server.
 """
 
+import re
 import time
 from panban import json_api
+from panban.util import normalize_for_search, required_substrings, trigrams
+from panban.views import View
 from panban.json_api import exceptions
 from panban.api import UserFacingException
 from panban.json_api.eternal import (
@@ -23,15 +26,144 @@ class DatabaseAbstraction(object):
         self.nodes_by_id = {}
         self.features = []
         self.all_tags = []
+        self._all_tags_outdated = False
         self.json_api_version = None
         self.json_api = None
         self.last_modification = 0
+        self.materialized_board_ids = set()
+        self.sync_report = None
+        self.loaded_description_ids = set()
+        self.node_ids_by_label = {}
+        self.node_ids_by_tag = {}
+        self.node_ids_by_trigram = None  # built by the first search
+        self._last_search = None  # (pattern, IDs of the matching nodes)
+        self.views = {}  # query -> views.View, materialized by the first use
+        self.changed_everything = False
+        self.changed_column_ids = set()
+        self.changed_node_ids = set()
 
     def reload(self):
         self.get_columns()
+        self._rematerialize_boards()
+
+    def ensure_board(self, board_id):
+        """
+        Makes sure that the columns of the given board are loaded.
+
+        Backends with the feature "lazy_boards" send the columns of most
+        boards only when they are opened.
+        """
+        board = self.nodes_by_id.get(board_id)
+        if board is None or board.children or 'lazy_boards' not in self.features:
+            return
+        response = self.command('load_board', board_id=board_id)
+        if response.status != response.STATUS_OK:
+            raise UserFacingException('Could not load board.  More info: %s'
+                    % repr(response))
+        self.materialized_board_ids.add(board_id)
+        self._apply_delta(response.data)
+
+    def _rematerialize_boards(self):
+        for board_id in list(self.materialized_board_ids):
+            if board_id in self.nodes_by_id:
+                self.ensure_board(board_id)
+            else:
+                self.materialized_board_ids.discard(board_id)
 
     def sync(self):
-        self.command('sync')
+        """
+        Syncs the source with its remote counterpart.
+
+        Only the backend is involved, so this may be called from a background
+        thread.  Returns a list of paths that were changed by the sync, which
+        should be passed to reload_paths() in the main thread afterwards.
+        A summary of the sync from the backend, if any, is stored in
+        sync_report.
+        """
+        response = self.command('sync')
+        if response.status != response.STATUS_OK:
+            raise UserFacingException('Could not sync.  More info: %s'
+                    % repr(response))
+        self.sync_report = (response.data or {}).get('report')
+        return (response.data or {}).get('changed_paths', [])
+
+    def reload_paths(self, paths):
+        """
+        Updates the nodes that are stored in the given files.
+
+        If the backend can't reload single files, all nodes are fetched, but
+        only those that actually changed are replaced.
+        """
+        if 'incremental_reload' not in self.features:
+            self._reload_changed_nodes()
+            return
+
+        response = self.command('reload_paths', paths=list(paths))
+        if response.status != response.STATUS_OK:
+            raise UserFacingException('Could not reload.  More info: %s'
+                    % repr(response))
+        self._apply_delta(response.data)
+        self._rematerialize_boards()
+
+    def rebucket(self):
+        """
+        Moves the nodes whose column depends on the current date.
+
+        Call this when the day changed.  Backends without the feature
+        "rebucket" are reloaded, but only changed nodes are replaced.
+        """
+        if 'rebucket' not in self.features:
+            self._reload_changed_nodes()
+            return
+
+        response = self.command('rebucket')
+        if response.status != response.STATUS_OK:
+            raise UserFacingException('Could not update the columns.  '
+                    'More info: %s' % repr(response))
+        self._apply_delta(response.data)
+        self._rematerialize_boards()
+
+    def load_more(self, column_id):
+        """
+        Loads more nodes into the given column, e.g. older completed tasks.
+
+        Returns False if there was nothing more to load.
+        """
+        if 'load_more' not in self.features:
+            return False
+
+        response = self.command('load_more', column_id=column_id)
+        if response.status != response.STATUS_OK:
+            raise UserFacingException('Could not load more.  More info: %s'
+                    % repr(response))
+        self._apply_delta(response.data)
+        self._rematerialize_boards()
+        return bool(response.data.get('nodes') or
+                response.data.get('deleted_ids'))
+
+    def load_descriptions(self, node_ids):
+        """
+        Makes sure that the descriptions of the given nodes are loaded.
+
+        Backends with the feature "lazy_descriptions" leave them out of
+        "load_all", so they are requested here, all at once.
+        """
+        if 'lazy_descriptions' not in self.features:
+            return
+        missing = [node_id for node_id in node_ids if node_id in
+                self.nodes_by_id and node_id not in self.loaded_description_ids]
+        if not missing:
+            return
+
+        response = self.command('load_descriptions', node_ids=missing)
+        if response.status != response.STATUS_OK:
+            raise UserFacingException('Could not load descriptions.  '
+                    'More info: %s' % repr(response))
+        for node_id, description in response.data['descriptions'].items():
+            if node_id in self.nodes_by_id:
+                self.nodes_by_id[node_id].description = description
+        self.loaded_description_ids.update(missing)
+        self._mark_changed(missing)
 
     def get_columns(self):
         response = self.command('load_all')
@@ -41,15 +173,257 @@ class DatabaseAbstraction(object):
 
         self.root_node_ids = []
         self.nodes_by_id = {}
-        all_tags = set()
+        self.loaded_description_ids = set()
+        self.node_ids_by_label = {}
+        self.node_ids_by_tag = {}
+        self._all_tags_outdated = True
+        self.node_ids_by_trigram = None
+        self._last_search = None
+        for view in self.views.values():
+            view.node_ids = None
+        for node_json in response.data.values():
+            self._add_node_from_json(node_json)
+        self._update_all_tags()
+        self._mark_changed(everything=True)
+
+    def _reload_changed_nodes(self):
+        response = self.command('load_all')
+        if response.status != response.STATUS_OK:
+            raise UserFacingException('Could not fetch columns.  More info: %s'
+                    % repr(response))
+
+        changed = {}
         for node_id, node_json in response.data.items():
-            pnode = PortableNode.from_json(self.json_api, node_json)
-            node = Node.from_portable_node(pnode, self)
-            all_tags.update(node.tags)
-            if not node.parent:
-                self.root_node_ids.append(node.id)
-            self.nodes_by_id[node.id] = node
-        self.all_tags = list(sorted(all_tags))
+            node = self.nodes_by_id.get(node_id)
+            if node is None or node._raw_json != node_json:
+                changed[node_id] = node_json
+        deleted_ids = [node_id for node_id in self.nodes_by_id
+                if node_id not in response.data]
+        if changed or deleted_ids:
+            self._apply_delta({'nodes': changed, 'deleted_ids': deleted_ids})
+            self._rematerialize_boards()
+
+    def _reload_generated_ids(self):
+        """
+        Fetches the nodes again that a command changed, if the backend has
+        the feature "autogenerate_node_ids".
+
+        Such backends derive the ID of a node from its column and its
+        position in there, which the backend may assign differently than the
+        local copy, e.g. todo.txt orders a column by the lines of its file.
+        Only the nodes that differ afterwards are replaced.
+
+        >>> import os, tempfile
+        >>> from panban.backends import todotxt
+        >>> source = os.path.join(tempfile.mkdtemp(), 'todo.txt')
+        >>> _ = open(source, 'w').write('water plants\\nfix bug\\n'
+        ...     'x buy milk\\n')
+        >>> db = DatabaseAbstraction(todotxt.Handler(), source)
+        >>> db.reload()
+        >>> done = [node for node in db.nodes_by_id.values()
+        ...     if node.label == 'Done'][0]
+        >>> db.find_nodes_by_label('water plants')[0].move_to_column(done.id)
+        True
+        >>> db.find_nodes_by_label('water plants')[0].change_label('water cactus')
+        True
+        >>> db.find_nodes_by_label('fix bug')[0].change_label('fix bugs')
+        True
+        >>> print(open(source).read().replace(todotxt.today(), 'TODAY'), end='')
+        x TODAY water cactus
+        fix bugs
+        x buy milk
+        """
+        if 'autogenerate_node_ids' in self.features:
+            self._reload_changed_nodes()
+
+    def _add_node_from_json(self, node_json):
+        pnode = PortableNode.from_json(self.json_api, node_json)
+        node = Node.from_portable_node(pnode, self)
+        if not node.parent and node.id not in self.nodes_by_id:
+            self.root_node_ids.append(node.id)
+        if node.id in self.nodes_by_id:
+            self._unindex_node(self.nodes_by_id[node.id])
+        self.nodes_by_id[node.id] = node
+        self._index_node(node)
+        self.loaded_description_ids.discard(node.id)
+        return node
+
+    def _index_node(self, node):
+        self.node_ids_by_label.setdefault(node.label, []).append(node.id)
+        self._index_tags(node)
+        self._last_search = None
+        if self.node_ids_by_trigram is not None:
+            self._index_trigrams(node)
+
+    def _unindex_node(self, node):
+        node_ids = self.node_ids_by_label.get(node.label, [])
+        if node.id in node_ids:
+            node_ids.remove(node.id)
+            if not node_ids:
+                del self.node_ids_by_label[node.label]
+        self._unindex_tags(node)
+        self._last_search = None
+        if self.node_ids_by_trigram is not None:
+            for trigram in trigrams(normalize_for_search(node.label)):
+                node_ids = self.node_ids_by_trigram.get(trigram, set())
+                node_ids.discard(node.id)
+                if not node_ids:
+                    self.node_ids_by_trigram.pop(trigram, None)
+
+    def _index_tags(self, node):
+        for tag in node.tags:
+            if tag not in self.node_ids_by_tag:
+                self.node_ids_by_tag[tag] = set()
+                self._all_tags_outdated = True
+            self.node_ids_by_tag[tag].add(node.id)
+
+    def _unindex_tags(self, node):
+        for tag in node.tags:
+            node_ids = self.node_ids_by_tag.get(tag, set())
+            node_ids.discard(node.id)
+            if not node_ids and tag in self.node_ids_by_tag:
+                del self.node_ids_by_tag[tag]
+                self._all_tags_outdated = True
+
+    def find_node_ids_by_regex(self, pattern):
+        """
+        Returns the set of IDs of the nodes whose label matches the regular
+        expression, ignoring case.
+
+        Only the nodes that contain all trigrams of the literal text in the
+        pattern are matched against it, so e.g. "fix.*bug" checks just the
+        nodes with "fix" and "bug" in their label.
+        """
+        if self._last_search is not None and self._last_search[0] == pattern:
+            return self._last_search[1]
+        regex = re.compile(pattern, flags=re.I)
+
+        required = set()
+        for substring in required_substrings(pattern):
+            required.update(trigrams(normalize_for_search(substring)))
+        if required:
+            if self.node_ids_by_trigram is None:
+                self._build_trigram_index()
+            candidate_sets = sorted((self.node_ids_by_trigram.get(trigram, set())
+                    for trigram in required), key=len)
+            candidates = candidate_sets[0].intersection(*candidate_sets[1:])
+        else:
+            candidates = self.nodes_by_id
+
+        result = set(node_id for node_id in candidates
+                if regex.search(self.nodes_by_id[node_id].label))
+        self._last_search = (pattern, result)
+        return result
+
+    def _build_trigram_index(self):
+        self.node_ids_by_trigram = {}
+        for node in self.nodes_by_id.values():
+            self._index_trigrams(node)
+
+    def _index_trigrams(self, node):
+        for trigram in trigrams(normalize_for_search(node.label)):
+            self.node_ids_by_trigram.setdefault(trigram, set()).add(node.id)
+
+    def find_node_ids_by_view(self, query):
+        """
+        Returns the set of IDs of the tasks that match the query of a saved
+        view, see panban.views.  Raises ValueError if the query is invalid.
+
+        The set is kept up to date as nodes change, so it must not be
+        modified by the caller.
+        """
+        view = self.views.get(query)
+        if view is None:
+            view = self.views[query] = View(query)
+        if view.node_ids is None or view.is_outdated():
+            view.materialize(self)
+        return view.node_ids
+
+    def count_tag(self, tag):
+        """Returns the number of nodes with the given tag."""
+        return len(self.node_ids_by_tag.get(tag, ()))
+
+    def find_nodes_by_label(self, label):
+        return [self.nodes_by_id[node_id]
+                for node_id in self.node_ids_by_label.get(label, [])]
+
+    def _apply_delta(self, data):
+        """
+        Args:
+            data: A dict with the keys "nodes", containing the JSON of nodes
+                that were added or changed, and "deleted_ids", containing the
+                IDs of nodes that no longer exist.
+        """
+        node_ids = list(data.get('nodes', {})) + data.get('deleted_ids', [])
+        touched_boards = any(node_id in self.root_node_ids
+                for node_id in node_ids)
+        old_column_ids = self._columns_containing(node_ids)
+
+        for node_id in data.get('deleted_ids', []):
+            node = self.nodes_by_id.pop(node_id, None)
+            if node is not None:
+                self._unindex_node(node)
+            while node_id in self.root_node_ids:
+                self.root_node_ids.remove(node_id)
+        nodes = [self._add_node_from_json(node_json)
+                for node_json in data.get('nodes', {}).values()]
+        self._update_all_tags()
+
+        touched_boards = touched_boards or any(not node.parent for node in nodes)
+        column_ids = [node.id for node in nodes
+                if node.parent in self.root_node_ids]
+        self._mark_changed(node_ids, column_ids + old_column_ids,
+                everything=touched_boards)
+
+    def _columns_containing(self, node_ids):
+        node_ids = set(node_ids)
+        if not node_ids:
+            return []
+        return [column.id for board_id in self.root_node_ids
+                for column in self._get_board_columns(board_id)
+                if not node_ids.isdisjoint(column.children)]
+
+    def _mark_changed(self, node_ids=(), column_ids=(), everything=False):
+        """
+        Records which nodes were changed, along with the columns that show
+        them, so the frontend can update just those columns.  Set everything
+        to True if the boards themselves changed.
+        """
+        self.changed_everything = self.changed_everything or everything
+        self.changed_node_ids.update(node_ids)
+        self.changed_column_ids.update(column_ids)
+        self.changed_column_ids.update(self._columns_containing(node_ids))
+        self.last_modification = time.time()
+        for view in self.views.values():
+            if everything:
+                view.node_ids = None
+            elif view.node_ids is not None:
+                view.update(self, node_ids)
+
+    def has_changes(self):
+        return self.changed_everything or bool(self.changed_column_ids)
+
+    def take_changes(self):
+        """
+        Returns what changed since the last call as a tuple of a boolean,
+        which is True if the boards themselves changed, the set of changed
+        column IDs and the set of changed node IDs.
+        """
+        changes = (self.changed_everything, self.changed_column_ids,
+                self.changed_node_ids)
+        self.changed_everything = False
+        self.changed_column_ids = set()
+        self.changed_node_ids = set()
+        return changes
+
+    def _update_all_tags(self):
+        # A new list only if the set of tags changed, so that the frontend
+        # can cache lists that are derived from it
+        if self._all_tags_outdated:
+            all_tags = list(sorted(self.node_ids_by_tag))
+            if all_tags != self.all_tags:
+                self.all_tags = all_tags
+            self._all_tags_outdated = False
 
     def add_node(self, label, parent_id, prio, tags=None):
         if tags is None:
@@ -61,6 +435,48 @@ class DatabaseAbstraction(object):
     def get_root_nodes(self):
         return [self.nodes_by_id[id] for id in self.root_node_ids]
 
+    def _get_board_columns(self, board_id):
+        board = self.nodes_by_id[board_id]
+        return [self.nodes_by_id[column_id] for column_id in board.children
+                if column_id in self.nodes_by_id]
+
+    def _remove_from_columns(self, node_id):
+        # A node may be shown on several boards, see the feature "lazy_boards"
+        for board_id in self.root_node_ids:
+            for column in self._get_board_columns(board_id):
+                while node_id in column.children:
+                    column.children.remove(node_id)
+
+    def _move_to_column(self, node, column_id):
+        """
+        Moves the node into the given column, and on every other board that
+        shows the node, into the column at the same position.
+
+        Returns the ID of the new parent of the node, which is a column of
+        the board that the node belonged to before.
+        """
+        target = self.nodes_by_id[column_id]
+        if target.parent not in self.nodes_by_id:
+            return column_id
+        index = self.nodes_by_id[target.parent].children.index(column_id)
+        old_parent = self.nodes_by_id.get(node.parent)
+        home_board_id = old_parent.parent if old_parent else target.parent
+
+        new_parent_id = column_id
+        for board_id in self.root_node_ids:
+            columns = self._get_board_columns(board_id)
+            shown = any(node.id in column.children for column in columns)
+            if not shown and board_id != target.parent:
+                continue
+            for column in columns:
+                while node.id in column.children:
+                    column.children.remove(node.id)
+            if index < len(columns):
+                columns[index].children.append(node.id)
+                if board_id == home_board_id:
+                    new_parent_id = columns[index].id
+        return new_parent_id
+
     def command(self, command_string, **parameters):
         """
         Args:
@@ -118,16 +534,41 @@ class DatabaseAbstraction(object):
         # Update ID of node
         node.id = new_id
 
+        # Update "node_ids_by_label" and "node_ids_by_tag"
+        node_ids = self.node_ids_by_label.get(node.label, [])
+        if old_id in node_ids:
+            node_ids[node_ids.index(old_id)] = new_id
+        for tag in node.tags:
+            node_ids = self.node_ids_by_tag.setdefault(tag, set())
+            node_ids.discard(old_id)
+            node_ids.add(new_id)
+        if self.node_ids_by_trigram is not None:
+            for trigram in trigrams(normalize_for_search(node.label)):
+                node_ids = self.node_ids_by_trigram.setdefault(trigram, set())
+                node_ids.discard(old_id)
+                node_ids.add(new_id)
+        self._last_search = None
+        for view in self.views.values():
+            if view.node_ids is not None and old_id in view.node_ids:
+                view.node_ids.discard(old_id)
+                view.node_ids.add(new_id)
+
         # Update "nodes_by_id"
         del self.nodes_by_id[old_id]
         self.nodes_by_id[new_id] = node
 
-        # Update parent's children
-        if node.parent:
-            parent = self.nodes_by_id[node.parent]
-            for i in range(len(parent.children)):
-                if parent.children[i] == old_id:
-                    parent.children[i] = new_id
+        # Update parent's children, and the columns of other boards that
+        # show the node, see the feature "lazy_boards"
+        columns = [self.nodes_by_id[node.parent]] if node.parent else []
+        for board_id in self.root_node_ids:
+            columns.extend(self._get_board_columns(board_id))
+        for column in columns:
+            for i in range(len(column.children)):
+                if column.children[i] == old_id:
+                    column.children[i] = new_id
+
+        # The callers mark the columns as changed
+        self.changed_node_ids.update([old_id, new_id])
 
 
 class Node(object):
@@ -202,45 +643,54 @@ class Node(object):
         if response.status != response.STATUS_OK:
             raise UserFacingException('Could not delete.  More info: %s' % repr(response))
 
+        column_ids = self.db._columns_containing([self.id])
         if self.id in self.db.nodes_by_id:
             del self.db.nodes_by_id[self.id]
-        if self.parent in self.db.nodes_by_id:
-            parent = self.db.nodes_by_id[self.parent]
-            while self.id in parent.children:
-                parent.children.remove(self.id)
-        self.db.last_modification = time.time()
+            self.db._unindex_node(self)
+            self.db._update_all_tags()
+        self.db._remove_from_columns(self.id)
+        self.db._mark_changed([self.id], column_ids)
+        self.db._reload_generated_ids()
 
         return True
 
     def move_to_column(self, column_id):
-        # TODO: handle failure
         response = self.db.command('move_nodes', item_ids=[self.id],
             target_column=column_id)
+        # Backends that write each item separately report the result per item
+        results = (response.data or {}).get('item_results', {})
+        result = results.get(self.id, self.db.json_api.ITEM_RESULT_OK)
+        if response.status != response.STATUS_OK or \
+                result != self.db.json_api.ITEM_RESULT_OK:
+            if result == self.db.json_api.ITEM_RESULT_OK:
+                result = repr(response)
+            raise UserFacingException('Could not move.  More info: %s' % result)
 
         parent = None
         if self.parent:
             parent = self.db.nodes_by_id[self.parent]
-            while self.id in parent.children:
-                parent.children.remove(self.id)
-        target = self.db.nodes_by_id[column_id]
-        target.children.append(self.id)
-        self.parent = column_id
+        old_column_ids = self.db._columns_containing([self.id])
+        self.parent = self.db._move_to_column(self, column_id)
         self._update()
 
         if parent:
             for child in parent.children:
                 self.db.nodes_by_id[child]._update()
 
-        self.db.last_modification = time.time()
+        self.db._mark_changed([self.id], old_column_ids)
+        self.db._reload_generated_ids()
         return True
 
     def change_label(self, new_label):
         # TODO: handle failure
         response = self.db.command('change_label', item_id=self.id,
             new_label=new_label)
+        self.db._unindex_node(self)
         self.label = new_label
+        self.db._index_node(self)
         self._update()
-        self.db.last_modification = time.time()  # TODO: doesn't refresh view?
+        self.db._mark_changed([self.id])
+        self.db._reload_generated_ids()
         return True
 
     def change_description(self, new_description):
@@ -248,16 +698,39 @@ class Node(object):
             new_description=new_description)
         self.description = new_description
         self._update()
-        self.db.last_modification = time.time()
+        self.db._mark_changed([self.id])
+        self.db._reload_generated_ids()
         return True
 
     def change_prio(self, prio):
+        """
+        The backend may move the node to another column, e.g. todo.txt puts
+        todos with the highest priority into "High Prio":
+
+        >>> import os, tempfile
+        >>> from panban.backends import todotxt
+        >>> source = os.path.join(tempfile.mkdtemp(), 'todo.txt')
+        >>> _ = open(source, 'w').write('fix bug\\nwater plants\\n')
+        >>> db = DatabaseAbstraction(todotxt.Handler(), source)
+        >>> db.reload()
+        >>> db.find_nodes_by_label('fix bug')[0].change_prio(3)
+        >>> node = db.find_nodes_by_label('fix bug')[0]
+        >>> db.nodes_by_id[node.parent].label
+        'High Prio'
+        >>> node.change_label('fix bugs')
+        True
+        >>> db.find_nodes_by_label('fix bugs')[0].change_prio(0)
+        >>> print(open(source).read(), end='')
+        fix bugs
+        water plants
+        """
         assert prio in (0, 1, 2, 3)
         if self.prio != prio:
             self.db.command('change_prio', item_id=self.id, prio=prio)
             self.prio = prio
             self._update()
-            self.db.last_modification = time.time()
+            self.db._mark_changed([self.id])
+            self.db._reload_generated_ids()
 
     def add_tags(self, *tags):
         self._change_tags('add', tags)
@@ -277,6 +750,7 @@ class Node(object):
         self.db.command('change_tags', item_id=self.id, tags=tags,
                 action=param_table[action])
 
+        self.db._unindex_tags(self)
         if action == 'add':
             for tag in tags:
                 if tag not in self.tags:
@@ -286,10 +760,13 @@ class Node(object):
                 if tag in self.tags:
                     self.tags.remove(tag)
         elif action == 'clear':
-            new_value = []
+            del self.tags[:]
+        self.db._index_tags(self)
+        self.db._update_all_tags()
 
         self._update()
-        self.db.last_modification = time.time()
+        self.db._mark_changed([self.id])
+        self.db._reload_generated_ids()
         return True
 
     def _update(self):
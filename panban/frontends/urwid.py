@@ -1,15 +1,21 @@
+import collections
+import datetime
 import os
 import re
 import subprocess
 import tempfile
+import threading
 import time
 
 import urwid
 
-from panban.backends import get_backend_from_uri
+from panban import jump
+from panban import views
+from panban import watcher
+from panban.backends import get_backend_from_uri, get_local_path
 from panban.json_api.eternal import DEFAULT_PRIO
 from panban.api import UserFacingException
-from panban.util import extract_urls
+from panban.util import extract_urls, SortedIndex
 from panban.controller import DatabaseAbstraction
 
 VIM_KEYS = {
@@ -72,11 +78,66 @@ PRIO_LABELS = {
 CHOICE_ABORT = '[Cancel]'
 CHOICE_NEW_TAG = '[New Tag]'
 CHOICE_ALL_TAGS = '[All Tags]'
+CHOICE_ALL_TASKS = '[All Tasks]'
+CHOICE_NEW_VIEW = '[New View]'
+CHOICE_FORGET_VIEW = '[Forget View]'
+CHOICE_WIDTH = 23  # columns of the choice popup, unless its options are longer
+
+STATUS_TIMEOUT = 5  # seconds until transient status messages disappear
+SYNC_MAX_BACKOFF = 3600  # maximum seconds between retries of a failed sync
+WIDGET_CACHE_SIZE = 300  # entry widgets that a column keeps, at least a screenful
+FILTER_DELAY = 0.15  # seconds without typing before the regex filter is applied
+JUMP_RESULTS = 30  # tasks that the "jump to task" menu offers at most
+
+
+def sort_by_prio(node):
+    return (-(node.prio or 0), node.label)
+
+
+def sort_by_completion_date(node):
+    return (node.completion_date or '0000-00-00', node.label)
+
+
+def sort_by_creation_date(node):
+    return (node.creation_date or '0000-00-00', node.label)
+
+
+def sort_by_label(node):
+    return (node.label, )
+
+
+def group_by_prio(node):
+    return node.prio
+
+
+def group_by_completion_day(node):
+    return (node.completion_date or '')[:10]
+
+
+def group_by_creation_day(node):
+    return (node.creation_date or '')[:10]
+
+
+# name -> (label, key function, reverse, grouper)
+# Done columns are sorted by "completed" by default, all others by "prio".
+SORT_ORDERS = {
+    'prio': ('Priority', sort_by_prio, False, group_by_prio),
+    'completed': ('Completion date', sort_by_completion_date, True,
+        group_by_completion_day),
+    'created': ('Creation date', sort_by_creation_date, True,
+        group_by_creation_day),
+    'label': ('Label', sort_by_label, False, None),
+}
+CHOICE_DEFAULT_SORT_ORDER = '[Default]'
+
+TAG_PRIORITIES_LABEL = 'Tag Priorities'  # see _apply_priorities_from_task_description()
 
 
 class UI(object):
-    def __init__(self, source_uris, initial_tab=None, debug=False, theme=None, use_titlebar=True):
+    def __init__(self, source_uris, initial_tab=None, debug=False, theme=None, use_titlebar=True,
+            sync_interval=0):
         self.dbs = {}
+        self.watcher = None
         for source_uri in source_uris:
             self.load_db(source_uri)
 
@@ -88,8 +149,11 @@ class UI(object):
         self.initial_tab = initial_tab
         self.filter_regex = None
         self.filter_tag = None
+        self.view = None  # a query of views.load_views(), or None
+        self.sort_order = None  # a key of SORT_ORDERS, or None for the default
         self.hide_left_column = False
         self.use_titlebar = use_titlebar
+        self.sync_interval = sync_interval
 
         self.theme = DEFAULT_THEME
         if theme is not None:
@@ -98,9 +162,12 @@ class UI(object):
 
         self.kanban_layout = KanbanLayout(self)
         self.base = Base(self, self.db, self.kanban_layout)
-        self.tabs = None  # DEPRECATED. there's always only one "tab".
+        self.tabs = None  # The boards (root nodes) of the current database
+        self.active_board_id = None
 
         self._tag_priorities = dict()
+        self._tag_priorities_cache = {}  # description -> tag priorities
+        self._sorted_tags = None  # see _get_sorted_tags()
 
         self._choice_callback = None
         self._choice_callback_params = ()
@@ -110,6 +177,19 @@ class UI(object):
         self._choice_quick_keys = None
         self._choice_styles = ()
 
+        self._sync_thread = None
+        self._sync_result = None
+        self._sync_pipe = None
+        self._sync_alarm = None
+        self._sync_delay = sync_interval
+        self._status_alarm = None
+        self._rebucket_alarm = None
+        self._filter_alarm = None
+        self._filter_regex_before_edit = None
+        self._jump_indexes = {}  # source URI -> jump.JumpIndex
+        self._watch_pipe = None
+        self._watch_buffer = b''
+
         self._original_urwid_SHOW_CURSOR = urwid.escape.SHOW_CURSOR
 
     def _parse_theme(self, theme):
@@ -143,6 +223,8 @@ class UI(object):
             source_backend = get_backend_from_uri(source_uri)
             backend_handler = source_backend.Handler()
             self.dbs[source_uri] = DatabaseAbstraction(backend_handler, source_uri)
+            if self.watcher is not None:
+                self._watch_source(source_uri)
         else:
             raise Exception("Duplicate Source: %s" % source_uri)
 
@@ -153,8 +235,10 @@ class UI(object):
 
         self.db = self.dbs[source_uri]
         self.db_uri = source_uri
+        self.active_board_id = None
         self.db.reload()
         self.rebuild()
+        self._sync_on_load()
 
     def rotate_db(self, offset):
         if len(self.dbs) > 1:
@@ -172,6 +256,11 @@ class UI(object):
                 self.loop.screen.set_terminal_properties(colors=256)
             except:
                 pass
+            self._sync_pipe = self.loop.watch_pipe(self._sync_finished)
+            self._schedule_sync()
+            self._schedule_rebucket()
+            self._start_watcher()
+            self._sync_on_load()
         else:
             raise Exception("Do not call UI.activate() more than once!")
 
@@ -186,6 +275,184 @@ class UI(object):
         self.base.reload()
         self.loop.start()
 
+    def _start_watcher(self):
+        self._watch_pipe = self.loop.watch_pipe(self._files_changed)
+        self.watcher = watcher.create_watcher(self._report_changed_paths)
+        for source_uri in self.dbs:
+            self._watch_source(source_uri)
+        self.watcher.start()
+
+    def _watch_source(self, source_uri):
+        path = get_local_path(source_uri)
+        if path is None:
+            return
+        try:
+            if os.path.isdir(path):
+                self.watcher.watch_directory(path)
+            else:
+                self.watcher.watch_file(path)
+        except OSError as e:
+            self.set_status('Not watching %s: %s' % (path, e), timeout=STATUS_TIMEOUT)
+
+    def _report_changed_paths(self, paths):
+        # Called from the watcher thread, so hand the paths over to the
+        # main loop through the watch pipe.
+        os.write(self._watch_pipe, b''.join(os.fsencode(path) + b'\0'
+                for path in paths))
+
+    def _files_changed(self, data):
+        # Called in the main loop through the watch pipe
+        self._watch_buffer += data
+        *chunks, self._watch_buffer = self._watch_buffer.split(b'\0')
+        changed = set(os.fsdecode(chunk) for chunk in chunks)
+
+        for source_uri, db in self.dbs.items():
+            source_path = get_local_path(source_uri)
+            if source_path is None:
+                continue
+            absolute = os.path.abspath(source_path)
+            paths = []
+            for path in changed:
+                if path == absolute:
+                    paths.append(source_path)
+                elif path.startswith(absolute + os.sep):
+                    # Use the same form of the path as the backend
+                    paths.append(os.path.join(source_path,
+                        os.path.relpath(path, absolute)))
+            if not paths or not db.nodes_by_id:
+                continue
+            try:
+                db.reload_paths(paths)
+            except Exception as e:
+                # e.g. another program is still in the middle of writing
+                self.set_status('Could not reload %s: %s' % (source_path, e),
+                        timeout=STATUS_TIMEOUT)
+                continue
+            if db is self.db:
+                self.refresh()
+        return True  # Keep the pipe open
+
+    def set_status(self, text, timeout=None):
+        self.base.set_status(text)
+        if self.loop is None:
+            return
+        if self._status_alarm is not None:
+            self.loop.remove_alarm(self._status_alarm)
+            self._status_alarm = None
+        if timeout is not None:
+            self._status_alarm = self.loop.set_alarm_in(
+                    timeout, lambda loop, data: self.set_status(''))
+
+    def load_more(self, column_id):
+        if self.db.load_more(column_id):
+            self.refresh()
+        else:
+            self.set_status('Nothing more to load', timeout=STATUS_TIMEOUT)
+
+    def load_descriptions(self, nodes):
+        """
+        Loads the descriptions of the given nodes and of their children, if
+        the backend didn't send them yet.
+        """
+        node_ids = []
+        for node in nodes:
+            node_ids.append(node.id)
+            node_ids.extend(node.children)
+        try:
+            self.db.load_descriptions(node_ids)
+        except Exception as e:
+            self.set_status(str(e), timeout=STATUS_TIMEOUT)
+
+    def sync(self):
+        """
+        Syncs the current database in a background thread.
+
+        When the sync is done, only the files that were changed by it are
+        reloaded, see _sync_finished().
+        """
+        if self._sync_thread is not None:
+            return  # A sync is already running
+        db = self.db
+        self.set_status('Syncing %s...' % os.path.basename(self.db_uri))
+
+        def run():
+            try:
+                self._sync_result = (db, db.sync(), None)
+            except Exception as e:
+                self._sync_result = (db, [], e)
+            os.write(self._sync_pipe, b'.')
+
+        self._sync_thread = threading.Thread(target=run, daemon=True)
+        self._sync_thread.start()
+
+    def _sync_finished(self, data):
+        # Called in the main loop through the watch pipe
+        self._sync_thread.join()
+        self._sync_thread = None
+        db, changed_paths, error = self._sync_result
+
+        if error is not None:
+            # Back off exponentially while the sync keeps failing
+            self._sync_delay = min(max(self._sync_delay, 1) * 2, SYNC_MAX_BACKOFF)
+            self.set_status('Sync failed: %s' % error)
+        else:
+            self._sync_delay = self.sync_interval
+            message = 'Sync done, %d file(s) changed' % len(changed_paths)
+            if db.sync_report:
+                message += ' (%s)' % db.sync_report
+            if changed_paths:
+                try:
+                    db.reload_paths(changed_paths)
+                except Exception as e:
+                    message = 'Could not reload after sync: %s' % e
+                else:
+                    if db is self.db:
+                        self.refresh()
+            self.set_status(message, timeout=STATUS_TIMEOUT)
+
+        self._schedule_sync()
+        return True  # Keep the pipe open
+
+    def _schedule_sync(self):
+        if self._sync_alarm is not None:
+            self.loop.remove_alarm(self._sync_alarm)
+            self._sync_alarm = None
+        if self.sync_interval:
+            self._sync_alarm = self.loop.set_alarm_in(
+                    self._sync_delay, self._sync_alarm_callback)
+
+    def _sync_on_load(self):
+        # The backend showed us a local copy, fetch the latest data
+        if 'sync_on_load' in self.db.features:
+            self.sync()
+
+    def _sync_alarm_callback(self, loop, data):
+        self._sync_alarm = None
+        if 'sync' in self.db.features:
+            self.sync()
+        else:
+            self._schedule_sync()
+
+    def _schedule_rebucket(self):
+        # Columns like "Active" depend on the date, so they need to be
+        # updated when the day changes.
+        tomorrow = datetime.date.today() + datetime.timedelta(1)
+        midnight = time.mktime(tomorrow.timetuple())
+        self._rebucket_alarm = self.loop.set_alarm_at(midnight,
+                self._rebucket_alarm_callback)
+
+    def _rebucket_alarm_callback(self, loop, data):
+        self._rebucket_alarm = None
+        # Other databases are reloaded anyway when switching to them
+        try:
+            self.db.rebucket()
+        except Exception as e:
+            self.set_status('Could not update the columns: %s' % e,
+                    timeout=STATUS_TIMEOUT)
+        else:
+            self.refresh()
+        self._schedule_rebucket()
+
     def hide_cursor(self):
         # Workaround, see https://github.com/urwid/urwid/issues/170
         urwid.escape.SHOW_CURSOR = ''
@@ -252,6 +519,135 @@ class UI(object):
     def edit_string_async(self, string, title, callback, callback_params=None):
         self.base._open_edit_popup(string, title, callback, callback_params)
 
+    def edit_filter_regex(self):
+        """
+        Asks for a regex to filter the entries by, applying it while typing.
+        """
+        self._filter_regex_before_edit = self.filter_regex
+        self.base._open_edit_popup('', 'Regex Filter', self.change_filter_regex,
+                change_callback=self._schedule_filter_regex,
+                cancel_callback=self._cancel_filter_regex)
+
+    def change_filter_regex(self, pattern):
+        self._remove_filter_alarm()
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            self.set_status('Invalid regex: %s' % e, timeout=STATUS_TIMEOUT)
+            return
+        if (pattern or None) != self.filter_regex:
+            self.filter_regex = pattern or None
+            self.rebuild()
+
+    def _schedule_filter_regex(self, pattern):
+        # Wait for a pause in typing, so that large boards aren't filtered
+        # after every single key
+        self._remove_filter_alarm()
+        self._filter_alarm = self.loop.set_alarm_in(FILTER_DELAY,
+                lambda loop, data: self._filter_while_typing(pattern))
+
+    def _filter_while_typing(self, pattern):
+        self._filter_alarm = None
+        try:
+            re.compile(pattern)
+        except re.error:
+            return  # The regex is probably not finished yet
+        self.change_filter_regex(pattern)
+
+    def _cancel_filter_regex(self):
+        self._remove_filter_alarm()
+        if self.filter_regex != self._filter_regex_before_edit:
+            self.filter_regex = self._filter_regex_before_edit
+            self.rebuild()
+
+    def _remove_filter_alarm(self):
+        if self._filter_alarm is not None:
+            self.loop.remove_alarm(self._filter_alarm)
+            self._filter_alarm = None
+
+    def user_choice_jump(self, query, exit_key=None):
+        """
+        Offers the tasks of all sources that match the query, see
+        jump.fuzzy_score(), and jumps to the chosen one.
+        """
+        if not query.strip():
+            return
+        results = []
+        for source_uri in self.dbs:
+            index = self._get_jump_index(source_uri)
+            for score, entry in index.search(query, limit=JUMP_RESULTS):
+                results.append((score, entry + [source_uri]))
+        results.sort(key=jump.jump_order)
+        if not results:
+            self.set_status('No task matches "%s"' % query,
+                    timeout=STATUS_TIMEOUT)
+            return
+
+        options = {}
+        for score, entry in results[:JUMP_RESULTS]:
+            node_id, label, board_id, board_label, column_label, source_uri = entry
+            place = [column_label]
+            if board_label != source_uri:
+                place.insert(0, board_label)
+            if len(self.dbs) > 1:
+                place.insert(0, os.path.basename(source_uri))
+            options[(source_uri, board_id, node_id, label)] = \
+                    '%s  (%s)' % (label, ' / '.join(place))
+        self.user_choice(
+            options=options,
+            callback=self.jump_to_task,
+            exit_key=exit_key,
+        )
+
+    def _get_jump_index(self, source_uri):
+        index = self._jump_indexes.get(source_uri)
+        if index is None:
+            index = self._jump_indexes[source_uri] = jump.JumpIndex(source_uri)
+            index.load()
+        db = self.dbs[source_uri]
+        fingerprint = jump.source_fingerprint(source_uri)
+
+        # Sources are only loaded if the index is missing or out of date
+        outdated = index.updated_at is None or (fingerprint is not None and
+                fingerprint != index.fingerprint)
+        if outdated and not db.nodes_by_id:
+            db.reload()
+        if outdated or (db.nodes_by_id and
+                db.last_modification > index.updated_at):
+            index.update(db, fingerprint)
+            try:
+                index.save()
+            except OSError as e:
+                self.set_status('Could not save the index: %s' % e,
+                        timeout=STATUS_TIMEOUT)
+        return index
+
+    def jump_to_task(self, target):
+        """
+        Opens the board of the task and focuses it.  Filters that would hide
+        the task are reset.
+        """
+        source_uri, board_id, node_id, label = target
+        if source_uri != self.db_uri:
+            self.change_db(source_uri)
+        if node_id not in self.db.nodes_by_id:
+            # The index was older than the source, try to find it by label
+            nodes = self.db.find_nodes_by_label(label)
+            if not nodes:
+                self.set_status('The task "%s" no longer exists' % label,
+                        timeout=STATUS_TIMEOUT)
+                return
+            node_id = nodes[0].id
+        if board_id in self.db.nodes_by_id:
+            self.active_board_id = board_id
+        self.filter_regex = None
+        self.filter_tag = None
+        self.view = None
+        self.rebuild()
+        if not self.kanban_layout.focus_node(node_id):
+            self.set_status('The task "%s" is not on this board' % label,
+                    timeout=STATUS_TIMEOUT)
+
     def user_choice(
             self,
             options,
@@ -285,20 +681,67 @@ class UI(object):
             focus=current_db_index,
         )
 
+    def user_choice_board(self, exit_key=None):
+        options = dict((board.id, board.label) for board in self.tabs)
+        self.user_choice(
+            options=options,
+            callback=self.change_board,
+            exit_key=exit_key,
+            focus=self.kanban_layout.active_tab_nr,
+        )
+
+    def change_board(self, board_id):
+        if board_id != self.active_board_id:
+            self.active_board_id = board_id
+            self.rebuild()
+
+    def user_choice_sort_order(self, exit_key=None):
+        options = {None: CHOICE_DEFAULT_SORT_ORDER}
+        for name, sort_order in SORT_ORDERS.items():
+            options[name] = sort_order[0]
+        self.user_choice(
+            options=options,
+            callback=self.change_sort_order,
+            exit_key=exit_key,
+            focus=list(options).index(self.sort_order),
+        )
+
+    def change_sort_order(self, name):
+        """
+        Sorts the entries of all columns by the given key of SORT_ORDERS, or
+        by the default order of each column if name is None.
+        """
+        if name != self.sort_order:
+            self.sort_order = name
+            self.rebuild()
+
+    def _get_sorted_tags(self):
+        """
+        Returns the tags sorted by priority, and a list of their styles.
+        Both are cached until the tags or their priorities change.
+        """
+        all_tags = self.db.all_tags
+        if self._sorted_tags is None or self._sorted_tags[0] is not all_tags \
+                or self._sorted_tags[1] is not self._tag_priorities:
+            # all_tags is sorted already, and the sort is stable
+            tags = sorted(all_tags,
+                    key=lambda tag: -self._tag_priorities.get(tag, DEFAULT_PRIO))
+            styles = []
+            for tag in tags:
+                style = COLOR_MAP_BY_PRIO[self._tag_priorities.get(tag, DEFAULT_PRIO)]
+                styles.append((style, style + '_focused'))
+            self._sorted_tags = (all_tags, self._tag_priorities, tags, styles)
+        return self._sorted_tags[2:]
+
     def user_choice_filtertag(self, exit_key=None):
-        all_tags = list(self.db.all_tags)
-        all_tags.sort()
-        all_tags.sort(key=lambda tag: -self._tag_priorities.get(tag, DEFAULT_PRIO))
-        options = [CHOICE_ALL_TAGS] + all_tags
-        styles = [None]
-        for tag in all_tags:
-            prio = self._tag_priorities.get(tag, DEFAULT_PRIO)
-            style = COLOR_MAP_BY_PRIO[prio]
-            styles.append((style, style + '_focused'))
+        tags, styles = self._get_sorted_tags()
+        options = {CHOICE_ALL_TAGS: CHOICE_ALL_TAGS}
+        for tag in tags:
+            options[tag] = '%s (%d)' % (tag, self.db.count_tag(tag))
 
         self.user_choice(
             options=options,
-            styles=styles,
+            styles=[None] + styles,
             callback=self._user_choice_filtertag_callback,
             exit_key=exit_key,
         )
@@ -312,10 +755,76 @@ class UI(object):
         if self.filter_tag != old_filter_tag:
             self.rebuild()
 
+    def user_choice_view(self, exit_key=None):
+        # Other panban instances may have saved views in the meantime
+        queries = views.load_views()
+        options = {CHOICE_ALL_TASKS: CHOICE_ALL_TASKS}
+        for query in queries:
+            try:
+                count = len(self.db.find_node_ids_by_view(query))
+            except ValueError:
+                options[query] = '%s (invalid)' % query
+            else:
+                options[query] = '%s (%d)' % (query, count)
+        options[CHOICE_NEW_VIEW] = CHOICE_NEW_VIEW
+        if self.view in queries:
+            options[CHOICE_FORGET_VIEW] = CHOICE_FORGET_VIEW
+        self.user_choice(
+            options=options,
+            callback=self._user_choice_view_callback,
+            exit_key=exit_key,
+            focus=list(options).index(self.view if self.view in options
+                else CHOICE_ALL_TASKS),
+        )
+
+    def _user_choice_view_callback(self, choice):
+        if choice == CHOICE_NEW_VIEW:
+            self.edit_string_async('', 'New View', self._new_view_callback)
+        elif choice == CHOICE_FORGET_VIEW:
+            queries = views.load_views()
+            if self.view in queries:
+                queries.remove(self.view)
+                self._save_views(queries)
+            self.change_view(None)
+        elif choice == CHOICE_ALL_TASKS:
+            self.change_view(None)
+        else:
+            self.change_view(choice)
+
+    def _new_view_callback(self, query):
+        query = ' '.join(query.split())
+        if query and self.change_view(query):
+            queries = views.load_views()
+            if query not in queries:
+                self._save_views(queries + [query])
+
+    def _save_views(self, queries):
+        try:
+            views.save_views(queries)
+        except OSError as e:
+            self.set_status('Could not save the views: %s' % e,
+                    timeout=STATUS_TIMEOUT)
+
+    def change_view(self, query):
+        """
+        Shows only the tasks that match the query of a saved view, see
+        panban.views, or all tasks if query is None.  Returns False if the
+        query is invalid.
+        """
+        if query is not None:
+            try:
+                self.db.find_node_ids_by_view(query)
+            except ValueError as e:
+                self.set_status('Invalid view: %s' % e, timeout=STATUS_TIMEOUT)
+                return False
+        if query != self.view:
+            self.view = query
+            self.rebuild()
+        return True
+
     def user_choice_addtag(self, node, exit_key=None):
-        possible_new_tags = list(set(self.db.all_tags) - set(node.tags))
-        possible_new_tags.sort()
-        possible_new_tags.sort(key=lambda tag: -self._tag_priorities.get(tag, DEFAULT_PRIO))
+        tags, _ = self._get_sorted_tags()
+        possible_new_tags = [tag for tag in tags if tag not in node.tags]
         options = [CHOICE_ABORT] + possible_new_tags + [CHOICE_NEW_TAG]
         self.user_choice(
             options=options,
@@ -329,14 +838,10 @@ class UI(object):
             self.edit_string_async('', 'Add Tag', self._user_choice_addtag_edit_callback, [node])
         elif choice not in (CHOICE_ABORT, CHOICE_NEW_TAG):
             node.add_tags(choice)
-            # TODO: This reload is excessive and should be handled by updating the cache instead
-            self.reload()
 
     def _user_choice_addtag_edit_callback(self, tag_name, node):
         if tag_name:
             node.add_tags(tag_name)
-            # TODO: This reload is excessive and should be handled by updating the cache instead
-            self.reload()
 
     def user_choice_removetag(self, node, exit_key=None):
         options = [CHOICE_ABORT] + sorted(node.tags)
@@ -350,8 +855,6 @@ class UI(object):
     def _user_choice_removetag_callback(self, choice, node):
         if choice != CHOICE_ABORT:
             node.remove_tags(choice)
-            # TODO: This reload is excessive and should be handled by updating the cache instead
-            self.reload()
 
     def user_choice_prio(self, node, exit_key=None):
         self.user_choice(
@@ -363,10 +866,7 @@ class UI(object):
         )
 
     def _user_choice_prio_callback(self, prio, node):
-        old_prio = node.prio
         node.change_prio(prio)
-        if old_prio != node.prio:
-            self.rebuild()
 
     def _add_node(self, column_id, prio):
         self.edit_string_async('', 'New Task', self._add_node_callback, [column_id, prio])
@@ -375,8 +875,6 @@ class UI(object):
         if new_label.strip():
             tags = [self.filter_tag] if self.filter_tag else []
             self.db.add_node(new_label, column_id, prio=prio, tags=tags)
-            # TODO: This rebuild is excessive and should be handled by updating the cache instead
-            self.rebuild()
 
     def open_in_browser(self, url):
         subprocess.Popen(['firefox', url])
@@ -391,6 +889,8 @@ class UI(object):
         except KeyboardInterrupt:
             pass
         finally:
+            if self.watcher is not None:
+                self.watcher.stop()
             self.deactivate()
 
     def reload(self):
@@ -398,14 +898,40 @@ class UI(object):
         self.rebuild()
 
     def rebuild(self):
-        self.last_rebuild = time.time()
-
         root_nodes = self.db.get_root_nodes()
         self._apply_priorities_from_task_description(root_nodes)
-        root_nodes.sort(key=lambda node: node.label)
-        root_nodes.sort(key=lambda node: -(node.prio or 0))
+        root_nodes.sort(key=sort_by_prio)
         self.tabs = root_nodes
-        self.kanban_layout.reload()
+
+        # Keep the same board open, even if the order of the boards changed
+        board_ids = [node.id for node in root_nodes]
+        if self.active_board_id not in board_ids:
+            self.active_board_id = board_ids[0] if board_ids else None
+        if self.active_board_id is not None:
+            index = board_ids.index(self.active_board_id)
+            self.kanban_layout.active_tab_nr = index
+            self.db.ensure_board(self.active_board_id)
+            self.tabs[index] = self.db.nodes_by_id[self.active_board_id]
+
+        everything, column_ids, node_ids = self.db.take_changes()
+        self.kanban_layout.reload(None if everything else node_ids)
+        self.db.take_changes()
+        self.last_rebuild = time.time()
+
+    def refresh(self):
+        """
+        Updates the columns that changed since the last rebuild.  Everything
+        is rebuilt only if the boards themselves changed.
+        """
+        everything, column_ids, node_ids = self.db.take_changes()
+        tag_priorities = self._get_tag_priorities()
+        if everything or tag_priorities is not self._tag_priorities or \
+                not self.kanban_layout.reload_columns(column_ids, node_ids):
+            self.rebuild()
+        else:
+            # Descriptions loaded along the way are already shown
+            self.db.take_changes()
+            self.last_rebuild = time.time()
 
     def _apply_priorities_from_task_description(self, root_nodes):
         # (Written on 2023-05-02. Details may have changed since then)
@@ -440,51 +966,57 @@ class UI(object):
         #
         # This description is edited in the easiest way with the "B" key which
         # opens the description of the task in a separate panban board.
+        #
+        # The table is cached until the description changes, so that rebuilds
+        # don't have to parse it again.
 
-        from panban.backends import markdown
-        from panban.controller import DatabaseAbstraction
-        import io
-
-        prio_node = None
-        task = None
-        for uid, task in self.db.nodes_by_id.items():
-            if task.label == 'Tag Priorities':
-                prio_node = task
-                break
-
-        if task is None or not task.description:
-            self._tag_priorities = dict()
-            return
-
-        def get_tag_priorities(markdown_string):
-            handler = markdown.Handler(json_api='1')
-            nodes = handler.load_markdown_string(task.description)
-            root_ids = [uid for uid, node in nodes.items()
-                if not node.parent]
-            columns = [node for node in nodes.values()
-                if node.parent in root_ids]
-            priority_map = {
-                'High': 3,
-                'Medium': 2,
-                'Low': 1,
-                'None': 0,
-            }
-            tag_priorities = dict()
-            for column in columns:
-                try:
-                    prio = priority_map[column.label]
-                except KeyError:
-                    continue
-                for child_id in column.children:
-                    child = nodes[child_id]
-                    tag_priorities[child.label] = prio
-            return tag_priorities
-
-        self._tag_priorities = get_tag_priorities(task.description)
+        self._tag_priorities = self._get_tag_priorities()
         for node in root_nodes:
             if node.label in self._tag_priorities:
                 node.prio = self._tag_priorities[node.label]
 
+    def _get_tag_priorities(self):
+        tasks = self.db.find_nodes_by_label(TAG_PRIORITIES_LABEL)
+        description = tasks[0].description if tasks else None
+        if description not in self._tag_priorities_cache:
+            # Only the table of the current description is kept
+            self._tag_priorities_cache = {
+                description: parse_tag_priorities(description)}
+        return self._tag_priorities_cache[description]
+
+
+def parse_tag_priorities(markdown_string):
+    """
+    Returns a dict of tag -> priority, see the comment in
+    UI._apply_priorities_from_task_description().
+    """
+    if not markdown_string:
+        return dict()
+
+    from panban.backends import markdown
+    handler = markdown.Handler(json_api='1')
+    nodes = handler.load_markdown_string(markdown_string)
+    root_ids = [uid for uid, node in nodes.items()
+        if not node.parent]
+    columns = [node for node in nodes.values()
+        if node.parent in root_ids]
+    priority_map = {
+        'High': 3,
+        'Medium': 2,
+        'Low': 1,
+        'None': 0,
+    }
+    tag_priorities = dict()
+    for column in columns:
+        try:
+            prio = priority_map[column.label]
+        except KeyError:
+            continue
+        for child_id in column.children:
+            child = nodes[child_id]
+            tag_priorities[child.label] = prio
+    return tag_priorities
+
 
 class DummyButton(urwid.Button):
     button_left = urwid.Text("")
@@ -499,8 +1031,16 @@ class EntryButton(urwid.Button):
         self.ui = ui
         self.columnbox = columnbox
         self.entry = entry
+        self.important = entry.is_important()
         super().__init__(self._generate_button_text())
 
+    def update(self, entry):
+        """Shows the current data of the entry, which may be a new object."""
+        self.entry = entry
+        text = self._generate_button_text()
+        if text != self.get_label():
+            self.set_label(text)
+
     def _generate_button_text(self):
         e = self.entry
         if self.entry.is_important():
@@ -526,10 +1066,6 @@ class EntryButton(urwid.Button):
         if new_label.strip() and self._old_label != new_label:
             self.entry.change_label(new_label)
 
-            # TODO: This reload/rebuild is excessive and should be handled by updating the cache instead
-            self.ui.db.reload()
-            self.ui.rebuild()
-
     def keypress(self, size, key):
         if key == 'enter':
             self.edit_label()
@@ -553,16 +1089,15 @@ class EntryButton(urwid.Button):
             # NOTE: if you change the key for this binding, update exit_key:
             self.ui.user_choice_prio(self.entry, exit_key='p')
         elif key == 'E':
+            self.ui.load_descriptions([self.entry])
             new_descr = self.ui.edit_string_externally(self.entry.description or '')
             if new_descr == '':
                 new_descr = None
             self.entry.change_description(new_descr)
-            # TODO: This reload/rebuild is excessive and should be handled by updating the cache instead
-            self.ui.db.reload()
-            self.ui.rebuild()
         elif key == 'A':
             self.ui._add_node(self.columnbox.column.id, self.entry.prio)
         elif key == 'B':
+            self.ui.load_descriptions([self.entry])
             self.ui.edit_in_panban(self.entry.description,
                                    callback=self.entry.change_description,
                                    backend='markdown')
@@ -571,30 +1106,42 @@ class EntryButton(urwid.Button):
             tab = self.ui.tabs[self.ui.kanban_layout.active_tab_nr]
             column_id = tab.children[key_int]
             self.entry.move_to_column(column_id)
-            # TODO: This reload is excessive and should be handled by updating the cache instead
-            self.ui.reload()
         else:
             return key
 
 
 class Base(urwid.WidgetPlaceholder):
-    def __init__(self, ui, db, content):
+    def __init__(self, ui, db, kanban_layout):
+        content = urwid.Frame(kanban_layout)
         super().__init__(content)
         self.ui = ui
         self.db = db
+        self.kanban_layout = kanban_layout
         self.content_widget = content
         self.choice_widget = ChoiceMenuBox(self.ui)
-        self.overlay_widget_choice = urwid.Overlay(
-            urwid.LineBox(self.choice_widget),
-            content, 'center', 23, 'middle', 10)
+        self.choice_linebox = urwid.LineBox(self.choice_widget)
+        self.overlay_widget_choice = urwid.Overlay(self.choice_linebox,
+            content, 'center', CHOICE_WIDTH, 'middle', 10)
 
     def _open_choice_popup(self):
         self.choice_widget.load_options()
+        # Widen the popup for long options, e.g. in the "jump to task" menu
+        labels = self.ui._choice_options
+        if isinstance(labels, dict):
+            labels = labels.values()
+        if max([len(label) for label in labels] or [0]) + 4 > CHOICE_WIDTH:
+            width = ('relative', 80)
+        else:
+            width = CHOICE_WIDTH
+        self.overlay_widget_choice.set_overlay_parameters('center', width,
+                'middle', 10, min_width=CHOICE_WIDTH)
         self.original_widget = self.overlay_widget_choice
 
-    def _open_edit_popup(self, edit_text, title=None, callback=None, callback_params=None):
+    def _open_edit_popup(self, edit_text, title=None, callback=None, callback_params=None,
+            change_callback=None, cancel_callback=None):
         self.ui.show_cursor()
-        self._edit_widget = EditBox(self.ui, edit_text, callback, callback_params)
+        self._edit_widget = EditBox(self.ui, edit_text, callback, callback_params,
+                change_callback, cancel_callback)
         self._overlay_widget_edit = urwid.Overlay(
             urwid.Filler(urwid.LineBox(self._edit_widget, title=title)),
             self.content_widget, 'center', 42, 'middle', 6)
@@ -604,19 +1151,40 @@ class Base(urwid.WidgetPlaceholder):
         self.ui.hide_cursor()
         self.original_widget = self.content_widget
 
+    def set_status(self, text):
+        if text:
+            self.content_widget.footer = urwid.AttrMap(urwid.Text(text), 'header')
+        else:
+            self.content_widget.footer = None
+
     def reload(self):
         self.db.reload()
-        self.content_widget.reload()
+        self.kanban_layout.reload()
 
     def keypress(self, size, key):
-        if self.db.last_modification > self.ui.last_rebuild:
-            self.ui.rebuild()
-
+        # Show changes from outside of the UI, e.g. by a background sync,
+        # before the key is handled, and those made by the key right after
+        if self.ui.db.has_changes():
+            self.ui.refresh()
+        key = self._handle_key(size, key)
+        if self.ui.db.has_changes():
+            self.ui.refresh()
+        return key
+
+    def _handle_key(self, size, key):
         key = super().keypress(size, key)
         if key == 'q':
             self.ui.user_choice_filtertag()
         elif key == 's':
             self.ui.user_choice_source(exit_key='s')
+        elif key == 'b':
+            self.ui.user_choice_board(exit_key='b')
+        elif key == 'O':
+            self.ui.user_choice_sort_order(exit_key='O')
+        elif key == 'v':
+            self.ui.user_choice_view(exit_key='v')
+        elif key == 'f':
+            self.ui.edit_string_async('', 'Jump to Task', self.ui.user_choice_jump)
         elif key == 'tab':
             self.ui.rotate_db(1)
         elif key == 'shift tab':
@@ -626,7 +1194,7 @@ class Base(urwid.WidgetPlaceholder):
         elif key == 'R':
             self.reload()
         elif key == '/':
-            self.ui.edit_string_async('', 'Regex Filter', self._apply_filter)
+            self.ui.edit_filter_regex()
         elif key == 'esc':
             if self.ui.filter_regex:
                 # First, ESC resets the search/regex filter
@@ -636,26 +1204,38 @@ class Base(urwid.WidgetPlaceholder):
                 # The second ESC press resets the tag filter
                 self.ui.filter_tag = None
                 self.ui.rebuild()
+            elif self.ui.view:
+                # And the third one leaves the view
+                self.ui.change_view(None)
         elif key == 'y':
-            self.ui.deactivate()
-            self.ui.db.sync()
-            self.ui.reactivate()
-            self.ui.reload()
+            self.ui.sync()
         else:
             return key
 
-    def _apply_filter(self, pattern):
-        self.ui.filter_regex = pattern
-        self.ui.rebuild()
-
 
 class ChoiceMenuBox(urwid.ListBox):
+    """
+    The list of options of the choice popup.  Typing narrows the options
+    down to those that contain the typed text.
+    """
+
     def __init__(self, ui):
         self.ui = ui
-        self.list_walker = urwid.SimpleFocusListWalker([])
+        self.list_walker = ChoiceWalker(self)
         super().__init__(self.list_walker)
 
     def keypress(self, size, key):
+        filter_text = self.list_walker.filter_text
+        if key == 'backspace':
+            self.set_filter(filter_text[:-1])
+            return
+        # Until something is typed, "q", space and the exit key keep their
+        # meaning of closing the popup or choosing the focused option
+        if len(key) == 1 and key.isprintable() and (filter_text or
+                key not in ('q', ' ', self.ui._choice_exit_key)):
+            self.set_filter(filter_text + key)
+            return
+
         key = super().keypress(size, key)
 
         if key in ('tab', 'q', 'esc') or (self.ui._choice_exit_key is not None
@@ -663,31 +1243,111 @@ class ChoiceMenuBox(urwid.ListBox):
             self.ui.base._close_popup()
         # Do NOT return the key here to block downstream key bindings
 
-    def load_options(self):
-        self.list_walker[:] = []
-        # TODO: clean up button objects. disconnect signals if necessary
+    def set_filter(self, filter_text):
+        self.list_walker.set_filter(filter_text)
+        if filter_text:
+            title = '%s (%d)' % (filter_text, len(self.list_walker.rows))
+        else:
+            title = ''
+        self.ui.base.choice_linebox.set_title(title)
 
+    def load_options(self):
         if isinstance(self.ui._choice_options, dict):
-            options = [(value, label) for value, label in self.ui._choice_options.items()]
+            options = list(self.ui._choice_options.items())
         else:
             options = [(label, label) for label in self.ui._choice_options]
+        self.list_walker.set_options(options, self.ui._choice_styles,
+                self.ui._choice_focus or 0)
+        self.ui.base.choice_linebox.set_title('')
 
-        for i, option in enumerate(options):
-            value, label = option
-            button = ChoiceMenuButton(self, self.ui, value, label)
 
-            styles = self.ui._choice_styles
-            if styles and i < len(styles) and styles[i] is not None:
-                style, style_focused = styles[i]
-            else:
-                style, style_focused = 'button', 'button_focused'
+class ChoiceWalker(urwid.ListWalker):
+    """
+    Supplies the options of a ChoiceMenuBox, creating the widgets of the
+    options only when the ListBox asks for them, i.e. for the visible rows.
 
-            urwid.connect_signal(button, 'click', ChoiceMenuButton.click)
-            button = urwid.AttrMap(button, style, style_focused)
-            self.list_walker.append(button)
+    Positions are indexes into "rows", the indexes of the options that match
+    the filter text.
+    """
 
-        if self.ui._choice_focus:
-            self.list_walker.set_focus(self.ui._choice_focus)
+    def __init__(self, menu):
+        self.menu = menu
+        self.options = []  # (value, label)
+        self.styles = ()
+        self.rows = []
+        self.filter_text = ''
+        self.focus = 0
+        self._folded_labels = None  # built by the first filter
+        # option index -> widget, the least recently used first
+        self._widgets = collections.OrderedDict()
+
+    def set_options(self, options, styles, focus):
+        self.options = options
+        self.styles = styles
+        self.rows = list(range(len(options)))
+        self.filter_text = ''
+        self.focus = focus if focus < len(options) else 0
+        self._folded_labels = None
+        self._widgets.clear()
+        self._modified()
+
+    def set_filter(self, filter_text):
+        if self._folded_labels is None:
+            self._folded_labels = [label.lower() for _, label in self.options]
+        folded_text = filter_text.lower()
+        if self.filter_text and folded_text.startswith(self.filter_text.lower()):
+            candidates = self.rows  # A longer text only removes options
+        else:
+            candidates = range(len(self.options))
+        focused_option = self.rows[self.focus] if self.rows else None
+
+        self.rows = [index for index in candidates
+                if folded_text in self._folded_labels[index]]
+        self.filter_text = filter_text
+
+        # Keep the focus on the same option, if it's still there
+        self.focus = 0
+        if focused_option in self.rows:
+            self.focus = self.rows.index(focused_option)
+        self._modified()
+
+    def set_focus(self, position):
+        self.focus = position
+        self._modified()
+
+    def next_position(self, position):
+        if position + 1 >= len(self.rows):
+            raise IndexError(position)
+        return position + 1
+
+    def prev_position(self, position):
+        if position <= 0:
+            raise IndexError(position)
+        return position - 1
+
+    def positions(self, reverse=False):
+        if reverse:
+            return range(len(self.rows) - 1, -1, -1)
+        return range(len(self.rows))
+
+    def __getitem__(self, position):
+        if position < 0 or position >= len(self.rows):
+            raise IndexError(position)
+        index = self.rows[position]
+        widget = self._widgets.pop(index, None)
+        if widget is None:
+            value, label = self.options[index]
+            button = ChoiceMenuButton(self.menu, self.menu.ui, value, label)
+            urwid.connect_signal(button, 'click', ChoiceMenuButton.click)
+            if index < len(self.styles) and self.styles[index] is not None:
+                style, style_focused = self.styles[index]
+            else:
+                style, style_focused = 'button', 'button_focused'
+            widget = urwid.AttrMap(button, style, style_focused)
+        self._widgets[index] = widget
+        while len(self._widgets) > WIDGET_CACHE_SIZE:
+            self._widgets.popitem(last=False)
+        return widget
 
 
 class ChoiceMenuButton(urwid.Button):
@@ -705,7 +1365,8 @@ class ChoiceMenuButton(urwid.Button):
 
 
 class EditBox(urwid.Edit):
-    def __init__(self, ui, edit_text, callback=None, callback_params=None):
+    def __init__(self, ui, edit_text, callback=None, callback_params=None,
+            change_callback=None, cancel_callback=None):
         super().__init__(edit_text=edit_text, multiline=False)
         self.ui = ui
         self.callback = callback
@@ -713,16 +1374,25 @@ class EditBox(urwid.Edit):
             self.callback_params = []
         else:
             self.callback_params = callback_params
+        self.change_callback = change_callback
+        self.cancel_callback = cancel_callback
 
     def keypress(self, size, key):
         if key == 'esc':
             self.ui.base._close_popup()
+            if self.cancel_callback:
+                self.cancel_callback()
         elif key == 'enter':
+            # Close first, the callback may open another popup
+            self.ui.base._close_popup()
             if self.callback:
                 self.callback(self.edit_text, *self.callback_params)
-            self.ui.base._close_popup()
         else:
-            return super().keypress(size, key)
+            old_text = self.edit_text
+            key = super().keypress(size, key)
+            if self.change_callback and self.edit_text != old_text:
+                self.change_callback(self.edit_text)
+            return key
 
 
 class KanbanLayout(urwid.Columns):
@@ -731,24 +1401,43 @@ class KanbanLayout(urwid.Columns):
         self.active_tab_nr = 0
         self.hide_metadata = not self.ui.debug
         self.hide_description = True
+        self._columnboxes = {}  # column ID -> ColumnBox of the active board
         super().__init__([], dividechars=1)
         for key, value in VIM_KEYS.items():
             self._command_map[key] = value
 
-    def reload(self):
+    def reload(self, changed_ids=None):
+        """
+        Args:
+            changed_ids: the IDs of the nodes that changed since the last
+                reload, or None if anything may have changed
+        """
         try:
             focus = self.focus_position
         except IndexError:
             focus = None
 
+        columns = list(self.get_column_nodes())
+        if not self.hide_description or not self.hide_metadata:
+            self.ui.load_descriptions(columns)
+
         columnboxes = []
-        for i, column in enumerate(self.get_column_nodes()):
+        old_columnboxes = self._columnboxes
+        self._columnboxes = {}
+        for i, column in enumerate(columns):
             if i == 0 and self.ui.hide_left_column:
                 continue
 
-            # TODO: don't re-create ColumnBoxes on each reload
-            columnbox = ColumnBox(self.ui, column)
+            # Reuse the ColumnBox along with the widgets of its entries
+            columnbox = old_columnboxes.get(column.id)
+            if columnbox is None:
+                columnbox = ColumnBox(self.ui, column)
+            else:
+                columnbox.column = column
+                columnbox.label = column.label
+                columnbox.update_order(changed_ids)
             columnbox.reload()
+            self._columnboxes[column.id] = columnbox
             columnboxes.append((columnbox, self.options()))
         self.contents = columnboxes
 
@@ -758,6 +1447,41 @@ class KanbanLayout(urwid.Columns):
             else:
                 self.focus_position = focus  # TODO: does this help?
 
+    def reload_columns(self, column_ids, node_ids):
+        """
+        Reloads the given columns of the active board, updating only the
+        widgets of the given nodes.  Returns False if the whole layout has to
+        be reloaded instead, e.g. because a column was renamed.
+        """
+        columns_by_id = dict((column.id, column)
+                for column in self.get_column_nodes())
+        columns = []
+        for column_id in column_ids:
+            if column_id not in self._columnboxes:
+                continue  # Not shown
+            column = columns_by_id.get(column_id)
+            if column is None or \
+                    column.label != self._columnboxes[column_id].label:
+                return False
+            columns.append(column)
+
+        if not self.hide_description or not self.hide_metadata:
+            self.ui.load_descriptions(columns)
+        for column in columns:
+            columnbox = self._columnboxes[column.id]
+            columnbox.column = column
+            columnbox.update_order(node_ids)
+            columnbox.reload(node_ids)
+        return True
+
+    def focus_node(self, node_id):
+        """Focuses the entry of the node.  Returns False if it's not shown."""
+        for position, (columnbox, _) in enumerate(self.contents):
+            if columnbox.focus_node(node_id):
+                self.focus_position = position
+                return True
+        return False
+
     def get_column_nodes(self):
         if self.active_tab_nr < len(self.ui.tabs):
             active_tab = self.ui.tabs[self.active_tab_nr]
@@ -779,32 +1503,203 @@ class KanbanLayout(urwid.Columns):
         else:
             return key
 
+class ColumnWalker(urwid.ListWalker):
+    """
+    Supplies the rows of a ColumnBox, creating the widgets of the entries only
+    when the ListBox asks for them, i.e. for the visible rows and a few more.
+
+    Positions are integers: -2 and -1 are the title bar and the divider below
+    it, 2*i + 1 is the i-th entry, and 2*i is the divider in front of it,
+    which only exists if the entry starts a new group.
+    """
+
+    def __init__(self, columnbox):
+        self.columnbox = columnbox
+        self.header = None
+        self.nodes = []
+        self.grouper = None
+        self.focus = None
+        self._divider = urwid.Divider()
+        self._dummy = None
+        # node ID -> (generation, widget), the least recently used first
+        self._widgets = collections.OrderedDict()
+        self._generation = 0
+
+    def set_rows(self, header, nodes, grouper, changed_ids=None):
+        """
+        Args:
+            header: the widget of the title bar, or None
+            nodes: the sorted and filtered entries
+            grouper: a function returning the group of an entry, or None
+            changed_ids: the IDs of the entries whose widgets have to be
+                updated, or None to update all of them
+        """
+        focused_index = None
+        focused_id = None
+        if self.focus is not None and self.focus > 0 and self.focus % 2 == 1:
+            focused_index = (self.focus - 1) // 2
+            if focused_index < len(self.nodes):
+                focused_id = self.nodes[focused_index].id
+
+        self.header = header
+        self.nodes = nodes
+        self.grouper = grouper
+        if changed_ids is None:
+            self._generation += 1  # The cached widgets have to be updated
+        else:
+            for node_id in changed_ids:
+                if node_id in self._widgets:
+                    self._widgets[node_id] = (None, self._widgets[node_id][1])
+
+        # Keep the focus on the same entry, if it's still there
+        for index, node in enumerate(nodes):
+            if node.id == focused_id:
+                self.focus = 2 * index + 1
+                break
+        else:
+            if focused_index is not None and focused_index < len(nodes):
+                self.focus = 2 * focused_index + 1
+            else:
+                # Avoid starting with the bottom item focused
+                self.focus = self._first_position()
+        self._modified()
+
+    def _first_position(self):
+        return -2 if self.header is not None else 1
+
+    def _starts_group(self, index):
+        if index == 0 or self.grouper is None:
+            return False
+        return self.grouper(self.nodes[index]) != \
+                self.grouper(self.nodes[index - 1])
+
+    def set_focus(self, position):
+        self.focus = position
+        self._modified()
+
+    def next_position(self, position):
+        if position == -2:
+            return -1
+        if position == -1:
+            return 1
+        if position % 2 == 0:
+            return position + 1
+        index = (position + 1) // 2
+        if index >= len(self.nodes):
+            raise IndexError(position)
+        return 2 * index if self._starts_group(index) else 2 * index + 1
+
+    def prev_position(self, position):
+        if position == -2:
+            raise IndexError(position)
+        if position == -1:
+            return -2
+        if position % 2 == 0:
+            return position - 1
+        index = (position - 1) // 2
+        if self._starts_group(index):
+            return 2 * index
+        if index > 0:
+            return 2 * index - 1
+        if self.header is None:
+            raise IndexError(position)
+        return -1
+
+    def __getitem__(self, position):
+        if position == -2 and self.header is not None:
+            return self.header
+        if position == -1 and self.header is not None:
+            return self._divider
+        if position < 0:
+            raise IndexError(position)
+
+        index, is_entry = divmod(position, 2)
+        if not self.nodes and position == 1:
+            if self._dummy is None:
+                color = COLOR_MAP_BY_PRIO[DEFAULT_PRIO]
+                self._dummy = urwid.AttrMap(DummyButton(""), color,
+                        color + '_focused')
+            return self._dummy
+        if index >= len(self.nodes):
+            raise IndexError(position)
+        if not is_entry:
+            if not self._starts_group(index):
+                raise IndexError(position)
+            return self._divider
+        return self._get_widget(self.nodes[index])
+
+    def _get_widget(self, entry):
+        # Widgets are cached across reloads and only updated when they are
+        # shown again.  Those of entries that weren't shown for a while are
+        # dropped, so the number of widgets doesn't grow with the column.
+        generation, widget = self._widgets.pop(entry.id, (None, None))
+        if widget is None or widget.original_widget.important != \
+                entry.is_important():
+            widget = urwid.AttrMap(EntryButton(self.columnbox.ui,
+                self.columnbox, entry), None)
+            generation = None
+        elif generation != self._generation:
+            widget.original_widget.update(entry)
+
+        if generation != self._generation:
+            if entry.is_important():
+                color = 'important'
+            else:
+                color = COLOR_MAP_BY_PRIO[entry.prio]
+            if widget.attr_map != {None: color}:
+                widget.set_attr_map({None: color})
+                widget.set_focus_map({None: color + '_focused'})
+
+        self._widgets[entry.id] = (self._generation, widget)
+        while len(self._widgets) > WIDGET_CACHE_SIZE:
+            self._widgets.popitem(last=False)
+        return widget
+
+
 class ColumnBox(urwid.ListBox):
     def __init__(self, ui, column):
         self.ui = ui
         self.label = column.label
         self.column = column
-        self.list_walker = urwid.SimpleFocusListWalker([])
+        self.list_walker = ColumnWalker(self)
+        self._order = None  # A SortedIndex of the entries
         super().__init__(self.list_walker)
         for key, value in VIM_KEYS.items():
             self._command_map[key] = value
 
-    def reload(self):
-        focus = self.list_walker.focus
+    def update_order(self, changed_ids):
+        """
+        Moves the changed entries to their new position in the sort order,
+        or forgets the order if changed_ids is None.
+        """
+        if self._order is None:
+            return
+        if changed_ids is None or self.column.id in changed_ids:
+            self._order = None
+            return
+        if not changed_ids:
+            return
+
+        children = set(self.column.children)
+        for node_id in changed_ids:
+            if node_id in children:
+                self._order.update(self.ui.db.nodes_by_id[node_id])
+            else:
+                self._order.discard(node_id)
 
+    def reload(self, changed_ids=None):
         for column in self.ui.kanban_layout.get_column_nodes():
             if column.label == self.label:
                 break
         else:
             raise UserFacingException('Column with label %s does not exist' % self.label)
 
-        self.list_walker[:] = []
-
         if not self.ui.kanban_layout.hide_metadata:
             label = "%s <%s>" % (self.label, column.id[:8])
         else:
             label = self.label
 
+        header = None
         if self.ui.use_titlebar:
             palette_keys = [component[0] for component in self.ui.palette]
             palette_key = 'header_' + self.label.lower().replace(' ', '_')
@@ -812,70 +1707,46 @@ class ColumnBox(urwid.ListBox):
                 styling = palette_key
             else:
                 styling = 'header'
-
-            self.list_walker.append(urwid.AttrMap(urwid.Text(label), styling))
-            self.list_walker.append(urwid.Divider())
+            header = urwid.AttrMap(urwid.Text(label), styling)
 
         done = self.label.lower() in DONE_COLUMNS
         active = self.label.lower() in ACTIVE_COLUMNS
-        nodes = list(column.getChildrenNodes())
+        sort_order = self.ui.sort_order or ('completed' if done else 'prio')
+        _, key, reverse, grouper = SORT_ORDERS[sort_order]
+        if active:
+            grouper = None
 
+        if self._order is None or self._order.key is not key:
+            self._order = SortedIndex(key, column.getChildrenNodes())
+        node_ids = None
+        if self.ui.view:
+            node_ids = self.ui.db.find_node_ids_by_view(self.ui.view)
         if self.ui.filter_tag:
-            nodes = [node for node in nodes if self.ui.filter_tag in node.tags]
+            matches = self.ui.db.node_ids_by_tag.get(self.ui.filter_tag, set())
+            node_ids = matches if node_ids is None else node_ids & matches
         if self.ui.filter_regex:
-            filter_regex = re.compile(self.ui.filter_regex, flags=re.I)
-            nodes = [node for node in nodes if filter_regex.search(node.label)]
-
-        nodes.sort(key=lambda node: node.label)
-        if done:
-            nodes.sort(key=lambda node: node.completion_date or '0000-00-00')
-            nodes.reverse()
+            matches = self.ui.db.find_node_ids_by_regex(self.ui.filter_regex)
+            node_ids = matches if node_ids is None else node_ids & matches
+        if node_ids is None:
+            nodes = list(reversed(self._order) if reverse else self._order)
         else:
-            nodes.sort(key=lambda node: -(node.prio or 0))
-
-        def extract_day(node):
-            return (node.completion_date or '')[:10]
-
-        previous_group = None
-        if done:
-            grouper = extract_day
-        elif active:
-            grouper = None
-        else:
-            grouper = lambda node: node.prio
-
-        for entry in nodes:
-            if grouper is not None:
-                group = grouper(entry)
-            else:
-                group = 1
-
-            if group != previous_group and previous_group is not None:
-                #self.list_walker.append(urwid.Divider())
-                self.list_walker.append(urwid.Divider())
-            previous_group = group
-
-            widget = EntryButton(self.ui, self, entry)
-            if entry.is_important():
-                color = 'important'
-            else:
-                color = COLOR_MAP_BY_PRIO[entry.prio]
-            widget = urwid.AttrMap(widget, color, color + '_focused')
-            self.list_walker.append(widget)
+            nodes = self._order.select(node_ids, reverse)
 
-        if not nodes:
-            widget = DummyButton("")
-            color = COLOR_MAP_BY_PRIO[DEFAULT_PRIO]
-            widget = urwid.AttrMap(widget, color, color + '_focused')
-            self.list_walker.append(widget)
+        self.list_walker.set_rows(header, nodes, grouper, changed_ids)
 
-        if not focus:  # Avoid starting with the bottom item focused
-            self.list_walker.set_focus(0)
+    def focus_node(self, node_id):
+        for index, node in enumerate(self.list_walker.nodes):
+            if node.id == node_id:
+                self.set_focus(2 * index + 1)
+                return True
+        return False
 
     def keypress(self, size, key):
         key = super().keypress(size, key)
         if key == 'A':
             # This is only reached when there is no focused node in the column
             self.ui._add_node(self.column.id, DEFAULT_PRIO)
+        elif key == 'M':
+            self.ui.load_more(self.column.id)
         else:
             return key
@@ -16,12 +16,22 @@ VALID_COMMANDS = [
     'delete_nodes',
     'add_node',
     'sync',
+    'reload_paths',
+    'load_board',
+    'rebucket',
+    'load_more',
+    'load_descriptions',
 ]
 
 PARAM_TAG_ADD = 'add'
 PARAM_TAG_REMOVE = 'remove'
 PARAM_TAG_CLEAR = 'clear'
 
+# Commands that operate on several items at once may report the outcome for
+# each item in data['item_results'], mapping item IDs to this constant on
+# success or to an error message on failure.
+ITEM_RESULT_OK = 'ok'
+
 VALID_FEATURES = [
     # The feature "autogenerate_node_ids" updates the IDs of nodes by applying
     # json_api.generate_node_id whenever a node changes, to solve the problem
@@ -31,6 +41,42 @@ VALID_FEATURES = [
     # A better solution might be if the Backend sends a mapping of old IDs to
     # new IDs in the response to the manipulation request.
     'autogenerate_node_ids',
+
+    # The feature "incremental_reload" means that the backend implements the
+    # command "reload_paths", which re-reads only the given files and responds
+    # with the nodes that changed and the IDs of nodes that vanished.
+    'incremental_reload',
+
+    # The feature "sync" means that the backend implements the command "sync"
+    # and that it's safe to run it in a background thread.
+    'sync',
+
+    # The feature "lazy_boards" means that "load_all" may return root nodes
+    # without children, whose columns have to be fetched with the command
+    # "load_board" before showing them.  Their columns may reference nodes
+    # whose parent is a column of another board, so a node can appear on
+    # several boards without being duplicated.
+    'lazy_boards',
+
+    # The feature "rebucket" means that the backend implements the command
+    # "rebucket", which moves only those nodes whose column depends on the
+    # current date (e.g. due dates or thresholds) after the day changed.
+    'rebucket',
+
+    # The feature "load_more" means that some columns (e.g. completed tasks)
+    # show only the most recent nodes at first, and that the command
+    # "load_more" adds older ones.
+    'load_more',
+
+    # The feature "sync_on_load" means that "load_all" may answer with a
+    # stale local copy of the data, so the frontend should run the command
+    # "sync" in the background right after loading the source.
+    'sync_on_load',
+
+    # The feature "lazy_descriptions" means that "load_all" leaves out the
+    # descriptions of the nodes, and that the command "load_descriptions"
+    # sends them when the frontend is about to show them.
+    'lazy_descriptions',
 ]
 
 class JSONEncoder(json.JSONEncoder):
@@ -71,6 +117,7 @@ def decode_node(json_data):
     >>> node.pos
     3
     """
+    raw_json = json_data
     if isinstance(json_data, str):
         json_data = json.loads(json_data)
     elif not isinstance(json_data, dict):
@@ -82,6 +129,7 @@ def decode_node(json_data):
             'children', 'creation_date', 'tags', 'completion_date'):
         if key in json_data:
             setattr(node, key, json_data[key])
+    node._raw_json = raw_json
     return node
 
 
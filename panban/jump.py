@@ -0,0 +1,192 @@
+"""
+Indexes the tasks of every source, so that they can be found without
+opening the source first.
+
+The index of each source is stored in the cache directory, along with a
+fingerprint of the files of the source.  As long as the fingerprint still
+matches, the index is searched without loading the source.  Remote sources
+have no fingerprint, their index is updated whenever they are loaded.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from panban.backends import get_local_path
+
+INDEX_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or
+        os.path.expanduser('~/.cache'), 'panban', 'jump')
+INDEX_VERSION = 1
+WORD_SEPARATORS = ' -_/.:#@+'
+
+
+def fuzzy_score(query, text):
+    """
+    Returns how well the characters of the query match the text, in order
+    and ignoring case, or None if they don't match.
+
+    Consecutive characters and characters at the start of words score higher.
+
+    >>> fuzzy_score('fb', 'Fix bug') > fuzzy_score('fb', 'fabric')
+    True
+    >>> fuzzy_score('bgu', 'fix bug') is None
+    True
+    """
+    text = text.lower()
+    score = 0
+    position = -1
+    for char in query.lower():
+        if char == ' ':
+            continue
+        found = text.find(char, position + 1)
+        if found == -1:
+            return None
+        score += 1
+        if found == position + 1:
+            score += 2
+        if found == 0 or text[found - 1] in WORD_SEPARATORS:
+            score += 3
+        position = found
+    return score
+
+
+def source_fingerprint(source_uri):
+    """
+    Returns a string that changes whenever the files of the source change,
+    or None if the source is remote.
+    """
+    path = get_local_path(source_uri)
+    if path is None:
+        return None
+
+    if os.path.isdir(path):
+        paths = [os.path.join(directory, filename)
+                for directory, _, filenames in os.walk(path)
+                for filename in filenames]
+    else:
+        paths = [path]
+    stats = []
+    for path in sorted(paths):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        stats.append((path, stat.st_mtime_ns, stat.st_size))
+    return hashlib.sha256(repr(stats).encode('utf-8')).hexdigest()
+
+
+def jump_order(scored_entry):
+    """The sort key of (score, entry) tuples, the best match first."""
+    score, entry = scored_entry
+    return (-score, len(entry[1]), entry[1])
+
+
+class JumpIndex(object):
+    """
+    The tasks of a source, with the board and the column that they are on.
+
+    >>> from panban.backends import markdown
+    >>> from panban.controller import DatabaseAbstraction
+    >>> directory = tempfile.mkdtemp()
+    >>> source = os.path.join(directory, 'tasks.md')
+    >>> _ = open(source, 'w').write('# Todo\\n\\n- fix bug\\n- write docs\\n'
+    ...     '\\n# Done\\n\\n- buy flowers\\n')
+    >>> db = DatabaseAbstraction(markdown.Handler(), source)
+    >>> db.reload()
+    >>> index = JumpIndex(source, directory=directory)
+    >>> index.update(db, source_fingerprint(source))
+    >>> index.save()
+    >>> [(entry[1], entry[4]) for score, entry in index.search('bu')]
+    [('buy flowers', 'Done'), ('fix bug', 'Todo')]
+
+    The index is stored on the disk, so it can be searched without loading
+    the source again, as long as the files of the source are unchanged:
+
+    >>> index = JumpIndex(source, directory=directory)
+    >>> index.load(), index.fingerprint == source_fingerprint(source)
+    (True, True)
+    >>> [entry[1] for score, entry in index.search('wdoc')]
+    ['write docs']
+    >>> _ = open(source, 'a').write('- water plants\\n')
+    >>> index.fingerprint == source_fingerprint(source)
+    False
+    """
+
+    def __init__(self, source_uri, directory=INDEX_DIR):
+        self.source_uri = source_uri
+        name = hashlib.sha256(source_uri.encode('utf-8')).hexdigest()[:32]
+        self.path = os.path.join(directory, name + '.json')
+        self.fingerprint = None
+        self.updated_at = None  # None until the index is loaded or updated
+        # Lists of [node ID, label, board ID, board label, column label]
+        self.entries = []
+
+    def load(self):
+        """Returns False if there is no usable index yet."""
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get('version') != INDEX_VERSION or \
+                data.get('source') != self.source_uri:
+            return False
+        self.fingerprint = data['fingerprint']
+        self.updated_at = data['updated_at']
+        self.entries = data['entries']
+        return True
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({
+                'version': INDEX_VERSION,
+                'source': self.source_uri,
+                'fingerprint': self.fingerprint,
+                'updated_at': self.updated_at,
+                'entries': self.entries,
+            }, f)
+        os.replace(temp_path, self.path)
+
+    def update(self, db, fingerprint):
+        """
+        Replaces the entries with the tasks of the loaded database.
+
+        A task that is shown on several boards is indexed with the first one.
+        """
+        entries = []
+        seen_ids = set()
+        for board in db.get_root_nodes():
+            for column in db._get_board_columns(board.id):
+                for node_id in column.children:
+                    node = db.nodes_by_id.get(node_id)
+                    if node is None or node_id in seen_ids:
+                        continue
+                    seen_ids.add(node_id)
+                    entries.append([node_id, node.label, board.id,
+                        board.label, column.label])
+        self.entries = entries
+        self.fingerprint = fingerprint
+        self.updated_at = time.time()
+
+    def search(self, query, limit=None):
+        """
+        Returns a list of (score, entry) of the entries that match the query
+        best, see fuzzy_score().
+        """
+        scored = []
+        for entry in self.entries:
+            score = fuzzy_score(query, entry[1])
+            if score is not None:
+                scored.append((score, entry))
+        scored.sort(key=jump_order)
+        return scored[:limit]
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -13,6 +13,7 @@ def main():
         debug=args.debug,
         theme=theme,
         use_titlebar=args.titlebar,
+        sync_interval=args.sync_interval,
     )
     frontend.main()
 
@@ -33,6 +34,8 @@ def parse_arguments():
             help='Enable debugging features')
     parser.add_argument('--no-titlebar', dest='titlebar', action='store_false',
             help='Hide the title bar', default=True)
+    parser.add_argument('--sync-interval', type=int, default=0, metavar='SECONDS',
+            help='Sync the database in the background every SECONDS seconds')
     parser.add_argument('source', type=str, nargs='+', metavar='DATABASE_SOURCE')
     args = parser.parse_args()
     return args
@@ -0,0 +1,372 @@
+"""
+Stand-in servers for the doctests of the network backends.
+
+They listen on a random port of 127.0.0.1 and run in a background thread,
+so that the backends can be tested without network access.
+"""
+
+import datetime
+import hashlib
+import http.server
+import json
+import math
+import re
+import threading
+import time
+import urllib.parse
+import xml.etree.ElementTree as ET
+
+NS_DAV = 'DAV:'
+NS_CALDAV = 'urn:ietf:params:xml:ns:caldav'
+NS_CALSERVER = 'http://calendarserver.org/ns/'
+
+
+class StandInServer(object):
+    """
+    Base class that runs a threaded HTTP/1.1 server with keep-alive.
+
+    Subclasses implement handle(request) which returns a tuple
+    (status, headers, body).
+    """
+
+    def __init__(self):
+        server = self
+
+        class RequestHandler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with server.lock:
+                    server.connection_count += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def _dispatch(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                self.body = self.rfile.read(length) if length else b''
+                with server.lock:
+                    server.request_count += 1
+                    status, headers, body = server.handle(self)
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_PUT = do_DELETE = do_PROPFIND = do_REPORT = _dispatch
+
+        self.lock = threading.RLock()
+        self.connection_count = 0
+        self.request_count = 0
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                RequestHandler)
+        self.httpd.daemon_threads = True
+        self.url = 'http://127.0.0.1:%d' % self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                daemon=True)
+        self.thread.start()
+
+    def handle(self, request):
+        raise NotImplementedError("Please override this method!")
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class StandInCalDAVServer(StandInServer):
+    """
+    Serves a single calendar collection at /calendar/.
+
+    Supports just enough of CalDAV for panban.backends.caldav.CalDAVClient:
+    PROPFIND for getctag/sync-token/getetag, the REPORTs sync-collection and
+    calendar-multiget, as well as GET, PUT and DELETE with preconditions.
+    Like many servers, it can leave out the ETag from responses to PUT.
+    """
+    COLLECTION = '/calendar/'
+
+    def __init__(self, support_sync_collection=True, etag_on_put=True):
+        self.resources = {}  # href -> (etag, data)
+        self.changelog = []  # (revision, href)
+        self.revision = 0
+        self.support_sync_collection = support_sync_collection
+        self.etag_on_put = etag_on_put
+        super().__init__()
+
+    def put_resource(self, name, data):
+        """Creates or changes a resource, like another client would."""
+        with self.lock:
+            self._store(self.COLLECTION + name, data)
+
+    def delete_resource(self, name):
+        with self.lock:
+            self._remove(self.COLLECTION + name)
+
+    def _store(self, href, data):
+        self.revision += 1
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        etag = '"%d"' % self.revision
+        self.resources[href] = (etag, data)
+        self.changelog.append((self.revision, href))
+        return etag
+
+    def _remove(self, href):
+        self.revision += 1
+        del self.resources[href]
+        self.changelog.append((self.revision, href))
+
+    def _token(self):
+        return 'http://example.com/sync/%d' % self.revision
+
+    def handle(self, request):
+        method = request.command
+        path = request.path
+        if method == 'PROPFIND':
+            return self._propfind(request)
+        if method == 'REPORT':
+            return self._report(request)
+        if method == 'GET':
+            if path not in self.resources:
+                return 404, {}, b''
+            etag, data = self.resources[path]
+            return 200, {'ETag': etag}, data
+        if method == 'PUT':
+            if_match = request.headers.get('If-Match')
+            if_none_match = request.headers.get('If-None-Match')
+            current = self.resources.get(path)
+            if if_none_match == '*' and current is not None:
+                return 412, {}, b''
+            if if_match and (current is None or current[0] != if_match):
+                return 412, {}, b''
+            etag = self._store(path, request.body)
+            headers = {'ETag': etag} if self.etag_on_put else {}
+            return 201 if current is None else 204, headers, b''
+        if method == 'DELETE':
+            if path not in self.resources:
+                return 404, {}, b''
+            if_match = request.headers.get('If-Match')
+            if if_match and self.resources[path][0] != if_match:
+                return 412, {}, b''
+            self._remove(path)
+            return 204, {}, b''
+        return 405, {}, b''
+
+    def _multistatus(self, responses):
+        root = ET.Element('{%s}multistatus' % NS_DAV)
+        for href, props, status in responses:
+            response = ET.SubElement(root, '{%s}response' % NS_DAV)
+            ET.SubElement(response, '{%s}href' % NS_DAV).text = href
+            if status is not None:
+                ET.SubElement(response, '{%s}status' % NS_DAV).text = status
+                continue
+            propstat = ET.SubElement(response, '{%s}propstat' % NS_DAV)
+            prop = ET.SubElement(propstat, '{%s}prop' % NS_DAV)
+            for tag, text in props:
+                ET.SubElement(prop, tag).text = text
+            ET.SubElement(propstat, '{%s}status' % NS_DAV).text = \
+                    'HTTP/1.1 200 OK'
+        return root
+
+    def _xml_response(self, root, extra=None):
+        if extra is not None:
+            root.append(extra)
+        body = ET.tostring(root, encoding='utf-8')
+        return 207, {'Content-Type': 'application/xml; charset=utf-8'}, body
+
+    def _propfind(self, request):
+        if request.path in self.resources:
+            etag = self.resources[request.path][0]
+            responses = [(request.path, [('{%s}getetag' % NS_DAV, etag)], None)]
+            return self._xml_response(self._multistatus(responses))
+        if request.path != self.COLLECTION:
+            return 404, {}, b''
+        if request.headers.get('Depth', '0') == '0':
+            props = [('{%s}getctag' % NS_CALSERVER, str(self.revision))]
+            if self.support_sync_collection:
+                props.append(('{%s}sync-token' % NS_DAV, self._token()))
+            responses = [(self.COLLECTION, props, None)]
+        else:
+            responses = [(href, [('{%s}getetag' % NS_DAV, etag)], None)
+                    for href, (etag, data) in sorted(self.resources.items())]
+        return self._xml_response(self._multistatus(responses))
+
+    def _report(self, request):
+        query = ET.fromstring(request.body)
+        if query.tag == '{%s}sync-collection' % NS_DAV:
+            if not self.support_sync_collection:
+                return 403, {}, b''
+            token = query.findtext('{%s}sync-token' % NS_DAV) or ''
+            prefix = self._token().rsplit('/', 1)[0] + '/'
+            if token and not token.startswith(prefix):
+                return 403, {}, b''
+            since = int(token[len(prefix):]) if token else 0
+            changed = set(href for revision, href in self.changelog
+                    if revision > since)
+            responses = []
+            for href in sorted(changed):
+                if href in self.resources:
+                    etag = self.resources[href][0]
+                    responses.append((href,
+                        [('{%s}getetag' % NS_DAV, etag)], None))
+                else:
+                    responses.append((href, [], 'HTTP/1.1 404 Not Found'))
+            token_element = ET.Element('{%s}sync-token' % NS_DAV)
+            token_element.text = self._token()
+            return self._xml_response(self._multistatus(responses),
+                    token_element)
+
+        if query.tag == '{%s}calendar-multiget' % NS_CALDAV:
+            responses = []
+            for href_element in query.iter('{%s}href' % NS_DAV):
+                href = href_element.text
+                if href in self.resources:
+                    etag, data = self.resources[href]
+                    responses.append((href, [
+                        ('{%s}getetag' % NS_DAV, etag),
+                        ('{%s}calendar-data' % NS_CALDAV,
+                            data.decode('utf-8')),
+                    ], None))
+                else:
+                    responses.append((href, [], 'HTTP/1.1 404 Not Found'))
+            return self._xml_response(self._multistatus(responses))
+
+        return 400, {}, b''
+
+
+class StandInGitHubServer(StandInServer):
+    """
+    Serves the issues of repositories at /repos/OWNER/REPO/issues (and each
+    of them at /repos/OWNER/REPO/issues/NUMBER), and the lists of
+    repositories at /orgs/ORG/repos or /users/USER/repos.
+
+    Like api.github.com, the listing is split into pages of at most 100
+    items, which are linked through the Link header.  It can be filtered
+    with "since", answers If-None-Match with 304 and enforces a rate limit,
+    which 304 responses don't count against.  Set fail_next to answer that
+    many of the following requests with a 502 error.
+    """
+    MAX_PER_PAGE = 100
+    RATE_LIMIT = 5000
+    ISSUES_REGEX = re.compile(r'^/repos/([^/]+/[^/]+)/issues$')
+    ISSUE_REGEX = re.compile(r'^/repos/([^/]+/[^/]+)/issues/(\d+)$')
+    REPOS_REGEX = re.compile(r'^/(orgs|users)/([^/]+)/repos$')
+    EPOCH = datetime.datetime(2020, 1, 1)
+
+    def __init__(self):
+        self.issues = {}  # "owner/repo" -> list of issue dicts
+        self.organizations = set()  # the other owners are users
+        self.fail_next = 0
+        self.clock = 0
+        self.rate_limit_remaining = self.RATE_LIMIT
+        self.rate_limit_reset = int(time.time()) + 3600
+        self.last_status = None
+        self.last_response_size = None  # number of items
+        super().__init__()
+
+    def _tick(self):
+        self.clock += 1
+        moment = self.EPOCH + datetime.timedelta(seconds=self.clock)
+        return moment.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def add_issues(self, repo, count):
+        with self.lock:
+            issues = self.issues.setdefault(repo, [])
+            for number in range(len(issues) + 1, len(issues) + count + 1):
+                issues.append({
+                    'number': number,
+                    'node_id': 'I_%s_%d' % (repo.replace('/', '_'), number),
+                    'title': 'Issue %d' % number,
+                    'state': 'closed' if number % 3 == 0 else 'open',
+                    'body': 'Body of issue %d' % number,
+                    'assignees': [{'login': 'hut'}] if number % 2 else [],
+                    'labels': [],
+                    'milestone': None,
+                    'updated_at': self._tick(),
+                })
+
+    def update_issue(self, repo, number, **changes):
+        """Changes an issue, like somebody on GitHub would."""
+        with self.lock:
+            issue = self.issues[repo][number - 1]
+            issue.update(changes)
+            issue['updated_at'] = self._tick()
+
+    def handle(self, request):
+        status, headers, body = self._handle(request)
+        self.last_status = status
+        if status != 304:
+            self.rate_limit_remaining = max(0, self.rate_limit_remaining - 1)
+        headers['X-RateLimit-Limit'] = str(self.RATE_LIMIT)
+        headers['X-RateLimit-Remaining'] = str(self.rate_limit_remaining)
+        headers['X-RateLimit-Reset'] = str(self.rate_limit_reset)
+        return status, headers, body
+
+    def _handle(self, request):
+        if self.rate_limit_remaining == 0:
+            return 403, {}, b'{"message": "API rate limit exceeded"}'
+        if self.fail_next:
+            self.fail_next -= 1
+            return 502, {}, b''
+        if request.command != 'GET':
+            return 405, {}, b''
+        parsed = urllib.parse.urlsplit(request.path)
+        params = dict(urllib.parse.parse_qsl(parsed.query))
+        not_found = 404, {}, b'{"message": "Not Found"}'
+        match = self.ISSUES_REGEX.match(parsed.path)
+        if match:
+            if match.group(1) not in self.issues:
+                return not_found
+            items = self.issues[match.group(1)]
+            if 'since' in params:
+                items = [issue for issue in items
+                        if issue['updated_at'] >= params['since']]
+            return self._page(request, parsed.path, params, items)
+
+        match = self.ISSUE_REGEX.match(parsed.path)
+        if match:
+            issues = self.issues.get(match.group(1), [])
+            number = int(match.group(2))
+            if not 1 <= number <= len(issues):
+                return not_found
+            body = json.dumps(issues[number - 1]).encode('utf-8')
+            return 200, {'Content-Type': 'application/json; charset=utf-8'}, body
+
+        match = self.REPOS_REGEX.match(parsed.path)
+        if match:
+            kind, owner = match.groups()
+            if (kind == 'orgs') != (owner in self.organizations):
+                return not_found
+            items = [{
+                'full_name': name,
+                'name': name.split('/', 1)[1],
+                'has_issues': True,
+                'archived': False,
+            } for name in sorted(self.issues) if name.startswith(owner + '/')]
+            return self._page(request, parsed.path, params, items)
+        return not_found
+
+    def _page(self, request, path, params, items):
+        per_page = min(int(params.get('per_page', 30)), self.MAX_PER_PAGE)
+        page = int(params.get('page', 1))
+        last_page = max(1, math.ceil(len(items) / per_page))
+        headers = {'Content-Type': 'application/json; charset=utf-8'}
+        links = []
+        for rel, target in (('prev', page - 1), ('next', page + 1),
+                ('first', 1), ('last', last_page)):
+            if 1 <= target <= last_page and target != page:
+                params['page'] = str(target)
+                links.append('<%s%s?%s>; rel="%s"' % (self.url, path,
+                    urllib.parse.urlencode(params), rel))
+        if links:
+            headers['Link'] = ', '.join(links)
+        body = items[(page - 1) * per_page:page * per_page]
+        self.last_response_size = len(body)
+        body = json.dumps(body).encode('utf-8')
+        headers['ETag'] = '"%s"' % hashlib.sha1(body).hexdigest()
+        if request.headers.get('If-None-Match') == headers['ETag']:
+            return 304, {'ETag': headers['ETag']}, b''
+        return 200, headers, body
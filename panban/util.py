@@ -1,7 +1,195 @@
+import bisect
 import re
 
 # Source: https://stackoverflow.com/questions/839994/extracting-a-url-in-python/50790119#50790119
 URL_REGEX = re.compile(r"\b((?:https?://)?(?:(?:www\.)?(?:[\da-z\.-]+)\.(?:[a-z]{2,6})|(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)|(?:(?:[0-9a-fA-F]{1,4}:){7,7}[0-9a-fA-F]{1,4}|(?:[0-9a-fA-F]{1,4}:){1,7}:|(?:[0-9a-fA-F]{1,4}:){1,6}:[0-9a-fA-F]{1,4}|(?:[0-9a-fA-F]{1,4}:){1,5}(?::[0-9a-fA-F]{1,4}){1,2}|(?:[0-9a-fA-F]{1,4}:){1,4}(?::[0-9a-fA-F]{1,4}){1,3}|(?:[0-9a-fA-F]{1,4}:){1,3}(?::[0-9a-fA-F]{1,4}){1,4}|(?:[0-9a-fA-F]{1,4}:){1,2}(?::[0-9a-fA-F]{1,4}){1,5}|[0-9a-fA-F]{1,4}:(?:(?::[0-9a-fA-F]{1,4}){1,6})|:(?:(?::[0-9a-fA-F]{1,4}){1,7}|:)|fe80:(?::[0-9a-fA-F]{0,4}){0,4}%[0-9a-zA-Z]{1,}|::(?:ffff(?::0{1,4}){0,1}:){0,1}(?:(?:25[0-5]|(?:2[0-4]|1{0,1}[0-9]){0,1}[0-9])\.){3,3}(?:25[0-5]|(?:2[0-4]|1{0,1}[0-9]){0,1}[0-9])|(?:[0-9a-fA-F]{1,4}:){1,4}:(?:(?:25[0-5]|(?:2[0-4]|1{0,1}[0-9]){0,1}[0-9])\.){3,3}(?:25[0-5]|(?:2[0-4]|1{0,1}[0-9]){0,1}[0-9])))(?::[0-9]{1,4}|[1-5][0-9]{4}|6[0-4][0-9]{3}|65[0-4][0-9]{2}|655[0-2][0-9]|6553[0-5])?(?:/[\w\.-]*)*/?)\b")
+REPETITION_REGEX = re.compile(r'\{\d*,?\d*\}')
+# Escapes that take arguments, like \x41, \012, \1, \u00e9 and \N{EM DASH}
+ESCAPE_ARGUMENTS_REGEX = re.compile(r'x[0-9a-fA-F]{0,2}|u[0-9a-fA-F]{0,4}|'
+        r'U[0-9a-fA-F]{0,8}|N\{[^}]*\}?|0[0-7]{0,2}|[0-7]{3}|[1-9]\d?')
 
 def extract_urls(text):
     return URL_REGEX.findall(text)
+
+
+def normalize_for_search(text):
+    """
+    Folds the case of the text like re.IGNORECASE would, for the trigram
+    index.  The result may match more than the regex, but never less.
+
+    >>> normalize_for_search('Straße, DIY')
+    'strasse, diy'
+    """
+    # Python's regular expressions treat the dotless i like an i
+    return text.casefold().replace('\u0131', 'i')
+
+
+def trigrams(text):
+    """
+    >>> sorted(trigrams('hello'))
+    ['ell', 'hel', 'llo']
+    """
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+def required_substrings(pattern):
+    r"""
+    Returns substrings that every match of the regular expression contains.
+
+    The pattern is only roughly parsed, so this errs on the side of
+    returning fewer substrings.  Groups are skipped, and patterns with
+    alternatives or extensions like (?x) give an empty list.
+
+    >>> required_substrings('fix bug')
+    ['fix bug']
+    >>> required_substrings(r'^fix.*bugs?$')
+    ['fix', 'bug']
+    >>> required_substrings(r'v1\.2 (alpha|beta)+ [a-z]{2}x')
+    ['v1.2 ', ' ', 'x']
+    >>> required_substrings(r'ab+c\d')
+    ['ab', 'c']
+    >>> required_substrings('foo|bar'), required_substrings('(?x)foo bar')
+    ([], [])
+    >>> required_substrings(r'\x41bc'), required_substrings(r'\012abc')
+    (['bc'], ['abc'])
+    >>> required_substrings(r'\u00e9t\u00e9')
+    ['t']
+    >>> required_substrings(r'\N{EM DASH}ab')
+    ['ab']
+    """
+    if '(?' in pattern:
+        return []
+
+    substrings = []
+    current = ''
+    depth = 0
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        literal = None
+        if char == '\\':
+            escaped = pattern[i + 1:i + 2]
+            if escaped and not escaped.isalnum():
+                literal = escaped
+            arguments = ESCAPE_ARGUMENTS_REGEX.match(pattern, i + 1)
+            if arguments:
+                i = arguments.end()
+            else:
+                i += 2
+        elif char == '[':
+            # Skip the character class
+            i += 1
+            if pattern[i:i + 1] == '^':
+                i += 1
+            if pattern[i:i + 1] == ']':
+                i += 1
+            while i < len(pattern) and pattern[i] != ']':
+                i += 2 if pattern[i] == '\\' else 1
+            i += 1
+        elif REPETITION_REGEX.match(pattern, i):
+            i = REPETITION_REGEX.match(pattern, i).end()
+        elif char == '|' and depth == 0:
+            return []
+        else:
+            if char == '(':
+                depth += 1
+            elif char == ')':
+                depth -= 1
+            elif char not in '.^$*+?{}|':
+                literal = char
+            i += 1
+
+        quantifier = pattern[i:i + 1]
+        if literal is not None and depth == 0 and quantifier not in ('*', '?', '{'):
+            current += literal
+            if quantifier != '+':
+                continue
+        if current:
+            substrings.append(current)
+            current = ''
+    if current:
+        substrings.append(current)
+    return substrings
+
+
+class SortedIndex(object):
+    """
+    Keeps items ordered by key(item), identified by their "id" attribute.
+
+    Adding, moving or removing a single item takes a binary search instead of
+    sorting all items again.  The key of each item is remembered, so items
+    may be modified in place before they are passed to update().
+
+    >>> class Item(object):
+    ...     def __init__(self, id, prio):
+    ...         self.id, self.prio = id, prio
+    ...     def __repr__(self):
+    ...         return self.id
+    >>> a, b, c = Item('a', 1), Item('b', 3), Item('c', 2)
+    >>> index = SortedIndex(lambda item: -item.prio, [a, b, c])
+    >>> list(index)
+    [b, c, a]
+    >>> a.prio = 5
+    >>> index.update(a)
+    >>> list(index)
+    [a, b, c]
+    >>> index.select({'a', 'c', 'x'}, reverse=True)
+    [c, a]
+    >>> index.discard('b')
+    >>> list(reversed(index)), len(index), 'b' in index
+    ([c, a], 2, False)
+    """
+
+    def __init__(self, key, items=()):
+        self.key = key
+        self._keys = {}  # id -> key
+        self._items = {}  # id -> item
+        for item in items:
+            self._keys[item.id] = key(item)
+            self._items[item.id] = item
+        self._entries = sorted((item_key, item_id)  # (key, id)
+                for item_id, item_key in self._keys.items())
+
+    def update(self, item):
+        """Adds the item, or moves it to its new position."""
+        self.discard(item.id)
+        item_key = self.key(item)
+        bisect.insort(self._entries, (item_key, item.id))
+        self._keys[item.id] = item_key
+        self._items[item.id] = item
+
+    def discard(self, item_id):
+        if item_id not in self._items:
+            return
+        item_key = self._keys.pop(item_id)
+        del self._items[item_id]
+        del self._entries[bisect.bisect_left(self._entries, (item_key, item_id))]
+
+    def select(self, item_ids, reverse=False):
+        """Returns a list of the items whose IDs are in the given set."""
+        if len(item_ids) < len(self._entries):
+            entries = sorted((self._keys[item_id], item_id)
+                    for item_id in item_ids if item_id in self._items)
+            items = [self._items[item_id] for _, item_id in entries]
+        else:
+            items = [item for item in self if item.id in item_ids]
+        if reverse:
+            items.reverse()
+        return items
+
+    def __contains__(self, item_id):
+        return item_id in self._items
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return (self._items[item_id] for _, item_id in self._entries)
+
+    def __reversed__(self):
+        return (self._items[item_id] for _, item_id in reversed(self._entries))
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
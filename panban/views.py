@@ -0,0 +1,177 @@
+"""
+Saved views, i.e. named filters that select tasks by their properties.
+
+A view is a query of terms that a task has to match all of:
+
+    prio:3          has priority 3, or one of several with e.g. prio:2,3
+    tag:work        has the tag "work"
+    column:Done     is in the column "Done", ignoring case, and with "_" in
+                    place of spaces, e.g. column:in_progress
+    created:7d      was created in the last 7 days
+    completed:7d    was completed in the last 7 days
+    -TERM           does not match the term, e.g. -column:Done
+    WORD            has the word in its label, ignoring case
+
+For example, "prio:3 tag:work -column:Done".  The queries are stored in the
+config directory, so the same views are offered for every source.
+"""
+
+import datetime
+import os
+import tempfile
+
+VIEWS_FILE = os.path.join(os.environ.get('XDG_CONFIG_HOME') or
+        os.path.expanduser('~/.config'), 'panban', 'views')
+DATE_TERMS = ('created', 'completed')
+
+
+def load_views(path=VIEWS_FILE):
+    """Returns the list of saved queries, one per line of the file."""
+    try:
+        with open(path, 'r') as f:
+            lines = [line.strip() for line in f]
+    except OSError:
+        return []
+    return [line for line in lines if line and not line.startswith('#')]
+
+
+def save_views(queries, path=VIEWS_FILE):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        for query in queries:
+            f.write(query + '\n')
+    os.replace(temp_path, path)
+
+
+def parse_query(query):
+    """
+    Returns a list of (negated, kind, argument) tuples of the terms of the
+    query.  Raises ValueError if a term is invalid.
+
+    >>> parse_query('prio:2,3 + -column:Done Bug')
+    [(False, 'prio', (2, 3)), (True, 'column', 'done'), (False, 'word', 'bug')]
+    >>> parse_query('created:7d')
+    [(False, 'created', 7)]
+    >>> parse_query('prio:high')
+    Traceback (most recent call last):
+        ...
+    ValueError: Invalid priority: high
+    """
+    terms = []
+    for word in query.split():
+        if word == '+':
+            continue  # "prio:3 + tag:work" reads better to some
+        negated = word.startswith('-') and len(word) > 1
+        if negated:
+            word = word[1:]
+        kind, _, argument = word.partition(':')
+        if kind == 'prio':
+            try:
+                argument = tuple(int(prio) for prio in argument.split(','))
+            except ValueError:
+                raise ValueError('Invalid priority: %s' % argument)
+        elif kind in DATE_TERMS:
+            try:
+                argument = int(argument[:-1] if argument.endswith('d')
+                        else argument)
+            except ValueError:
+                raise ValueError('Invalid number of days: %s' % argument)
+        elif kind == 'column':
+            argument = argument.lower().replace('_', ' ')
+        elif kind != 'tag':
+            kind, argument = 'word', word.lower()
+        terms.append((negated, kind, argument))
+    return terms
+
+
+class View(object):
+    """
+    The set of IDs of the tasks of a database that match a query.
+
+    The set is computed once by materialize() and then kept up to date by
+    update() with the nodes that changed, so opening a view doesn't have to
+    look at every task.
+
+    >>> from panban.backends import markdown
+    >>> from panban.controller import DatabaseAbstraction
+    >>> directory = tempfile.mkdtemp()
+    >>> source = os.path.join(directory, 'tasks.md')
+    >>> _ = open(source, 'w').write('# Todo\\n\\n- fix bug\\n- write docs\\n'
+    ...     '\\n# Done\\n\\n- buy flowers\\n')
+    >>> db = DatabaseAbstraction(markdown.Handler(), source)
+    >>> db.reload()
+    >>> labels = lambda node_ids: sorted(db.nodes_by_id[node_id].label
+    ...     for node_id in node_ids)
+    >>> labels(db.find_node_ids_by_view('-column:done'))
+    ['fix bug', 'write docs']
+    >>> done = [column for column in db.nodes_by_id.values()
+    ...     if column.label == 'Done'][0]
+    >>> db.find_nodes_by_label('fix bug')[0].move_to_column(done.id)
+    True
+    >>> labels(db.find_node_ids_by_view('-column:done'))
+    ['write docs']
+    """
+
+    def __init__(self, query):
+        self.query = query
+        self.terms = parse_query(query)
+        self.node_ids = None  # None until the view is materialized
+        self._today = None
+
+    def is_outdated(self):
+        """Returns True if the date changed since the view was materialized."""
+        return self._today != datetime.date.today() and \
+                any(kind in DATE_TERMS for _, kind, _ in self.terms)
+
+    def materialize(self, db):
+        self._today = datetime.date.today()
+        self.node_ids = set(node.id for node in db.nodes_by_id.values()
+                if self.matches(node, db))
+
+    def update(self, db, node_ids):
+        """Adds or removes the given nodes, after they changed."""
+        for node_id in node_ids:
+            node = db.nodes_by_id.get(node_id)
+            if node is None:
+                self.node_ids.discard(node_id)
+                continue
+            # The tasks of a renamed column may match the view now, or not
+            children = [db.nodes_by_id[child_id] for child_id in
+                    node.children if child_id in db.nodes_by_id]
+            for changed in [node] + children:
+                if self.matches(changed, db):
+                    self.node_ids.add(changed.id)
+                else:
+                    self.node_ids.discard(changed.id)
+
+    def matches(self, node, db):
+        # Only tasks are shown in views, not boards and columns
+        if not node.parent or node.parent in db.root_node_ids:
+            return False
+        return all(self._matches_term(kind, argument, node, db) != negated
+                for negated, kind, argument in self.terms)
+
+    def _matches_term(self, kind, argument, node, db):
+        if kind == 'prio':
+            return (node.prio or 0) in argument
+        elif kind == 'tag':
+            return argument in node.tags
+        elif kind == 'column':
+            column = db.nodes_by_id.get(node.parent)
+            return column is not None and column.label.lower() == argument
+        elif kind in DATE_TERMS:
+            if kind == 'created':
+                date = node.creation_date
+            else:
+                date = node.completion_date
+            start = self._today - datetime.timedelta(days=argument)
+            return bool(date) and date[:10] >= start.isoformat()
+        else:
+            return argument in node.label.lower()
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
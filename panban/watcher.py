@@ -0,0 +1,229 @@
+"""
+Watches database sources for changes made by other programs.
+
+On Linux, the changes are detected with inotify (through ctypes), elsewhere
+the watched directories are polled with os.stat().  Either way, a background
+thread collects the changed paths and passes them to a callback in batches.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+
+POLL_INTERVAL = 2  # seconds between two scans of the PollingWatcher
+DEBOUNCE_DELAY = 0.2  # seconds to wait for more changes before reporting
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE |
+        IN_CREATE)
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def create_watcher(callback):
+    """
+    Returns an InotifyWatcher if inotify is available, else a PollingWatcher.
+    """
+    try:
+        return InotifyWatcher(callback)
+    except OSError:
+        return PollingWatcher(callback)
+
+
+class Watcher(object):
+    """
+    Base class of the watchers.
+
+    Call watch_directory() and watch_file() for every source, then start().
+    The callback is called from the watcher thread with a set of paths.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self._watches = {}  # directory -> (set of file names or None, suffix)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def watch_directory(self, path, suffix=''):
+        """Watch all files in the directory whose name ends with suffix."""
+        path = os.path.abspath(path)
+        with self._lock:
+            self._watches[path] = (None, suffix)
+        self._add_watch(path)
+
+    def watch_file(self, path):
+        # Many editors save files by renaming a temporary file, so we watch
+        # the parent directory and filter by the file name.
+        directory, filename = os.path.split(os.path.abspath(path))
+        with self._lock:
+            filenames, suffix = self._watches.get(directory, (set(), ''))
+            if filenames is not None:
+                filenames.add(filename)
+            self._watches[directory] = (filenames, suffix)
+        self._add_watch(directory)
+
+    def _add_watch(self, directory):
+        pass
+
+    def _is_relevant(self, directory, filename):
+        with self._lock:
+            if directory not in self._watches:
+                return False
+            filenames, suffix = self._watches[directory]
+        if filenames is None:
+            return filename.endswith(suffix) and not filename.startswith('.')
+        return filename in filenames
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        raise NotImplementedError("Please override this method!")
+
+
+class PollingWatcher(Watcher):
+    def __init__(self, callback, interval=POLL_INTERVAL):
+        super().__init__(callback)
+        self.interval = interval
+        self._fingerprints = {}
+
+    def _add_watch(self, directory):
+        self._fingerprints.update(self._scan(directory))
+
+    def _scan(self, directory):
+        fingerprints = {}
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            return fingerprints
+        for entry in entries:
+            if self._is_relevant(directory, entry.name):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                fingerprints[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        return fingerprints
+
+    def poll(self):
+        """
+        Returns the set of paths that changed since the last poll.
+
+        >>> import tempfile
+        >>> directory = tempfile.mkdtemp()
+        >>> watcher = PollingWatcher(callback=None)
+        >>> watcher.watch_directory(directory, suffix='.ics')
+        >>> for filename in ('task.ics', 'notes.txt'):
+        ...     _ = open(os.path.join(directory, filename), 'w').write('x')
+        >>> [os.path.basename(path) for path in watcher.poll()]
+        ['task.ics']
+        >>> watcher.poll()
+        set()
+        """
+        with self._lock:
+            directories = list(self._watches)
+        new_fingerprints = {}
+        for directory in directories:
+            new_fingerprints.update(self._scan(directory))
+        old_fingerprints = self._fingerprints
+        self._fingerprints = new_fingerprints
+        return set(path for path in set(old_fingerprints) | set(new_fingerprints)
+                if old_fingerprints.get(path) != new_fingerprints.get(path))
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            changed = self.poll()
+            if changed:
+                self.callback(changed)
+
+
+class InotifyWatcher(Watcher):
+    def __init__(self, callback):
+        library = ctypes.util.find_library('c')
+        if library is None:
+            raise OSError('libc not found')
+        self._libc = ctypes.CDLL(library, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError('inotify is not supported')
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._directories_by_wd = {}
+        self._stop_pipe = os.pipe()
+        super().__init__(callback)
+
+    def _add_watch(self, directory):
+        if directory in self._directories_by_wd.values():
+            return
+        wd = self._libc.inotify_add_watch(self._fd,
+                os.fsencode(directory), INOTIFY_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed',
+                    directory)
+        self._directories_by_wd[wd] = directory
+
+    def stop(self):
+        super().stop()
+        os.write(self._stop_pipe[1], b'.')
+
+    def _read_events(self):
+        changed = set()
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                directory = self._directories_by_wd.get(wd)
+                if directory is not None and name and \
+                        self._is_relevant(directory, name):
+                    changed.add(os.path.join(directory, name))
+
+    def _run(self):
+        try:
+            while not self._stopped.is_set():
+                readable, _, _ = select.select([self._fd, self._stop_pipe[0]], [], [])
+                if self._stop_pipe[0] in readable:
+                    break
+                changed = self._read_events()
+
+                # Collect the events of a burst of writes into a single batch
+                deadline = time.time() + DEBOUNCE_DELAY
+                while True:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    readable, _, _ = select.select([self._fd], [], [], remaining)
+                    if readable:
+                        changed |= self._read_events()
+
+                if changed:
+                    self.callback(changed)
+        finally:
+            os.close(self._fd)
+            for fd in self._stop_pipe:
+                os.close(fd)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()